@@ -8,4 +8,10 @@ pip install -r requirements.txt
 python manage.py collectstatic --no-input
 
 # Aplicar migraciones a la base de datos de la nube
-python manage.py migrate
\ No newline at end of file
+python manage.py migrate
+
+# Contar las consultas que existían antes de la migración 0013 (o importadas con bulk_create)
+python manage.py reconstruir_estadisticas --si-faltan
+
+# Indexar para búsqueda las consultas que existían antes de la migración 0017
+python manage.py reconstruir_busqueda --si-faltan
\ No newline at end of file
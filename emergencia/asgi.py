@@ -12,5 +12,12 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'emergencia.settings')
+# Activa la cadena de middleware async y las vistas de async_views.py
+os.environ.setdefault('EMERGENCIA_ASGI', '1')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from webEmergencia.middleware import EstaticosASGI  # noqa: E402 (necesita Django configurado)
+
+# Los estáticos los sirve WhiteNoise fuera de la cadena de middleware (que queda toda async)
+application = EstaticosASGI(django_application)
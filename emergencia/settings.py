@@ -45,6 +45,68 @@ REST_FRAMEWORK = {
     ]
 }
 
+# Segundos que PrincipalMiddleware mantiene el rol del usuario cacheado en sesión
+PRINCIPAL_CACHE_SECONDS = 300
+
+# Control de presupuesto de consultas SQL por vista (webEmergencia.query_budget):
+# 'raise' en tests, 'warn' registra un warning, 'off' lo desactiva
+QUERY_BUDGET_MODE = 'warn' if DEBUG else 'off'
+
+# Catálogo local de medicamentos (python manage.py importar_medicamentos)
+MEDICAMENTOS_INDEX_PATH = os.path.join(BASE_DIR, 'medicamentos.idx')
+# Consultar la API de OpenFDA sólo mientras no haya catálogo local importado
+MEDICAMENTOS_OPENFDA_FALLBACK = True
+MEDICAMENTOS_OPENFDA_URL = 'https://api.fda.gov/drug/label.json'
+# Caché de respuestas de OpenFDA por prefijo (segundos / cantidad de prefijos)
+MEDICAMENTOS_CACHE_TTL = 3600
+MEDICAMENTOS_CACHE_STALE = 86400
+MEDICAMENTOS_CACHE_MAX = 5000
+MEDICAMENTOS_OPENFDA_TIMEOUT = 5
+# Marcas distintas pedidas por prefijo (sólo el conteo, no las etiquetas); con menos filas que esto
+# la respuesta está completa y sirve para los prefijos más largos sin volver a OpenFDA
+MEDICAMENTOS_OPENFDA_LIMITE = 100
+
+# True cuando el proceso corre con emergencia.asgi (uvicorn): las vistas con I/O
+# de red (buscar-medicamentos) se sirven con su versión async de async_views.py
+ASGI_ASYNC = os.environ.get('EMERGENCIA_ASGI') == '1'
+
+# Cambios de estado de consultas por Server-Sent Events (webEmergencia/eventos.py)
+EVENTOS_SSE_INTERVALO = 1.0     # segundos entre lecturas de eventos nuevos (ASGI)
+EVENTOS_SSE_LATIDO = 20         # segundos entre comentarios keep-alive (ASGI)
+EVENTOS_SSE_RETRY_MS = 3000     # espera del navegador antes de reconectar (WSGI: cada cuánto pregunta)
+EVENTOS_SSE_SOLAPE_SEGUNDOS = 10  # cada lectura relee este margen (ids que confirman fuera de orden)
+EVENTOS_RETENCION_HORAS = 24
+
+# Fragmentos HTML de mis_documentos en el caché por defecto (webEmergencia/documentos.py).
+# Sin CACHES es LocMemCache, uno por proceso; con varios workers conviene Redis o Memcached
+DOCUMENTOS_CACHE_TTL = 7 * 86400
+
+# Sincronización incremental de consultas (webEmergencia/sincronizacion.py)
+SYNC_SOLAPE_SEGUNDOS = 60       # ?since= relee este margen (transacciones que confirman tarde)
+SYNC_RETENCION_DIAS = 30        # lápidas guardadas; una marca más vieja responde 410
+
+# Cola de tareas en segundo plano (webEmergencia/tareas.py, python manage.py trabajar_tareas)
+TAREAS_MAX_INTENTOS = 5
+TAREAS_TIEMPO_MAXIMO = 300      # segundos antes de que otro trabajador retome una tarea en curso
+TAREAS_BACKOFF_BASE = 10        # segundos del primer reintento; se duplica en cada uno (con jitter)
+TAREAS_BACKOFF_MAX = 3600
+TAREAS_RETENCION_DIAS = 7       # las tareas hechas se borran después de esto; las fallidas quedan
+# Sin un trabajador corriendo (TAREAS_TRABAJADOR=1 lo declara) cada tarea se ejecuta en el proceso
+# que la encoló, al confirmar su transacción; así los controles crónicos no quedan olvidados en la cola
+TAREAS_EN_LINEA = os.environ.get('TAREAS_TRABAJADOR') != '1'
+
+# Recordatorios de citas (webEmergencia/recordatorios.py, python manage.py enviar_recordatorios)
+RECORDATORIOS_NIVELES = {'24h': 24 * 3600, '1h': 3600}     # nombre: segundos de anticipación
+# ConsolaBackend (stdout), ArchivoBackend (NDJSON en RECORDATORIOS_ARCHIVO) o CorreoBackend (EMAIL_BACKEND)
+RECORDATORIOS_BACKEND = os.environ.get('RECORDATORIOS_BACKEND', 'webEmergencia.recordatorios.ConsolaBackend')
+RECORDATORIOS_ARCHIVO = os.environ.get('RECORDATORIOS_ARCHIVO', 'recordatorios.ndjson')
+RECORDATORIOS_PLAZO_ENVIO = 300     # segundos en_envio antes de devolver a pendiente (demonio caído)
+
+# Lecturas de seguimiento de dispositivos (webEmergencia/seguimiento.py)
+SEGUIMIENTO_MAX_LOTE = 5000         # lecturas por envío
+SEGUIMIENTO_COPY_MINIMO = 1000      # en PostgreSQL, lotes desde este tamaño se cargan con COPY
+SEGUIMIENTO_PUNTOS_MAXIMO = 2000    # tope de ?puntos= al leer; sobre eso se agrupa por intervalos
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -66,10 +128,22 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'webEmergencia.middleware.PrincipalMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+if ASGI_ASYNC:
+    # WhiteNoiseMiddleware sólo es síncrono y haría correr cada petición entera en un hilo;
+    # bajo ASGI los estáticos los sirve emergencia.asgi (webEmergencia.middleware.EstaticosASGI)
+    MIDDLEWARE.remove('whitenoise.middleware.WhiteNoiseMiddleware')
+
+# Pruebas de carga (python manage.py prueba_carga): con CONTAR_CONSULTAS_SQL=1 cada respuesta
+# trae X-Consultas-SQL con las consultas SQL que hizo la petición
+CONTAR_CONSULTAS_SQL = os.environ.get('CONTAR_CONSULTAS_SQL') == '1'
+if CONTAR_CONSULTAS_SQL:
+    MIDDLEWARE.insert(0, 'webEmergencia.middleware.ConsultasSQLMiddleware')
+
 ROOT_URLCONF = 'emergencia.urls'
 
 TEMPLATES = [
@@ -100,7 +174,8 @@ if 'DATABASE_URL' in os.environ:
     # Render nos pasa la base de datos automáticamente por la variable DATABASE_URL
     DATABASES = {
         'default': dj_database_url.config(
-            conn_max_age=600,
+            # Bajo ASGI las conexiones persistentes quedan atadas a hilos de sync_to_async: mejor un pool externo
+            conn_max_age=0 if ASGI_ASYNC else 600,
             conn_health_checks=True,
         )
     }
@@ -117,6 +192,14 @@ else:
         }
     }
 
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # Con varios hilos o workers escribiendo (runserver, gunicorn, prueba_carga), las transacciones
+    # toman el bloqueo de escritura al empezar y esperan su turno en vez de fallar con "database is locked"
+    DATABASES['default'].setdefault('OPTIONS', {}).update({'transaction_mode': 'IMMEDIATE', 'timeout': 20})
+    # La base de pruebas en memoria compartida responde "table is locked" sin esperar el timeout;
+    # en un archivo, las pruebas con varios hilos (TransicionesConcurrentesTests) esperan su turno
+    DATABASES['default'].setdefault('TEST', {}).setdefault('NAME', str(BASE_DIR / 'test_emergencia.sqlite3'))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
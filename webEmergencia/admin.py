@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Persona, Paciente, Especialista, Consulta, Seguimiento
+from .models import Persona, Paciente, Especialista, Consulta, Seguimiento, HorarioEspecialista
 from django.contrib.auth.hashers import make_password
 
 
@@ -24,4 +24,5 @@ admin.site.register(Persona, PersonaAdmin)
 admin.site.register(Paciente)
 admin.site.register(Especialista)
 admin.site.register(Consulta)
-admin.site.register(Seguimiento)
\ No newline at end of file
+admin.site.register(Seguimiento)
+admin.site.register(HorarioEspecialista)
@@ -0,0 +1,229 @@
+"""Agenda de especialistas: horarios, detección de choques y búsqueda de cupos libres.
+
+Cada cita aceptada ocupa [fecha_inicio, fecha_fin). Como ninguna cita dura más
+que DURACION_MAXIMA, las que chocan con un intervalo nuevo sólo pueden empezar
+en (inicio - DURACION_MAXIMA, fin): un rango sobre el índice
+(especialista_asignado, estado, fecha_inicio), O(log n) más las pocas filas del rango.
+
+Los cupos libres se calculan por especialista y bloque de atención con un mapa
+de bits (un int, un bit por cupo). Las citas de varios días se leen en una sola
+consulta; las de cada bloque se ubican con bisect y se marcan sus bits.
+"""
+import bisect
+import heapq
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Consulta, Especialista, HorarioEspecialista
+from .transiciones import aplicar
+
+
+# Estados en los que una cita ocupa la agenda del especialista
+ESTADOS_OCUPAN = ('aceptada',)
+
+DURACION_MINIMA = timedelta(minutes=5)
+DURACION_MAXIMA = timedelta(minutes=240)
+# Para citas sin fecha_fin (creadas antes de la agenda o por otras vías)
+DURACION_DEFECTO = timedelta(minutes=30)
+
+# Días leídos por consulta al buscar cupos
+VENTANA_DIAS = 7
+
+# Horario de quien no tiene HorarioEspecialista: lunes a viernes, 09-13 y 14-18
+HORARIO_DEFECTO = [
+    (dia, time(9), time(13)) for dia in range(5)
+] + [
+    (dia, time(14), time(18)) for dia in range(5)
+]
+
+
+class ConflictoAgenda(Exception):
+    def __init__(self, mensaje, consulta_id=None):
+        super().__init__(mensaje)
+        self.mensaje = mensaje
+        self.consulta_id = consulta_id
+
+
+def duracion_cita(minutos):
+    """Duración configurada por el especialista, acotada a [DURACION_MINIMA, DURACION_MAXIMA]"""
+    return min(max(timedelta(minutes=minutos or 0), DURACION_MINIMA), DURACION_MAXIMA)
+
+
+def choques(especialista_id, inicio, fin, excluir=None):
+    """Citas del especialista que se solapan con [inicio, fin)"""
+    consultas = Consulta.objects.filter(
+        especialista_asignado_id=especialista_id,
+        estado__in=ESTADOS_OCUPAN,
+        fecha_inicio__gt=inicio - DURACION_MAXIMA,
+        fecha_inicio__lt=fin,
+    ).filter(
+        Q(fecha_fin__gt=inicio) | Q(fecha_fin__isnull=True, fecha_inicio__gt=inicio - DURACION_DEFECTO)
+    )
+    if excluir is not None:
+        consultas = consultas.exclude(pk=excluir)
+    return consultas
+
+
+def fin_sin_choques(consulta, especialista_id, inicio, minutos):
+    """fecha_fin de la cita si empieza en `inicio`; ConflictoAgenda si choca con otra aceptada"""
+    if inicio is None:
+        return None
+    fin = inicio + duracion_cita(minutos)
+    choque = (
+        choques(especialista_id, inicio, fin, excluir=consulta.pk)
+        .order_by('fecha_inicio').values('id', 'fecha_inicio').first()
+    )
+    if choque:
+        hora = timezone.localtime(choque['fecha_inicio']).strftime('%d/%m/%Y %H:%M')
+        raise ConflictoAgenda(f'Ya tienes una cita aceptada que se cruza con este horario ({hora})', choque['id'])
+    return fin
+
+
+def reprogramar(consulta, inicio):
+    """fecha_fin para mover la cita a `inicio`; si está aceptada, recalcula su bloque y revisa choques.
+
+    Llamar dentro de transaction.atomic() y guardar en la misma transacción: el bloqueo del
+    especialista serializa el cambio con las aceptaciones (reservar).
+    """
+    if consulta.estado not in ESTADOS_OCUPAN or consulta.especialista_asignado_id is None:
+        return consulta.fecha_fin
+    minutos = (
+        Especialista.objects.select_for_update()
+        .values_list('duracion_cita', flat=True).get(pk=consulta.especialista_asignado_id)
+    )
+    return fin_sin_choques(consulta, consulta.especialista_asignado_id, inicio, minutos)
+
+
+def reservar(consulta, especialista):
+    """Asigna y acepta la consulta si el especialista tiene libre ese bloque; si no, ConflictoAgenda"""
+    with transaction.atomic():
+        # Serializa las aceptaciones de un mismo especialista (dos pestañas, dos clics)
+        minutos = Especialista.objects.select_for_update().values_list('duracion_cita', flat=True).get(pk=especialista.pk)
+
+        fin = fin_sin_choques(consulta, especialista.pk, consulta.fecha_inicio, minutos)
+
+        # UPDATE condicional: si otro médico la aceptó primero, no se pisa su asignación
+        actualizadas = aplicar(
+            'aceptar', Consulta.objects.filter(pk=consulta.pk), especialista_asignado=especialista, fecha_fin=fin,
+        )
+        if not actualizadas:
+            raise ConflictoAgenda('La consulta ya fue tomada por otro médico o cambió de estado', consulta.pk)
+        consulta.estado = 'aceptada'
+        consulta.especialista_asignado = especialista
+        consulta.fecha_fin = fin
+    return consulta
+
+
+def horarios_de(especialista_ids):
+    """{especialista_id: {dia_semana: [(hora_inicio, hora_fin), ...]}} en una consulta"""
+    horarios = {pk: defaultdict(list) for pk in especialista_ids}
+    configurados = set()
+    for esp_id, dia, hora_inicio, hora_fin in HorarioEspecialista.objects.filter(
+        especialista_id__in=especialista_ids,
+    ).order_by('hora_inicio').values_list('especialista_id', 'dia_semana', 'hora_inicio', 'hora_fin'):
+        horarios[esp_id][dia].append((hora_inicio, hora_fin))
+        configurados.add(esp_id)
+
+    defecto = getattr(settings, 'AGENDA_HORARIO_DEFECTO', HORARIO_DEFECTO)
+    for esp_id in set(especialista_ids) - configurados:
+        for dia, hora_inicio, hora_fin in defecto:
+            horarios[esp_id][dia].append((hora_inicio, hora_fin))
+    return horarios
+
+
+def mapa_ocupacion(inicio, duracion, cupos, ocupadas, inicios):
+    """Bit i encendido si el cupo i del bloque choca con alguna cita.
+
+    `ocupadas` son pares (inicio, fin) ordenados y `inicios` sus inicios, para bisect.
+    """
+    fin = inicio + cupos * duracion
+    mapa = 0
+    desde = bisect.bisect_right(inicios, inicio - DURACION_MAXIMA)
+    hasta = bisect.bisect_left(inicios, fin)
+    for ocupada_inicio, ocupada_fin in ocupadas[desde:hasta]:
+        if ocupada_fin <= inicio:
+            continue
+        primero = max(0, (ocupada_inicio - inicio) // duracion)
+        ultimo = min(cupos, -(-(ocupada_fin - inicio) // duracion))
+        if ultimo > primero:
+            mapa |= ((1 << (ultimo - primero)) - 1) << primero
+    return mapa
+
+
+def cupos_del_dia(especialista, dia, bloques, ocupadas, inicios, desde):
+    """Cupos libres de un especialista en un día, en orden"""
+    duracion = duracion_cita(especialista.duracion_cita)
+    zona = timezone.get_current_timezone()
+    for hora_inicio, hora_fin in bloques:
+        inicio = timezone.make_aware(datetime.combine(dia, hora_inicio), zona)
+        fin = timezone.make_aware(datetime.combine(dia, hora_fin), zona)
+        cupos = (fin - inicio) // duracion
+        if cupos <= 0:
+            continue
+        mapa = mapa_ocupacion(inicio, duracion, cupos, ocupadas, inicios)
+        if desde > inicio:
+            # Los cupos que ya empezaron cuentan como ocupados
+            pasados = min(cupos, -(-(desde - inicio) // duracion))
+            mapa |= (1 << pasados) - 1
+        for i in range(cupos):
+            if not mapa >> i & 1:
+                cupo_inicio = inicio + i * duracion
+                yield cupo_inicio, especialista.pk, cupo_inicio + duracion
+
+
+def cupos_libres(especialidad, cantidad=5, desde=None, dias=30, especialista_id=None):
+    """Los próximos `cantidad` cupos libres de cualquier especialista de `especialidad`
+    (o sólo de `especialista_id`).
+
+    Lee los horarios una vez y las citas de VENTANA_DIAS días por consulta.
+    """
+    desde = desde or timezone.now()
+    especialistas = Especialista.objects.filter(especialidad=especialidad).select_related('fk_rutp')
+    if especialista_id is not None:
+        especialistas = especialistas.filter(pk=especialista_id)
+    especialistas = {e.pk: e for e in especialistas}
+    if not especialistas:
+        return []
+    horarios = horarios_de(list(especialistas))
+    zona = timezone.get_current_timezone()
+    primer_dia = timezone.localtime(desde, zona).date()
+
+    resultados = []
+    for offset in range(0, dias, VENTANA_DIAS):
+        dias_ventana = [primer_dia + timedelta(days=offset + i) for i in range(min(VENTANA_DIAS, dias - offset))]
+        ventana_inicio = timezone.make_aware(datetime.combine(dias_ventana[0], time.min), zona)
+        ventana_fin = timezone.make_aware(datetime.combine(dias_ventana[-1] + timedelta(days=1), time.min), zona)
+
+        ocupadas = defaultdict(list)
+        for esp_id, inicio, fin in Consulta.objects.filter(
+            especialista_asignado_id__in=list(especialistas),
+            estado__in=ESTADOS_OCUPAN,
+            fecha_inicio__gt=ventana_inicio - DURACION_MAXIMA,
+            fecha_inicio__lt=ventana_fin,
+        ).order_by('fecha_inicio').values_list('especialista_asignado_id', 'fecha_inicio', 'fecha_fin'):
+            ocupadas[esp_id].append((inicio, fin or inicio + DURACION_DEFECTO))
+        inicios = {esp_id: [inicio for inicio, _ in lista] for esp_id, lista in ocupadas.items()}
+
+        for dia in dias_ventana:
+            # Los cupos de cada especialista ya vienen ordenados: se mezclan en orden de hora
+            por_especialista = [
+                cupos_del_dia(esp, dia, horarios[esp_id].get(dia.weekday(), []),
+                              ocupadas[esp_id], inicios.get(esp_id, []), desde)
+                for esp_id, esp in especialistas.items()
+            ]
+            for inicio, esp_id, fin in heapq.merge(*por_especialista):
+                persona = especialistas[esp_id].fk_rutp
+                resultados.append({
+                    'especialista_id': esp_id,
+                    'especialista_nombre': f'{persona.nombre} {persona.apellido}',
+                    'inicio': inicio,
+                    'fin': fin,
+                })
+                if len(resultados) >= cantidad:
+                    return resultados
+    return resultados
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class WebemergenciaConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'webEmergencia'
+
+    def ready(self):
+        # Conecta los receivers de invalidación de caché
+        from . import signals
+        # Registra los handlers de la cola de tareas (tareas.py)
+        from . import finalizacion
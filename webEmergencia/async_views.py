@@ -0,0 +1,43 @@
+"""Versiones async de las vistas que esperan I/O de red.
+
+Sólo se enrutan cuando el proyecto corre bajo ASGI (emergencia.asgi, settings.ASGI_ASYNC).
+Mientras esperan a OpenFDA no ocupan un hilo ni un worker: cada worker uvicorn
+atiende cientos de búsquedas concurrentes con un solo pool de conexiones keep-alive.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+
+from .catalogo import catalogo
+from .eventos import desde_request, flujo_eventos
+from .openfda import get_cache_medicamentos
+
+
+async def buscar_medicamentos_api(request):
+    query = request.GET.get('q', '')
+
+    if not query or len(query) < 2:
+        return JsonResponse([], safe=False)
+
+    # Catálogo local: sin red. La primera carga puede leer la BD, por eso va en un hilo
+    if not await sync_to_async(catalogo.vacio)():
+        return JsonResponse(catalogo.buscar(query, limite=10), safe=False)
+
+    if not getattr(settings, 'MEDICAMENTOS_OPENFDA_FALLBACK', True):
+        return JsonResponse([], safe=False)
+    # Mismo caché que la vista WSGI; si el cliente se desconecta se cancela la llamada a OpenFDA
+    return JsonResponse(await get_cache_medicamentos().abuscar(query, limite=10), safe=False)
+
+
+async def eventos_consultas(request):
+    """Server-Sent Events con los cambios de estado de las consultas, en una conexión larga"""
+    # Resolver el principal puede leer la sesión y la BD
+    es_especialista = await sync_to_async(lambda: request.principal.es_especialista)()
+    if not es_especialista:
+        return JsonResponse({'error': 'Solo los médicos pueden recibir eventos de consultas'}, status=403)
+
+    response = StreamingHttpResponse(flujo_eventos(desde_request(request)), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Evita que nginx acumule el flujo en su buffer
+    response['X-Accel-Buffering'] = 'no'
+    return response
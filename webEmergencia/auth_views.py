@@ -6,8 +6,9 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from django.contrib.auth.hashers import check_password
-from .models import Persona, Paciente, Especialista
+from .models import Persona
 from .auth_serializers import RegistroSerializer
+from .middleware import Principal, guardar_principal
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
@@ -24,26 +25,18 @@ def login_view(request):
         if user_auth is not None:
             login(request, user_auth)
             
-            # Obtener la Persona
-            persona = Persona.objects.get(rut=rut)
-            
-            # Determinar el rol - Verificar Especialista primero (tiene prioridad)
-            rol = "desconocido"
-            try:
-                Especialista.objects.get(fk_rutp=persona)
-                rol = "especialista"
-            except Especialista.DoesNotExist:
-                # Si no es especialista, verificar si es paciente
-                try:
-                    Paciente.objects.get(fk_rut=persona)
-                    rol = "paciente"
-                except Paciente.DoesNotExist:
-                    pass
+            # Obtener la Persona y su rol con una sola consulta
+            principal = Principal.from_db(rut)
+            if not principal.is_authenticated:
+                raise Persona.DoesNotExist
+            persona = principal.persona
+            rol = principal.rol
             
             # Guardar en sesión
             request.session['user_rut'] = persona.rut
             request.session['user_nombre'] = f"{persona.nombre} {persona.apellido}"
             request.session['user_rol'] = rol
+            guardar_principal(request, principal)
             request.session.modified = True
             request.session.save()
             
@@ -65,26 +58,19 @@ def login_view(request):
     except User.DoesNotExist:
         # Si no existe usuario Django, intenta con la contraseña hasheada en Persona
         try:
-            persona = Persona.objects.get(rut=rut)
+            # Persona y rol con una sola consulta
+            principal = Principal.from_db(rut)
+            if not principal.is_authenticated:
+                raise Persona.DoesNotExist
+            persona = principal.persona
             if check_password(contrasena, persona.contrasena):
                 # Guardar datos del usuario en la sesión
                 request.session['user_rut'] = persona.rut
                 request.session['user_nombre'] = f"{persona.nombre} {persona.apellido}"
                 
-                # Determinar rol - Verificar Especialista primero (tiene prioridad)
-                rol = "desconocido"
-                try:
-                    Especialista.objects.get(fk_rutp=persona)
-                    rol = "especialista"
-                except Especialista.DoesNotExist:
-                    # Si no es especialista, verificar si es paciente
-                    try:
-                        Paciente.objects.get(fk_rut=persona)
-                        rol = "paciente"
-                    except Paciente.DoesNotExist:
-                        pass
-                
+                rol = principal.rol
                 request.session['user_rol'] = rol
+                guardar_principal(request, principal)
                 request.session.modified = True
                 request.session.save()
                 
@@ -0,0 +1,205 @@
+"""Búsqueda de texto en consultas: motivo, síntomas y diagnóstico.
+
+ConsultaBusqueda guarda el texto de cada consulta. Sobre esa tabla:
+- PostgreSQL: columna generada `vector` (to_tsvector 'spanish', motivo con peso A,
+  diagnóstico B, síntomas C) con índice GIN; se ordena por ts_rank_cd.
+- SQLite: tabla FTS5 consulta_busqueda_fts (sin acentos) sincronizada por
+  triggers; se ordena por bm25 con los mismos pesos relativos.
+- Otras bases: LIKE sobre ConsultaBusqueda, de la más nueva a la más vieja.
+
+Todas las palabras deben aparecer; la última basta como prefijo (escribir
+"diabet" encuentra "diabetes"). Las páginas siguen por cursor (rango, id), así
+que no se usa OFFSET.
+
+Los save() de Consulta y de Diagnostico avisan vía signals.py y finalizacion.py
+avisa de los diagnósticos de su bulk_create. El resto de los bulk_create
+(importar_pacientes, seed) no: después correr
+`python manage.py reconstruir_busqueda`.
+"""
+import base64
+import binascii
+import re
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from .models import Consulta, ConsultaBusqueda
+
+
+TAMANO_LOTE = 2000
+MAX_TERMINOS = 8
+
+CAMPOS_TEXTO = ('motivo', 'sintomas', 'diagnostico')
+
+CONSULTAS = {
+    'postgresql': '''
+        SELECT id, rango FROM (
+            SELECT "FK_CONSULTA" AS id, ts_rank_cd(vector, consulta) AS rango
+            FROM consulta_busqueda {paciente}, to_tsquery('spanish', %s) AS consulta
+            WHERE vector @@ consulta {de_paciente}
+        ) AS encontradas
+        {despues_de}
+        ORDER BY rango DESC, id DESC
+        LIMIT %s
+    ''',
+    'sqlite': '''
+        SELECT id, rango FROM (
+            SELECT consulta_busqueda_fts.rowid AS id, -bm25(consulta_busqueda_fts, 4.0, 1.0, 2.0) AS rango
+            FROM consulta_busqueda_fts
+            {paciente}
+            WHERE consulta_busqueda_fts MATCH %s {de_paciente}
+        ) AS encontradas
+        {despues_de}
+        ORDER BY rango DESC, id DESC
+        LIMIT %s
+    ''',
+}
+# Sólo las consultas de un paciente: el filtro va dentro de la búsqueda, antes del LIMIT
+DE_PACIENTE = {
+    'postgresql': (
+        'JOIN consulta AS de_paciente ON de_paciente."ID" = consulta_busqueda."FK_CONSULTA"',
+        'AND de_paciente."FK_IDPACIENTE" = %s',
+    ),
+    'sqlite': (
+        'JOIN consulta AS de_paciente ON de_paciente."ID" = consulta_busqueda_fts.rowid',
+        'AND de_paciente."FK_IDPACIENTE" = %s',
+    ),
+}
+# ts_rank_cd es real: el rango del cursor se compara como real
+DESPUES_DE = {
+    'postgresql': 'WHERE rango < %s::real OR (rango = %s::real AND id < %s)',
+    'sqlite': 'WHERE rango < %s OR (rango = %s AND id < %s)',
+}
+
+
+def terminos(texto):
+    return re.findall(r'\w+', (texto or '').lower())[:MAX_TERMINOS]
+
+
+def expresion(palabras, vendor):
+    """Consulta de texto para la base de datos: todas las palabras, la última como prefijo"""
+    if vendor == 'postgresql':
+        return ' & '.join(palabras[:-1] + [f'{palabras[-1]}:*'])
+    return ' '.join([f'"{palabra}"' for palabra in palabras[:-1]] + [f'"{palabras[-1]}"*'])
+
+
+def buscar(texto, limite, despues_de=None, paciente_id=None):
+    """[(consulta_id, rango)] de mayor a menor rango; despues_de es (rango, id) de la última fila ya entregada.
+
+    Con paciente_id sólo busca entre las consultas de ese paciente.
+    """
+    palabras = terminos(texto)
+    if not palabras:
+        return []
+    vendor = connection.vendor
+    if vendor not in CONSULTAS:
+        return _buscar_like(palabras, limite, despues_de, paciente_id)
+
+    params = [expresion(palabras, vendor)]
+    union, de_paciente = '', ''
+    if paciente_id is not None:
+        union, de_paciente = DE_PACIENTE[vendor]
+        params.append(paciente_id)
+    filtro = ''
+    if despues_de is not None:
+        filtro = DESPUES_DE[vendor]
+        params += [despues_de[0], despues_de[0], despues_de[1]]
+    sql = CONSULTAS[vendor].format(paciente=union, de_paciente=de_paciente, despues_de=filtro)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params + [limite])
+        return [(pk, float(rango)) for pk, rango in cursor.fetchall()]
+
+
+def _buscar_like(palabras, limite, despues_de, paciente_id=None):
+    filas = ConsultaBusqueda.objects.all()
+    if paciente_id is not None:
+        filas = filas.filter(consulta__fk_idpaciente_id=paciente_id)
+    for palabra in palabras:
+        filas = filas.filter(
+            Q(motivo__icontains=palabra) | Q(sintomas__icontains=palabra) | Q(diagnostico__icontains=palabra)
+        )
+    if despues_de is not None:
+        filas = filas.filter(consulta_id__lt=despues_de[1])
+    return [(pk, 0.0) for pk in filas.order_by('-consulta_id').values_list('consulta_id', flat=True)[:limite]]
+
+
+def codificar_cursor(rango, pk):
+    return base64.urlsafe_b64encode(f'{rango!r}|{pk}'.encode()).decode('ascii').rstrip('=')
+
+
+def decodificar_cursor(cursor):
+    try:
+        rango, pk = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8').split('|')
+        return float(rango), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValidationError({'error': 'Cursor inválido'})
+
+
+def _documentos(consultas, tamano=None):
+    filas = consultas.values_list(
+        'id', 'motivo', 'sintomas', 'diagnostico', 'diagnostico_data__nombre_enfermedad', 'diagnostico_data__descripcion',
+    )
+    if tamano:
+        filas = filas.iterator(chunk_size=tamano)
+    for pk, motivo, sintomas, diagnostico, enfermedad, descripcion in filas:
+        yield ConsultaBusqueda(
+            consulta_id=pk,
+            motivo=motivo or '',
+            sintomas=sintomas or '',
+            diagnostico=' '.join(texto for texto in (diagnostico, enfermedad, descripcion) if texto),
+        )
+
+
+def _guardar(documentos):
+    ConsultaBusqueda.objects.bulk_create(
+        documentos, update_conflicts=True, unique_fields=['consulta'], update_fields=list(CAMPOS_TEXTO),
+        batch_size=TAMANO_LOTE,
+    )
+
+
+def indexar(ids):
+    """Actualiza el texto buscable de las consultas `ids` (las borradas ya salieron por CASCADE)"""
+    ids = sorted(set(ids))
+    if ids:
+        _guardar(list(_documentos(Consulta.objects.filter(pk__in=ids))))
+
+
+def programar(ids):
+    """Indexa al confirmar la transacción en curso (el diagnóstico y las recetas ya están escritos)"""
+    ids = [pk for pk in ids if pk is not None]
+    if not ids:
+        return
+
+    def indexar_cambios():
+        indexar(ids)
+
+    transaction.on_commit(indexar_cambios, robust=True)
+
+
+def faltan():
+    """True si hay consultas sin texto buscable (recién migrada la 0017, o tras un bulk_create)"""
+    return Consulta.objects.exclude(pk__in=ConsultaBusqueda.objects.values('consulta_id')).exists()
+
+
+def reconstruir(tamano=TAMANO_LOTE):
+    """Vuelve a cargar el texto de todas las consultas en una pasada; devuelve cuántas"""
+    inicio = timezone.now()
+    total = 0
+    with transaction.atomic():
+        ConsultaBusqueda.objects.all().delete()
+        lote = []
+        for documento in _documentos(Consulta.objects.order_by(), tamano):
+            lote.append(documento)
+            if len(lote) >= tamano:
+                ConsultaBusqueda.objects.bulk_create(lote)
+                total += len(lote)
+                lote = []
+        ConsultaBusqueda.objects.bulk_create(lote)
+        total += len(lote)
+
+    # Lo que cambió mientras se leía (con margen para transacciones que confirmaron tarde)
+    indexar(Consulta.objects.filter(actualizado__gte=inicio - timedelta(minutes=1)).values_list('id', flat=True))
+    return total
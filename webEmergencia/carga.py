@@ -0,0 +1,242 @@
+"""Prueba de carga HTTP: sesiones de pacientes y médicos contra un servidor en marcha.
+
+preparar() elige personas sembradas (seed.py) y les crea un usuario Django con
+la contraseña de la semilla, porque la API pide un usuario autenticado. Cada
+usuario virtual corre en su hilo y repite sesiones hasta que se acaba el
+tiempo: login por api/auth/login/ y luego `rondas` recorridos de su rol:
+- paciente: lista sus consultas, abre una, mira los cupos de una especialidad
+  y pide una cita nueva (que después toman los médicos).
+- médico: lista las pendientes de su especialidad, busca un paciente por nombre
+  letra a letra (autocompletar), acepta una de las pendientes y la finaliza.
+
+Cada petición se anota con su endpoint (la ruta con <pk>), duración y estado
+HTTP, y con las consultas SQL si el servidor corre con CONTAR_CONSULTAS_SQL=1
+(cabecera X-Consultas-SQL). Los 409 de dos médicos que aceptan la misma cita
+son parte de la carga; se cuentan como errores sólo los 5xx y las fallas de
+conexión.
+"""
+import abc
+import math
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+import requests
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+from .models import Especialista, Paciente, Persona
+from .seed import CONTRASENA_SEMILLA, ESPECIALIDADES
+
+
+RONDAS = 5
+TIMEOUT = 30
+PAGINA = 20
+
+CABECERA_SQL = 'X-Consultas-SQL'
+MOTIVOS = ['Dolor de cabeza', 'Control', 'Fiebre', 'Dolor abdominal', 'Tos', 'Chequeo']
+
+
+def preparar(prefijo, pacientes, medicos):
+    """RUTs sembrados que van a iniciar sesión: ([rut de paciente], [(rut, especialidad)])"""
+    ruts_pacientes = list(
+        Paciente.objects.filter(fk_rut__rut__startswith=prefijo)
+        .order_by('fk_rut').values_list('fk_rut', flat=True)[:pacientes]
+    )
+    # seed.py reparte las especialidades en orden: los primeros cubren todas
+    datos_medicos = list(
+        Especialista.objects.filter(fk_rutp__rut__startswith=prefijo)
+        .order_by('fk_rutp').values_list('fk_rutp', 'especialidad')[:medicos]
+    )
+    contrasena = make_password(CONTRASENA_SEMILLA)
+    User.objects.bulk_create(
+        [User(username=rut, password=contrasena) for rut in ruts_pacientes + [rut for rut, _ in datos_medicos]],
+        ignore_conflicts=True,
+    )
+    return ruts_pacientes, datos_medicos
+
+
+def limpiar_usuarios(prefijo):
+    """Borra los usuarios de las personas sembradas (antes de seed.limpiar)"""
+    ruts = Persona.objects.filter(rut__startswith=prefijo).values('rut')
+    return User.objects.filter(username__in=ruts).delete()[0]
+
+
+def percentil(ordenados, p):
+    """Percentil p (0-100) por rango más cercano de una lista ya ordenada"""
+    if not ordenados:
+        return None
+    return ordenados[max(0, math.ceil(p / 100 * len(ordenados)) - 1)]
+
+
+def resumir(muestras, duracion):
+    """{'peticiones', 'por_segundo', 'p50_ms', ...} de [(ms, estado, consultas_sql)]"""
+    tiempos = sorted(ms for ms, _, _ in muestras)
+    sql = [consultas for _, _, consultas in muestras if consultas is not None]
+    estados = Counter(estado for _, estado, _ in muestras)
+    return {
+        'peticiones': len(muestras),
+        'por_segundo': round(len(muestras) / duracion, 2) if duracion else None,
+        'errores': sum(n for estado, n in estados.items() if estado == 0 or estado >= 500),
+        'estados': {str(estado): n for estado, n in sorted(estados.items())},
+        'p50_ms': _redondear(percentil(tiempos, 50)),
+        'p95_ms': _redondear(percentil(tiempos, 95)),
+        'p99_ms': _redondear(percentil(tiempos, 99)),
+        'media_ms': _redondear(sum(tiempos) / len(tiempos)) if tiempos else None,
+        'max_ms': _redondear(tiempos[-1]) if tiempos else None,
+        'sql_media': round(sum(sql) / len(sql), 2) if sql else None,
+        'sql_max': max(sql) if sql else None,
+    }
+
+
+def _redondear(valor):
+    return round(valor, 2) if valor is not None else None
+
+
+class Usuario(abc.ABC):
+    """Un usuario virtual con su propia sesión HTTP (cookies de sesión y CSRF)"""
+
+    def __init__(self, url, rut, semilla, pausa=0):
+        self.url = url.rstrip('/')
+        self.rut = rut
+        self.azar = random.Random(semilla)
+        self.pausa = pausa
+        self.muestras = defaultdict(list)
+        self.sesion = None
+
+    def pedir(self, endpoint, metodo, ruta, **kwargs):
+        """Hace la petición y la anota bajo `endpoint`; None si no hubo respuesta"""
+        cabeceras = {'Referer': self.url + '/'}
+        if metodo != 'GET' and 'csrftoken' in self.sesion.cookies:
+            # SessionAuthentication exige el token CSRF en POST, PUT y DELETE
+            cabeceras['X-CSRFToken'] = self.sesion.cookies['csrftoken']
+        inicio = time.perf_counter()
+        try:
+            respuesta = self.sesion.request(metodo, self.url + ruta, headers=cabeceras, timeout=TIMEOUT, **kwargs)
+        except requests.RequestException:
+            respuesta = None
+        ms = (time.perf_counter() - inicio) * 1000
+        consultas = respuesta.headers.get(CABECERA_SQL) if respuesta is not None else None
+        self.muestras[endpoint].append((
+            ms, respuesta.status_code if respuesta is not None else 0, int(consultas) if consultas else None,
+        ))
+        if self.pausa:
+            time.sleep(self.pausa)
+        return respuesta
+
+    def iniciar_sesion(self):
+        if self.sesion is not None:
+            self.sesion.close()
+        self.sesion = requests.Session()
+        respuesta = self.pedir(
+            'POST /api/auth/login/', 'POST', '/api/auth/login/',
+            json={'rut': self.rut, 'contrasena': CONTRASENA_SEMILLA},
+        )
+        return respuesta is not None and respuesta.status_code == 200
+
+    def correr(self, hasta, rondas=RONDAS):
+        try:
+            while time.monotonic() < hasta:
+                if not self.iniciar_sesion():
+                    # Sin sesión no hay recorrido; se reintenta (queda anotado el login fallido)
+                    time.sleep(0.5)
+                    continue
+                for _ in range(rondas):
+                    if time.monotonic() >= hasta:
+                        break
+                    self.ronda()
+        finally:
+            if self.sesion is not None:
+                self.sesion.close()
+
+    @abc.abstractmethod
+    def ronda(self):
+        """Un recorrido del rol con la sesión ya iniciada"""
+
+    @staticmethod
+    def resultados(respuesta):
+        if respuesta is None or respuesta.status_code != 200:
+            return []
+        return respuesta.json().get('results', [])
+
+
+class SesionPaciente(Usuario):
+    def ronda(self):
+        consultas = self.resultados(self.pedir(
+            'GET /api/consultas/ (paciente)', 'GET', '/api/consultas/', params={'page_size': PAGINA},
+        ))
+        if consultas:
+            pk = self.azar.choice(consultas)['id']
+            self.pedir('GET /api/consultas/<pk>/', 'GET', f'/api/consultas/{pk}/')
+
+        especialidad = self.azar.choice(ESPECIALIDADES)
+        self.pedir('GET /api/agenda/cupos/', 'GET', '/api/agenda/cupos/', params={'especialidad': especialidad, 'n': 5})
+        fecha = timezone.now() + timedelta(minutes=30 * self.azar.randrange(1, 2 * 24 * 60))
+        self.pedir('POST /api/consultas/', 'POST', '/api/consultas/', json={
+            'motivo': self.azar.choice(MOTIVOS),
+            'sintomas': 'Síntomas de prueba de carga',
+            'especialidad': especialidad,
+            'fecha_inicio': fecha.isoformat(),
+        })
+
+
+class SesionMedico(Usuario):
+    def __init__(self, url, rut, semilla, pausa=0, especialidad=None):
+        super().__init__(url, rut, semilla, pausa)
+        self.especialidad = especialidad
+
+    def ronda(self):
+        pendientes = self.resultados(self.pedir(
+            'GET /api/consultas/ (médico, pendientes)', 'GET', '/api/consultas/',
+            params={'estado': 'pendiente', 'especialidad': self.especialidad, 'page_size': PAGINA},
+        ))
+
+        # Autocompletar: una petición por letra desde la tercera
+        nombre = self.azar.choice(pendientes)['paciente_nombre'] if pendientes else 'Paciente1'
+        for largo in range(3, min(len(nombre), 6) + 1):
+            self.pedir('GET /api/personas/buscar/', 'GET', '/api/personas/buscar/', params={'q': nombre[:largo]})
+
+        if not pendientes:
+            return
+        pk = self.azar.choice(pendientes)['id']
+        aceptada = self.pedir(
+            'POST /api/citas-medico/<pk>/gestionar/', 'POST', f'/api/citas-medico/{pk}/gestionar/',
+            json={'accion': 'aceptar'},
+        )
+        if aceptada is None or aceptada.status_code != 200:
+            # Otro médico la tomó antes o se cruza con su agenda (409)
+            return
+        self.pedir('POST /api/consultas/<pk>/finalizar/', 'POST', f'/api/consultas/{pk}/finalizar/', json={
+            'descripcion': 'Diagnóstico de prueba de carga',
+            'es_cronico': False,
+            'recetas': [{'medicamento': 'Paracetamol', 'dosis': '500 mg', 'horario': 'Cada 8 horas'}],
+        })
+
+
+def ejecutar(url, pacientes, medicos, duracion, rondas=RONDAS, pausa=0, semilla=0):
+    """Corre los usuarios virtuales en paralelo; (segundos, {endpoint: [(ms, estado, consultas_sql)]})
+
+    pacientes: [rut]; medicos: [(rut, especialidad)], un hilo por cada uno.
+    """
+    usuarios = [SesionPaciente(url, rut, semilla + i, pausa) for i, rut in enumerate(pacientes)]
+    usuarios += [
+        SesionMedico(url, rut, semilla + len(pacientes) + i, pausa, especialidad)
+        for i, (rut, especialidad) in enumerate(medicos)
+    ]
+    inicio = time.perf_counter()
+    hasta = time.monotonic() + duracion
+    hilos = [threading.Thread(target=usuario.correr, args=(hasta, rondas)) for usuario in usuarios]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    segundos = time.perf_counter() - inicio
+
+    muestras = defaultdict(list)
+    for usuario in usuarios:
+        for endpoint, lista in usuario.muestras.items():
+            muestras[endpoint].extend(lista)
+    return segundos, dict(muestras)
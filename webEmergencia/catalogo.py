@@ -0,0 +1,189 @@
+"""Catálogo local de medicamentos con índice de prefijos en un archivo mapeado en memoria.
+
+El índice es un archivo binario ordenado:
+
+    MEDIDX1\\n | cantidad (uint32) | cantidad offsets (uint32) | registros
+
+cada registro es b'<clave>\\x00<nombre>\\n'. Las claves son palabras normalizadas
+(minúsculas, sin tildes) seguidas del resto del nombre, así "tyl" encuentra
+"Tylenol" y "acet" encuentra "Tylenol" por su genérico acetaminophen.
+
+Buscar es una búsqueda binaria sobre los offsets (O(log n)) y una lectura
+secuencial de las coincidencias. Al abrirse con mmap, todos los workers de
+gunicorn comparten las mismas páginas del archivo a través del page cache.
+"""
+import mmap
+import os
+import re
+import struct
+import tempfile
+import threading
+import unicodedata
+
+from django.conf import settings
+
+
+MAGIC = b'MEDIDX1\n'
+CABECERA = struct.Struct('<I')
+OFFSET = struct.Struct('<I')
+
+
+def normalizar(texto):
+    """'Tylénol  Extra-Fuerte' -> 'tylenol extra fuerte'"""
+    texto = unicodedata.normalize('NFKD', texto or '')
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return ' '.join(re.sub(r'[^0-9a-z]+', ' ', texto.lower()).split())
+
+
+def claves_de(nombre, generico=None):
+    """Una clave por cada palabra del nombre (y del genérico) hasta el final del texto"""
+    claves = set()
+    for texto in (nombre, generico):
+        palabras = normalizar(texto).split()
+        for i in range(len(palabras)):
+            claves.add(' '.join(palabras[i:]))
+    return claves
+
+
+def serializar_indice(medicamentos):
+    """Construye el contenido del índice a partir de pares (nombre, generico)"""
+    registros = set()
+    for nombre, generico in medicamentos:
+        for clave in claves_de(nombre, generico):
+            registros.add((clave.encode('utf-8'), nombre.encode('utf-8')))
+
+    ordenados = sorted(registros)
+    datos = bytearray()
+    offsets = bytearray()
+    for clave, nombre in ordenados:
+        offsets += OFFSET.pack(len(datos))
+        datos += clave + b'\x00' + nombre.replace(b'\n', b' ') + b'\n'
+    return MAGIC + CABECERA.pack(len(ordenados)) + bytes(offsets) + bytes(datos)
+
+
+def escribir_indice(medicamentos, ruta):
+    """Escribe el índice de forma atómica (los workers ven el archivo viejo o el nuevo, nunca uno a medias)"""
+    contenido = serializar_indice(medicamentos)
+    directorio = os.path.dirname(os.path.abspath(ruta))
+    os.makedirs(directorio, exist_ok=True)
+    fd, temporal = tempfile.mkstemp(dir=directorio, prefix='.medicamentos-')
+    try:
+        with os.fdopen(fd, 'wb') as archivo:
+            archivo.write(contenido)
+        # mkstemp crea el archivo 0600; los workers pueden correr con otro usuario
+        os.chmod(temporal, 0o644)
+        os.replace(temporal, ruta)
+    except BaseException:
+        if os.path.exists(temporal):
+            os.unlink(temporal)
+        raise
+    return len(contenido)
+
+
+class IndiceMedicamentos:
+    """Lectura del índice (desde un mmap o desde bytes en memoria)"""
+
+    def __init__(self, buffer):
+        if buffer[:len(MAGIC)] != MAGIC:
+            raise ValueError('Archivo de índice de medicamentos inválido')
+        self.buffer = buffer
+        inicio = len(MAGIC)
+        (self.cantidad,) = CABECERA.unpack_from(buffer, inicio)
+        self.inicio_offsets = inicio + CABECERA.size
+        self.inicio_datos = self.inicio_offsets + self.cantidad * OFFSET.size
+
+    def __len__(self):
+        return self.cantidad
+
+    def _registro(self, i):
+        (offset,) = OFFSET.unpack_from(self.buffer, self.inicio_offsets + i * OFFSET.size)
+        inicio = self.inicio_datos + offset
+        fin = self.buffer.find(b'\n', inicio)
+        separador = self.buffer.find(b'\x00', inicio, fin)
+        return self.buffer[inicio:separador], self.buffer[separador + 1:fin]
+
+    def buscar(self, prefijo, limite=10):
+        prefijo = normalizar(prefijo).encode('utf-8')
+        if not prefijo:
+            return []
+
+        # Primer registro con clave >= prefijo
+        bajo, alto = 0, self.cantidad
+        while bajo < alto:
+            medio = (bajo + alto) // 2
+            if self._registro(medio)[0] < prefijo:
+                bajo = medio + 1
+            else:
+                alto = medio
+
+        resultados = []
+        vistos = set()
+        i = bajo
+        while i < self.cantidad and len(resultados) < limite:
+            clave, nombre = self._registro(i)
+            if not clave.startswith(prefijo):
+                break
+            if nombre not in vistos:
+                vistos.add(nombre)
+                resultados.append(nombre.decode('utf-8'))
+            i += 1
+        return resultados
+
+
+def ruta_indice():
+    return str(getattr(settings, 'MEDICAMENTOS_INDEX_PATH', os.path.join(settings.BASE_DIR, 'medicamentos.idx')))
+
+
+class Catalogo:
+    """Índice compartido por el proceso; se recarga si el archivo cambia (nuevo import)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._indice = None
+        self._firma = None
+        self._mmap = None
+
+    def _firma_archivo(self, ruta):
+        try:
+            stat = os.stat(ruta)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _cargar(self):
+        ruta = ruta_indice()
+        firma = self._firma_archivo(ruta)
+        if firma is not None and firma == self._firma:
+            return self._indice
+
+        with self._lock:
+            if firma is not None and firma == self._firma:
+                return self._indice
+            if firma is not None:
+                with open(ruta, 'rb') as archivo:
+                    nuevo_mmap = mmap.mmap(archivo.fileno(), 0, access=mmap.ACCESS_READ)
+                self._indice = IndiceMedicamentos(nuevo_mmap)
+                self._mmap, viejo = nuevo_mmap, self._mmap
+                self._firma = firma
+                # El mmap viejo se libera cuando ya no lo use ninguna búsqueda en curso
+                del viejo
+            elif self._indice is None:
+                # Sin archivo: se construye en memoria desde la tabla (sólo este proceso)
+                from .models import Medicamento
+                contenido = serializar_indice(Medicamento.objects.values_list('nombre', 'generico').iterator())
+                self._indice = IndiceMedicamentos(contenido)
+            return self._indice
+
+    def buscar(self, prefijo, limite=10):
+        return self._cargar().buscar(prefijo, limite)
+
+    def vacio(self):
+        return len(self._cargar()) == 0
+
+    def invalidar(self):
+        with self._lock:
+            self._indice = None
+            self._firma = None
+
+
+catalogo = Catalogo()
@@ -0,0 +1,54 @@
+"""GET condicional (ETag / Last-Modified) para la API de consultas.
+
+Los validadores salen de columnas baratas de Consulta (id, version, actualizado)
+que se leen antes de cargar relaciones y serializar. Si el cliente ya tiene esa
+versión (If-None-Match / If-Modified-Since) se responde 304 sin cuerpo; si no,
+la respuesta normal lleva las cabeceras para la próxima vez.
+
+Cubre la consulta, su diagnóstico y sus recetas (signals.py). Un cambio de nombre
+o correo de la persona no cambia el ETag. Las listas sólo llevan ETag: borrar una
+fila o sacarla del filtro no mueve la fecha más reciente de la página.
+"""
+import hashlib
+
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+
+# Subir al cambiar la forma del payload (ConsultaSerializer): invalida los ETag de los clientes
+VERSION_API = 1
+
+# Columnas que identifican la versión de una consulta
+CAMPOS_VALIDADOR = ('version', 'actualizado')
+
+
+def validadores(filas, *extra):
+    """(etag, última modificación) de filas (pk, ..., version, actualizado) en su orden"""
+    resumen = hashlib.blake2b(digest_size=12)
+    resumen.update(f'{VERSION_API}|{extra}'.encode())
+    ultima = None
+    for fila in filas:
+        actualizado = fila[-1]
+        resumen.update(f'{fila[0]}:{fila[-2]}:{actualizado.timestamp()};'.encode())
+        if ultima is None or actualizado > ultima:
+            ultima = actualizado
+    return quote_etag(resumen.hexdigest()), ultima
+
+
+def no_modificada(request, etag, ultima):
+    """304 (GET/HEAD) o 412 (If-Match en PUT/DELETE) si corresponde; si no, None"""
+    respuesta = get_conditional_response(
+        request, etag=etag, last_modified=int(ultima.timestamp()) if ultima else None,
+    )
+    if respuesta is not None:
+        marcar(respuesta, etag, ultima)
+    return respuesta
+
+
+def marcar(respuesta, etag, ultima):
+    respuesta['ETag'] = etag
+    if ultima is not None:
+        respuesta['Last-Modified'] = http_date(ultima.timestamp())
+    # El cliente puede guardar la respuesta pero debe revalidarla en cada uso
+    patch_cache_control(respuesta, private=True, no_cache=True)
+    return respuesta
@@ -0,0 +1,152 @@
+"""Cola de consultas pendientes por especialidad.
+
+Un médico toma "el siguiente paciente" de su especialidad y el despachador
+reparte las pendientes entre los especialistas con menos citas abiertas. Ambos
+reclaman filas con SELECT ... FOR UPDATE SKIP LOCKED sobre el índice parcial
+consulta_pendientes_idx: dos médicos que piden a la vez reciben consultas
+distintas sin esperarse entre ellos ni pasar por una fila compartida.
+
+En backends sin SKIP LOCKED (SQLite) se lee sin bloquear y se reclama con un
+UPDATE condicional (estado='pendiente'); si otro ganó, se prueba la siguiente.
+"""
+import heapq
+
+from django.db import connection, transaction
+from django.db.models import Count, Exists, OuterRef, Q
+from django.utils import timezone
+
+from .agenda import DURACION_DEFECTO, DURACION_MAXIMA, ESTADOS_OCUPAN, choques, duracion_cita
+from .eventos import publicar_cambios
+from .models import Consulta, Especialista
+from .transiciones import aplicar
+
+
+# Pendientes que se prueban antes de rendirse (las demás las tomó otro médico entre la lectura y el UPDATE)
+MAX_INTENTOS = 10
+
+RECLAMADA = 'reclamada'
+CHOQUE = 'choque'
+TOMADA = 'tomada'
+
+
+def _skip_locked():
+    return connection.features.has_select_for_update_skip_locked
+
+
+def choca_con_agenda(especialista):
+    """Exists() de las citas del especialista que se cruzan con la consulta externa (el mismo criterio que agenda.choques)"""
+    inicio = OuterRef('fecha_inicio')
+    return Exists(Consulta.objects.filter(
+        especialista_asignado_id=especialista.pk,
+        estado__in=ESTADOS_OCUPAN,
+        fecha_inicio__gt=inicio - DURACION_MAXIMA,
+        fecha_inicio__lt=inicio + duracion_cita(especialista.duracion_cita),
+    ).filter(
+        Q(fecha_fin__gt=inicio) | Q(fecha_fin__isnull=True, fecha_inicio__gt=inicio - DURACION_DEFECTO)
+    ))
+
+
+def pendientes(especialidad, cantidad, excluir=(), especialista=None):
+    """Las `cantidad` pendientes más próximas de la especialidad, saltando las bloqueadas por otros.
+
+    Sólo las que aún no empiezan (o no tienen fecha): una pendiente cuya hora ya pasó no se
+    asigna a nadie, sigue en la lista del paciente para que la reprograme.
+    Con `especialista` se descartan en la misma consulta las que chocan con su agenda.
+    """
+    consultas = (
+        Consulta.objects.filter(estado='pendiente', especialidad=especialidad)
+        .filter(Q(fecha_inicio__gte=timezone.now()) | Q(fecha_inicio__isnull=True))
+        .exclude(pk__in=excluir)
+        .order_by('fecha_inicio', 'id')
+    )
+    if especialista is not None:
+        consultas = consultas.exclude(Q(fecha_inicio__isnull=False) & choca_con_agenda(especialista))
+    if _skip_locked():
+        consultas = consultas.select_for_update(skip_locked=True, of=('self',))
+    return list(consultas[:cantidad])
+
+
+def reclamar(consulta, especialista, verificar_agenda=True):
+    """Acepta la consulta a nombre del especialista si su agenda lo permite"""
+    fin = None
+    if consulta.fecha_inicio is not None:
+        fin = consulta.fecha_inicio + duracion_cita(especialista.duracion_cita)
+        if verificar_agenda and choques(especialista.pk, consulta.fecha_inicio, fin).exists():
+            return CHOQUE
+
+    actualizadas = aplicar(
+        'tomar', Consulta.objects.filter(pk=consulta.pk), especialista_asignado=especialista, fecha_fin=fin,
+    )
+    if not actualizadas:
+        return TOMADA
+    consulta.estado = 'aceptada'
+    consulta.especialista_asignado = especialista
+    consulta.fecha_fin = fin
+    return RECLAMADA
+
+
+def tomar_siguiente(especialista):
+    """Asigna al especialista la próxima pendiente de su especialidad; None si no hay"""
+    with transaction.atomic():
+        # Bloquea sólo la fila del propio médico: evita que dos pedidos suyos choquen en su agenda
+        especialista = Especialista.objects.select_for_update().get(pk=especialista.pk)
+        descartadas = []
+        for _ in range(MAX_INTENTOS):
+            candidatas = pendientes(especialista.especialidad, 1, excluir=descartadas, especialista=especialista)
+            if not candidatas:
+                return None
+            consulta = candidatas[0]
+            # pendientes() ya descartó las que chocan y la fila del médico sigue bloqueada
+            if reclamar(consulta, especialista, verificar_agenda=False) == RECLAMADA:
+                publicar_cambios([consulta])
+                return consulta
+            descartadas.append(consulta.pk)
+    return None
+
+
+def carga_abierta(especialista_ids):
+    """Citas aceptadas desde ahora en adelante, por especialista"""
+    return dict(
+        Consulta.objects.filter(
+            especialista_asignado__in=especialista_ids, estado='aceptada', fecha_inicio__gte=timezone.now(),
+        ).order_by().values('especialista_asignado').annotate(n=Count('id'))
+        .values_list('especialista_asignado', 'n')
+    )
+
+
+def repartir_pendientes(especialidad, limite=100):
+    """Asigna hasta `limite` pendientes de la especialidad al especialista con menos carga abierta.
+
+    Los médicos que están tomando un paciente en este momento (fila bloqueada) se saltan.
+    """
+    with transaction.atomic():
+        especialistas = Especialista.objects.filter(especialidad=especialidad).order_by('id')
+        if _skip_locked():
+            especialistas = especialistas.select_for_update(skip_locked=True)
+        especialistas = {e.pk: e for e in especialistas}
+        if not especialistas:
+            return []
+
+        carga = carga_abierta(list(especialistas))
+        monticulo = [(carga.get(pk, 0), pk) for pk in especialistas]
+        heapq.heapify(monticulo)
+
+        asignadas = []
+        for consulta in pendientes(especialidad, limite):
+            # El menos cargado primero; si su agenda choca, el siguiente
+            probados = []
+            while monticulo:
+                n, pk = heapq.heappop(monticulo)
+                resultado = reclamar(consulta, especialistas[pk])
+                if resultado == RECLAMADA:
+                    probados.append((n + 1, pk))
+                    asignadas.append(consulta)
+                    break
+                probados.append((n, pk))
+                if resultado == TOMADA:
+                    break
+            for item in probados:
+                heapq.heappush(monticulo, item)
+
+        publicar_cambios(asignadas)
+    return asignadas
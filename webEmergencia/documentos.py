@@ -0,0 +1,93 @@
+"""Documentos (diagnóstico + recetas) de mis_documentos, renderizados una vez y cacheados.
+
+Un diagnóstico finalizado casi nunca cambia: su fragmento HTML se guarda en el
+caché con clave (id, actualizado). Editar el diagnóstico mueve `actualizado`
+(auto_now) y editar o borrar una receta lo mueve desde signals.py, así que la
+clave vieja deja de usarse sin tener que borrarla.
+
+Ver el historial cuesta una consulta (la lista de consultas finalizadas del
+paciente, que trae la versión de cada diagnóstico) más un get_many al caché. Sólo
+los fragmentos que faltan se leen, con sus recetas en un único prefetch.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Prefetch
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.safestring import mark_safe
+
+from .models import Consulta, Diagnostico, Receta
+
+
+# Subir al cambiar la plantilla del fragmento: invalida todo lo cacheado
+VERSION_PLANTILLA = 1
+
+PLANTILLA = 'webEmergencia/_documento.html'
+
+
+def clave(diagnostico_id, actualizado):
+    return f'documento:{VERSION_PLANTILLA}:{diagnostico_id}:{actualizado.timestamp():.6f}'
+
+
+def renderizar(diagnosticos):
+    """{clave: {'html', 'num_recetas'}} de los diagnósticos dados (con recetas prefetcheadas)"""
+    fragmentos = {}
+    for diagnostico in diagnosticos:
+        recetas = list(diagnostico.recetas.all())
+        fragmentos[clave(diagnostico.id, diagnostico.actualizado)] = {
+            'diagnostico_id': diagnostico.id,
+            'html': render_to_string(PLANTILLA, {'diagnostico': diagnostico, 'recetas': recetas}),
+            'num_recetas': len(recetas),
+        }
+    return fragmentos
+
+
+def documentos_de(paciente):
+    """Documentos del paciente, del más reciente al más antiguo"""
+    consultas = list(
+        Consulta.objects.filter(
+            fk_idpaciente=paciente,
+            estado='finalizada',
+            diagnostico_data__isnull=False,
+        ).order_by('-fecha_inicio').values(
+            'id', 'fecha_inicio', 'motivo', 'especialidad', 'diagnostico_data__id', 'diagnostico_data__actualizado',
+        )
+    )
+    claves = {
+        consulta['diagnostico_data__id']: clave(consulta['diagnostico_data__id'], consulta['diagnostico_data__actualizado'])
+        for consulta in consultas
+    }
+    en_cache = cache.get_many(list(claves.values()))
+    por_diagnostico = {fragmento['diagnostico_id']: fragmento for fragmento in en_cache.values()}
+
+    faltan = [diagnostico_id for diagnostico_id, k in claves.items() if k not in en_cache]
+    if faltan:
+        # La clave sale de la misma lectura que el contenido: una edición concurrente no queda bajo una clave nueva
+        nuevos = renderizar(
+            Diagnostico.objects.filter(pk__in=faltan).prefetch_related(
+                Prefetch('recetas', queryset=Receta.objects.order_by('id')),
+            )
+        )
+        cache.set_many(nuevos, getattr(settings, 'DOCUMENTOS_CACHE_TTL', 7 * 86400))
+        por_diagnostico.update((fragmento['diagnostico_id'], fragmento) for fragmento in nuevos.values())
+
+    documentos = []
+    for consulta in consultas:
+        fragmento = por_diagnostico.get(consulta['diagnostico_data__id'])
+        if fragmento is None:
+            # Se borró entre la lista y el prefetch
+            continue
+        documentos.append({
+            'consulta_id': consulta['id'],
+            'consulta_fecha': consulta['fecha_inicio'],
+            'consulta_motivo': consulta['motivo'],
+            'consulta_especialidad': consulta['especialidad'],
+            'num_recetas': fragmento['num_recetas'],
+            'html': mark_safe(fragmento['html']),
+        })
+    return documentos
+
+
+def invalidar(diagnostico_ids):
+    """Nueva versión para los documentos de estos diagnósticos (cambios en sus recetas)"""
+    Diagnostico.objects.filter(pk__in=diagnostico_ids).update(actualizado=timezone.now())
@@ -0,0 +1,204 @@
+"""Estadísticas operativas diarias de consultas, mantenidas de forma incremental.
+
+EstadisticaDiaria guarda cuántas consultas hay por (día, especialidad, estado,
+especialista, razón de cancelación, diagnóstico crónico). ConsultaContada
+recuerda bajo qué clave está contada cada consulta: al confirmarse un cambio se
+compara con la clave actual de la fila y sólo si difieren se resta 1 a la vieja
+y se suma 1 a la nueva. Repetir la reconciliación no cambia nada, así que basta
+con avisar de más y nunca de menos.
+
+Avisan transiciones.actualizar (todos los UPDATE de estado, y los cambios de
+diagnóstico vía signals.py) y los save()/delete() de Consulta. bulk_create de
+consultas (importar_pacientes, seed) no avisa: después correr
+`python manage.py reconstruir_estadisticas`.
+
+Reconciliar una transición cuesta unas 5 consultas SQL dentro de la petición
+(más BEGIN/COMMIT en SQLite); los presupuestos de query_budget ya las incluyen.
+
+La API lee sólo EstadisticaDiaria: el costo depende del rango de días pedido,
+no de cuántas consultas haya en la historia.
+"""
+from collections import Counter
+from datetime import date, timedelta
+
+from django.db import transaction
+from django.db.models import F, Q, Sum
+from django.utils import timezone
+
+from .models import Consulta, ConsultaContada, EstadisticaDiaria
+
+
+# Día de las consultas sin fecha_inicio
+SIN_FECHA = date(1, 1, 1)
+
+DIMENSIONES = ('dia', 'especialidad', 'estado', 'especialista_id', 'razon', 'cronico')
+CAMPOS_CONSULTA = (
+    'id', 'fecha_inicio', 'especialidad', 'estado', 'especialista_asignado_id', 'razon_cancelacion',
+    'diagnostico_data__es_cronico',
+)
+LARGO_RAZON = 100
+
+# Parámetro ?por= de la API: columna de EstadisticaDiaria
+AGRUPACIONES = {
+    'dia': 'dia',
+    'especialidad': 'especialidad',
+    'estado': 'estado',
+    'especialista': 'especialista_id',
+    'razon': 'razon',
+    'cronico': 'cronico',
+}
+
+TAMANO_LOTE = 2000
+
+
+def clave(fila, zona):
+    """Dimensiones de una fila de Consulta.values_list(*CAMPOS_CONSULTA)"""
+    _, fecha, especialidad, estado, especialista_id, razon, cronico = fila
+    if estado == 'cancelada':
+        # Texto libre: se agrupa sin mayúsculas ni espacios repetidos
+        razon = ' '.join((razon or '').lower().split())[:LARGO_RAZON]
+    else:
+        razon = ''
+    return (
+        timezone.localtime(fecha, zona).date() if fecha else SIN_FECHA,
+        especialidad,
+        estado,
+        especialista_id or 0,
+        razon,
+        bool(cronico),
+    )
+
+
+def _filtro(k):
+    return dict(zip(DIMENSIONES, k))
+
+
+def _sumar(deltas):
+    # En orden de clave: dos reconciliaciones concurrentes bloquean las filas en el mismo orden
+    for k, n in sorted((k, n) for k, n in deltas.items() if n):
+        if EstadisticaDiaria.objects.filter(**_filtro(k)).update(cantidad=F('cantidad') + n):
+            continue
+        # Primera consulta con esta clave (otra reconciliación puede crearla al mismo tiempo)
+        EstadisticaDiaria.objects.bulk_create([EstadisticaDiaria(**_filtro(k))], ignore_conflicts=True)
+        EstadisticaDiaria.objects.filter(**_filtro(k)).update(cantidad=F('cantidad') + n)
+
+
+def reconciliar(ids=(), momento=None):
+    """Lleva a EstadisticaDiaria las consultas `ids` y las escritas por un UPDATE con actualizado=momento"""
+    ids = sorted(set(ids))
+    if not ids and momento is None:
+        return
+    consultas = Consulta.objects.filter(pk__in=ids)
+    if momento is not None:
+        consultas = consultas | Consulta.objects.filter(actualizado=momento)
+    zona = timezone.get_default_timezone()
+
+    with transaction.atomic():
+        # Con el bloqueo tomado se lee la fila: la última reconciliación en entrar ve el último estado confirmado
+        contadas = {
+            contada.consulta_id: contada
+            for contada in ConsultaContada.objects.select_for_update().filter(
+                Q(consulta_id__in=ids) | Q(consulta_id__in=consultas.values('pk')),
+            ).order_by('consulta_id')
+        }
+        actuales = {fila[0]: clave(fila, zona) for fila in consultas.values_list(*CAMPOS_CONSULTA)}
+
+        nuevas = sorted(pk for pk in actuales if pk not in contadas)
+        if nuevas:
+            # Consultas que todavía no están contadas (recién creadas o de un bulk_create)
+            ConsultaContada.objects.bulk_create([ConsultaContada(consulta_id=pk) for pk in nuevas], ignore_conflicts=True)
+            contadas.update(
+                (contada.consulta_id, contada)
+                for contada in ConsultaContada.objects.select_for_update().filter(consulta_id__in=nuevas).order_by('consulta_id')
+            )
+            actuales.update(
+                (fila[0], clave(fila, zona))
+                for fila in Consulta.objects.filter(pk__in=nuevas).values_list(*CAMPOS_CONSULTA)
+            )
+
+        deltas = Counter()
+        cambiadas, borradas = [], []
+        for contada in contadas.values():
+            antes = tuple(getattr(contada, d) for d in DIMENSIONES) if contada.estado is not None else None
+            ahora = actuales.get(contada.consulta_id)
+            if antes == ahora:
+                continue
+            if antes is not None:
+                deltas[antes] -= 1
+            if ahora is None:
+                borradas.append(contada.consulta_id)
+            else:
+                deltas[ahora] += 1
+                for dimension, valor in zip(DIMENSIONES, ahora):
+                    setattr(contada, dimension, valor)
+                cambiadas.append(contada)
+
+        _sumar(deltas)
+        if len(cambiadas) == 1:
+            cambiadas[0].save(update_fields=DIMENSIONES)
+        elif cambiadas:
+            ConsultaContada.objects.bulk_update(cambiadas, DIMENSIONES)
+        if borradas:
+            ConsultaContada.objects.filter(consulta_id__in=borradas).delete()
+
+
+def programar(ids=(), momento=None):
+    """Reconcilia al confirmar la transacción en curso; si falla, la respuesta no se cae (ver reconstruir)"""
+    if not ids and momento is None:
+        return
+    ids = list(ids)
+
+    def reconciliar_cambios():
+        reconciliar(ids, momento)
+
+    transaction.on_commit(reconciliar_cambios, robust=True)
+
+
+def faltan():
+    """True si hay consultas que nunca se contaron (recién migrada la 0013, o tras un bulk_create)"""
+    return Consulta.objects.exclude(pk__in=ConsultaContada.objects.values('consulta_id')).exists()
+
+
+def reconstruir(tamano=TAMANO_LOTE):
+    """Recalcula todo en una pasada sobre consulta; devuelve (consultas, filas de estadística)"""
+    zona = timezone.get_default_timezone()
+    inicio = timezone.now()
+    totales = Counter()
+    consultas = 0
+    with transaction.atomic():
+        ConsultaContada.objects.all().delete()
+        EstadisticaDiaria.objects.all().delete()
+        lote = []
+        filas = Consulta.objects.order_by().values_list(*CAMPOS_CONSULTA).iterator(chunk_size=tamano)
+        for fila in filas:
+            k = clave(fila, zona)
+            totales[k] += 1
+            lote.append(ConsultaContada(consulta_id=fila[0], **_filtro(k)))
+            if len(lote) >= tamano:
+                ConsultaContada.objects.bulk_create(lote)
+                consultas += len(lote)
+                lote = []
+        ConsultaContada.objects.bulk_create(lote)
+        consultas += len(lote)
+        EstadisticaDiaria.objects.bulk_create(
+            [EstadisticaDiaria(cantidad=n, **_filtro(k)) for k, n in totales.items()],
+            batch_size=tamano,
+        )
+
+    # Lo que cambió mientras se leía (con margen para transacciones que confirmaron tarde)
+    recientes = Consulta.objects.filter(actualizado__gte=inicio - timedelta(minutes=1)).values_list('id', flat=True)
+    reconciliar(recientes)
+    return consultas, len(totales)
+
+
+def resumen(desde, hasta, por=(), **filtros):
+    """Totales de EstadisticaDiaria entre dos días (inclusive) agrupados por `por` (claves de AGRUPACIONES)"""
+    filas = EstadisticaDiaria.objects.filter(dia__gte=desde, dia__lte=hasta, **filtros)
+    campos = [AGRUPACIONES[p] for p in por]
+    if not campos:
+        return [{'cantidad': filas.aggregate(total=Sum('cantidad'))['total'] or 0}]
+    grupos = filas.values(*campos).annotate(total=Sum('cantidad')).filter(total__gt=0).order_by(*campos)
+    return [
+        dict({p: grupo[AGRUPACIONES[p]] for p in por}, cantidad=grupo['total'])
+        for grupo in grupos
+    ]
@@ -0,0 +1,221 @@
+"""Cambios de estado de consultas empujados a los navegadores con Server-Sent Events.
+
+gestionar_cita_medico y finalizar_consulta_view publican un EventoConsulta al
+confirmar la transacción. La tabla hace de bus entre procesos (varios workers
+de gunicorn/uvicorn) y permite reanudar con Last-Event-ID.
+
+- ASGI: una conexión SSE larga por navegador. Cada worker tiene un único Difusor
+  que lee los eventos nuevos (una consulta por intervalo, no una por navegador)
+  y los reparte a las colas de sus suscriptores.
+- WSGI: cada respuesta trae los eventos pendientes y se cierra; el navegador se
+  reconecta solo (campo retry) sin dejar un worker bloqueado.
+
+Los ids se asignan al insertar, no al confirmar: en PostgreSQL un evento con id
+menor puede hacerse visible después de otro mayor, y leer sólo `id > último`
+se lo saltaría. Por eso cada lectura relee también los eventos de los últimos
+EVENTOS_SSE_SOLAPE_SEGUNDOS; el Difusor y cada conexión descartan por id los
+que ya entregaron (Vistos), y el navegador aplica un evento sólo si es más
+nuevo que el último que aplicó a esa consulta (el id va en data.evento).
+"""
+import asyncio
+import json
+import time
+import weakref
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import EventoConsulta
+
+
+# Eventos máximos por lectura (un navegador que vuelve tras mucho rato se pone al día en varias)
+LIMITE_LECTURA = 500
+
+
+def intervalo():
+    return getattr(settings, 'EVENTOS_SSE_INTERVALO', 1.0)
+
+
+def solape():
+    return timedelta(seconds=getattr(settings, 'EVENTOS_SSE_SOLAPE_SEGUNDOS', 10))
+
+
+def datos_evento(consulta):
+    """Lo que necesita el navegador para actualizar la fila (el estado completo, no el delta)"""
+    return {
+        'id': consulta.id,
+        'estado': consulta.estado,
+        'razon_cancelacion': consulta.razon_cancelacion,
+        'especialista_asignado': consulta.especialista_asignado_id,
+    }
+
+
+def publicar_cambios(consultas):
+    """Registra los cambios cuando se confirme la transacción en curso (o de inmediato si no hay)"""
+    eventos = [EventoConsulta(consulta_id=consulta.id, datos=datos_evento(consulta)) for consulta in consultas]
+    if not eventos:
+        return
+
+    def guardar():
+        creados = EventoConsulta.objects.bulk_create(eventos)
+        ids = [evento.id for evento in creados if evento.id is not None]
+        # Limpieza ocasional: cada vez que los ids cruzan un múltiplo de 200
+        if ids and (min(ids) - 1) // 200 != max(ids) // 200:
+            horas = getattr(settings, 'EVENTOS_RETENCION_HORAS', 24)
+            EventoConsulta.objects.filter(creado__lt=timezone.now() - timedelta(hours=horas)).delete()
+
+    transaction.on_commit(guardar)
+
+
+def publicar_cambio(consulta):
+    publicar_cambios([consulta])
+
+
+def ultimo_evento_id():
+    return EventoConsulta.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def eventos_despues_de(evento_id, limite=LIMITE_LECTURA):
+    """Hasta `limite` eventos con id mayor que evento_id, más los del solape que ya quedaron atrás
+
+    El límite sólo corta los nuevos: el solape no puede impedir que el cursor avance.
+    """
+    nuevos = list(
+        EventoConsulta.objects.filter(id__gt=evento_id).order_by('id').values('id', 'datos')[:limite]
+    )
+    releidos = list(
+        EventoConsulta.objects.filter(id__lte=evento_id, creado__gte=timezone.now() - solape())
+        .order_by('id').values('id', 'datos')
+    )
+    return releidos + nuevos
+
+
+def desde_request(request):
+    """Último evento visto: cabecera Last-Event-ID (reconexión) o ?desde= (carga de la página)"""
+    valor = request.headers.get('Last-Event-ID') or request.GET.get('desde')
+    try:
+        return max(int(valor), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def formatear(evento, cursor=None):
+    """`cursor` es el Last-Event-ID que debe recordar el navegador: un evento releído
+    del solape no lo hace retroceder"""
+    datos = {**evento['datos'], 'evento': evento['id']}
+    return f"id: {cursor or evento['id']}\nevent: consulta\ndata: {json.dumps(datos)}\n\n"
+
+
+def formatear_cursor(evento_id):
+    # Un id sin data no dispara evento pero mueve el Last-Event-ID del navegador
+    return f'id: {evento_id}\n\n'
+
+
+class Vistos:
+    """Ids ya entregados; se olvidan cuando salen del solape y ya no se pueden releer"""
+
+    def __init__(self):
+        self.ids = {}
+
+    def nuevo(self, evento_id):
+        ahora = time.monotonic()
+        # Doble margen: el solape se mide con el reloj del que insertó el evento
+        olvido = ahora - 2 * solape().total_seconds()
+        while self.ids and next(iter(self.ids.values())) < olvido:
+            del self.ids[next(iter(self.ids))]
+        if evento_id in self.ids:
+            return False
+        self.ids[evento_id] = ahora
+        return True
+
+
+class Difusor:
+    """Reparte los eventos nuevos a las conexiones SSE de un event loop"""
+
+    def __init__(self, tamano_cola=100):
+        self.tamano_cola = tamano_cola
+        self.suscriptores = set()
+        self.ultimo_id = None
+        self.vistos = Vistos()
+        self.tarea = None
+
+    def suscribir(self):
+        cola = asyncio.Queue(self.tamano_cola)
+        self.suscriptores.add(cola)
+        if self.tarea is None:
+            self.tarea = asyncio.get_running_loop().create_task(self._leer())
+        return cola
+
+    def desuscribir(self, cola):
+        self.suscriptores.discard(cola)
+
+    async def _leer(self):
+        try:
+            if self.ultimo_id is None:
+                self.ultimo_id = await sync_to_async(ultimo_evento_id)()
+            while self.suscriptores:
+                eventos = await sync_to_async(eventos_despues_de)(self.ultimo_id)
+                nuevos = [evento for evento in eventos if evento['id'] > self.ultimo_id]
+                for evento in eventos:
+                    if not self.vistos.nuevo(evento['id']):
+                        continue
+                    for cola in list(self.suscriptores):
+                        try:
+                            cola.put_nowait(evento)
+                        except asyncio.QueueFull:
+                            # Cliente demasiado lento: se corta y se pone al día al reconectar
+                            self.suscriptores.discard(cola)
+                            while not cola.empty():
+                                cola.get_nowait()
+                            cola.put_nowait(None)
+                if nuevos:
+                    self.ultimo_id = nuevos[-1]['id']
+                if len(nuevos) < LIMITE_LECTURA:
+                    await asyncio.sleep(intervalo())
+        finally:
+            self.tarea = None
+
+
+_difusores = weakref.WeakKeyDictionary()
+
+
+def get_difusor():
+    loop = asyncio.get_running_loop()
+    difusor = _difusores.get(loop)
+    if difusor is None:
+        difusor = _difusores[loop] = Difusor()
+    return difusor
+
+
+async def flujo_eventos(desde):
+    """Cuerpo de la respuesta SSE bajo ASGI; termina cuando el cliente se desconecta"""
+    difusor = get_difusor()
+    cola = difusor.suscribir()
+    try:
+        yield f"retry: {getattr(settings, 'EVENTOS_SSE_RETRY_MS', 3000)}\n\n"
+        # La puesta al día y el Difusor pueden traer el mismo evento
+        vistos = Vistos()
+        cursor = desde or 0
+        if desde is not None:
+            for evento in await sync_to_async(eventos_despues_de)(desde):
+                vistos.nuevo(evento['id'])
+                cursor = max(cursor, evento['id'])
+                yield formatear(evento, cursor)
+        latido = getattr(settings, 'EVENTOS_SSE_LATIDO', 20)
+        while True:
+            try:
+                evento = await asyncio.wait_for(cola.get(), latido)
+            except asyncio.TimeoutError:
+                # Mantiene viva la conexión a través de proxies
+                yield ': ping\n\n'
+                continue
+            if evento is None:
+                return
+            if vistos.nuevo(evento['id']):
+                cursor = max(cursor, evento['id'])
+                yield formatear(evento, cursor)
+    finally:
+        difusor.desuscribir(cola)
@@ -0,0 +1,116 @@
+"""Exportación de consultas a CSV o NDJSON sin cargar el resultado en memoria.
+
+Las consultas se leen con .values().iterator(chunk_size) (cursor del lado del
+servidor en PostgreSQL) con paciente, especialista y diagnóstico por JOIN. Las
+recetas, que son varias por diagnóstico, se traen con una consulta por bloque
+de filas. Cada bloque se formatea y se entrega a StreamingHttpResponse antes de
+leer el siguiente: la memoria depende de chunk_size, no del total exportado.
+"""
+import csv
+import io
+from collections import defaultdict
+from itertools import islice
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from .models import Receta
+
+
+# Filas por lectura del cursor y por bloque de la respuesta
+TAMANO_BLOQUE = 2000
+
+# (columna del archivo, campo de .values())
+COLUMNAS = [
+    ('id', 'id'),
+    ('estado', 'estado'),
+    ('especialidad', 'especialidad'),
+    ('fecha_inicio', 'fecha_inicio'),
+    ('fecha_fin', 'fecha_fin'),
+    ('motivo', 'motivo'),
+    ('sintomas', 'sintomas'),
+    ('razon_cancelacion', 'razon_cancelacion'),
+    ('paciente_rut', 'fk_idpaciente__fk_rut__rut'),
+    ('paciente_nombre', 'fk_idpaciente__fk_rut__nombre'),
+    ('paciente_apellido', 'fk_idpaciente__fk_rut__apellido'),
+    ('paciente_correo', 'fk_idpaciente__fk_rut__correo'),
+    ('especialista_id', 'especialista_asignado_id'),
+    ('especialista_nombre', 'especialista_asignado__fk_rutp__nombre'),
+    ('especialista_apellido', 'especialista_asignado__fk_rutp__apellido'),
+    ('diagnostico', 'diagnostico_data__descripcion'),
+    ('es_cronico', 'diagnostico_data__es_cronico'),
+    ('nombre_enfermedad', 'diagnostico_data__nombre_enfermedad'),
+]
+CAMPOS = [campo for _, campo in COLUMNAS] + ['diagnostico_data__id']
+ENCABEZADOS = [columna for columna, _ in COLUMNAS] + ['recetas']
+
+FORMATOS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+# Una celda que empieza así se evalúa como fórmula al abrir el CSV en una planilla
+INICIO_FORMULA = ('=', '+', '-', '@', '\t', '\r')
+
+
+def bloques(consultas, tamano=TAMANO_BLOQUE):
+    """Filas (dicts con COLUMNAS y 'recetas') en bloques de `tamano`"""
+    filas = consultas.order_by('id').values(*CAMPOS).iterator(chunk_size=tamano)
+    while True:
+        bloque = list(islice(filas, tamano))
+        if not bloque:
+            return
+        diagnosticos = [fila['diagnostico_data__id'] for fila in bloque if fila['diagnostico_data__id']]
+        recetas = defaultdict(list)
+        if diagnosticos:
+            for diagnostico_id, medicamento, dosis, horario in Receta.objects.filter(
+                diagnostico_id__in=diagnosticos,
+            ).order_by('id').values_list('diagnostico_id', 'medicamento', 'dosis', 'horario'):
+                recetas[diagnostico_id].append({'medicamento': medicamento, 'dosis': dosis, 'horario': horario})
+        yield [
+            dict(
+                [(columna, fila[campo]) for columna, campo in COLUMNAS],
+                recetas=recetas.get(fila['diagnostico_data__id'], []),
+            )
+            for fila in bloque
+        ]
+
+
+def _celda(valor, zona):
+    if valor is None:
+        return ''
+    if hasattr(valor, 'isoformat'):
+        return valor.astimezone(zona).isoformat() if timezone.is_aware(valor) else valor.isoformat()
+    valor = str(valor)
+    if valor.startswith(INICIO_FORMULA):
+        return "'" + valor
+    return valor
+
+
+def exportar_csv(consultas):
+    zona = timezone.get_current_timezone()
+    salida = io.StringIO()
+    escritor = csv.writer(salida)
+    escritor.writerow(ENCABEZADOS)
+    for bloque in bloques(consultas):
+        for fila in bloque:
+            recetas = ' | '.join(
+                f"{receta['medicamento']} {receta['dosis']} ({receta['horario']})" for receta in fila.pop('recetas')
+            )
+            escritor.writerow([_celda(valor, zona) for valor in fila.values()] + [_celda(recetas, zona)])
+        yield salida.getvalue()
+        salida.seek(0)
+        salida.truncate()
+    # Encabezado sin filas
+    if salida.tell():
+        yield salida.getvalue()
+
+
+def exportar_ndjson(consultas):
+    codificador = DjangoJSONEncoder(ensure_ascii=False)
+    for bloque in bloques(consultas):
+        yield ''.join(codificador.encode(fila) + '\n' for fila in bloque)
+
+
+def exportar(consultas, formato):
+    return exportar_csv(consultas) if formato == 'csv' else exportar_ndjson(consultas)
@@ -0,0 +1,73 @@
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+
+from .models import Consulta
+
+
+ESTADOS_VALIDOS = {valor for valor, _ in Consulta.ESTADO_CHOICES}
+
+
+def parse_fecha(valor, nombre, fin_de_dia=False):
+    """Acepta 'YYYY-MM-DD' o un datetime ISO. Con fin_de_dia una fecha sola se toma hasta el día siguiente."""
+    try:
+        fecha = parse_datetime(valor)
+        if fecha is None:
+            dia = parse_date(valor)
+            if dia is None:
+                raise ValueError
+            if fin_de_dia:
+                dia += timedelta(days=1)
+            fecha = datetime.combine(dia, time.min)
+    except ValueError:
+        raise ValidationError({'error': f'{nombre} debe ser una fecha ISO (YYYY-MM-DD)'})
+    if timezone.is_naive(fecha):
+        fecha = timezone.make_aware(fecha)
+    return fecha
+
+
+def filtrar_consultas(consultas, params):
+    """Aplica en la base de datos los filtros de la API de consultas.
+
+    - estado: uno o varios separados por coma (pendiente,aceptada)
+    - especialidad: nombre exacto
+    - desde / hasta: rango sobre fecha_inicio (hasta es inclusivo si es una fecha)
+    - especialista: id del especialista asignado, o 'ninguno' para las no asignadas
+    """
+    estado = params.get('estado')
+    if estado:
+        estados = [e.strip() for e in estado.split(',') if e.strip()]
+        invalidos = set(estados) - ESTADOS_VALIDOS
+        if invalidos:
+            raise ValidationError({'error': f'Estado no reconocido: {", ".join(sorted(invalidos))}'})
+        consultas = consultas.filter(estado__in=estados)
+
+    especialidad = params.get('especialidad')
+    if especialidad:
+        consultas = consultas.filter(especialidad=especialidad)
+
+    desde = params.get('desde')
+    if desde:
+        consultas = consultas.filter(fecha_inicio__gte=parse_fecha(desde, 'desde'))
+
+    hasta = params.get('hasta')
+    if hasta:
+        fecha_hasta = parse_fecha(hasta, 'hasta', fin_de_dia=True)
+        if parse_datetime(hasta) is None:
+            consultas = consultas.filter(fecha_inicio__lt=fecha_hasta)
+        else:
+            consultas = consultas.filter(fecha_inicio__lte=fecha_hasta)
+
+    especialista = params.get('especialista')
+    if especialista:
+        if especialista == 'ninguno':
+            consultas = consultas.filter(especialista_asignado__isnull=True)
+        else:
+            try:
+                consultas = consultas.filter(especialista_asignado_id=int(especialista))
+            except ValueError:
+                raise ValidationError({'error': 'especialista debe ser un id numérico o "ninguno"'})
+
+    return consultas
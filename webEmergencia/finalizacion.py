@@ -0,0 +1,227 @@
+"""Finalización de consultas (diagnóstico, recetas y control crónico), de a una o por lotes.
+
+Todo se valida antes de escribir. Después se escribe por lotes: un UPDATE
+condicional para los estados y un bulk_create por tabla, sin importar cuántas
+consultas ni recetas traiga la petición. Los controles de diagnósticos crónicos
+se crean después, en una tarea de la cola (tareas.py) encolada en la misma
+transacción.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from rest_framework import status
+
+from . import busqueda
+from .agenda import ConflictoAgenda, choques, cupos_libres
+from .estadisticas import programar
+from .eventos import publicar_cambios
+from .models import Consulta, Diagnostico, Especialista, Receta
+from .tareas import encolar, tarea
+from .transiciones import TRANSICIONES, aplicar
+
+
+# Consultas máximas por petición al endpoint de lote
+MAX_LOTE = 100
+
+DIAS_CONTROL_CRONICO = 7
+
+
+class ErrorFinalizacion(Exception):
+    def __init__(self, mensaje, status_code=status.HTTP_400_BAD_REQUEST):
+        super().__init__(mensaje)
+        self.mensaje = mensaje
+        self.status_code = status_code
+
+
+def validar_consulta(consulta, especialista):
+    if consulta is None:
+        raise ErrorFinalizacion('Consulta no encontrada', status.HTTP_404_NOT_FOUND)
+    if consulta.especialista_asignado_id != especialista.id:
+        raise ErrorFinalizacion('No tienes permiso para finalizar esta consulta', status.HTTP_403_FORBIDDEN)
+    if consulta.estado not in TRANSICIONES['finalizar'][0]:
+        raise ErrorFinalizacion(f'La consulta debe estar en estado "aceptada", estado actual: {consulta.estado}')
+
+
+def validar_datos(data):
+    """Diagnóstico y recetas enviados para una consulta"""
+    descripcion = data.get('descripcion')
+    if not descripcion:
+        raise ErrorFinalizacion('La descripción del diagnóstico es requerida')
+
+    recetas = data.get('recetas', [])
+    if not isinstance(recetas, list):
+        raise ErrorFinalizacion('Las recetas deben ser una lista')
+    for receta in recetas:
+        if not isinstance(receta, dict) or not all([receta.get('medicamento'), receta.get('dosis'), receta.get('horario')]):
+            raise ErrorFinalizacion('Cada receta debe tener medicamento, dosis y horario')
+
+    es_cronico = bool(data.get('es_cronico', False))
+    return {
+        'descripcion': descripcion,
+        'es_cronico': es_cronico,
+        'nombre_enfermedad': data.get('nombre_enfermedad') if es_cronico else None,
+        'recetas': [
+            {'medicamento': r['medicamento'], 'dosis': r['dosis'], 'horario': r['horario']} for r in recetas
+        ],
+    }
+
+
+def finalizar_consultas(especialista, items, queryset=None):
+    """Finaliza en una sola transacción las consultas de `items`, pares (pk, data).
+
+    Devuelve un resultado por ítem, en el mismo orden: (consulta, diagnostico) o el
+    ErrorFinalizacion que impidió finalizarla. Las que no pasan la validación no se
+    escriben; las demás se confirman juntas.
+    """
+    if queryset is None:
+        queryset = Consulta.objects.all()
+
+    with transaction.atomic():
+        # Bloquea las filas hasta el commit: nadie las acepta/cancela entre la validación y el UPDATE
+        ids = [pk for pk, _ in items if pk is not None]
+        consultas = queryset.select_for_update(of=('self',)).in_bulk(ids)
+
+        resultados = []
+        validas = []
+        vistas = set()
+        for pk, data in items:
+            try:
+                if pk in vistas:
+                    raise ErrorFinalizacion('La consulta está repetida en el lote')
+                vistas.add(pk)
+                consulta = consultas.get(pk)
+                validar_consulta(consulta, especialista)
+                datos = validar_datos(data)
+            except ErrorFinalizacion as e:
+                resultados.append(e)
+                continue
+            resultados.append(None)
+            validas.append((len(resultados) - 1, consulta, datos))
+
+        if not validas:
+            return resultados
+
+        actualizadas = aplicar('finalizar', Consulta.objects.filter(
+            pk__in=[consulta.pk for _, consulta, _ in validas],
+            especialista_asignado=especialista,
+        ))
+        if actualizadas != len(validas):
+            # Sólo posible en backends sin SELECT ... FOR UPDATE
+            raise ErrorFinalizacion(
+                'Algunas consultas cambiaron de estado durante la finalización, intente nuevamente',
+                status.HTTP_409_CONFLICT,
+            )
+
+        diagnosticos = Diagnostico.objects.bulk_create([
+            Diagnostico(
+                consulta=consulta,
+                descripcion=datos['descripcion'],
+                es_cronico=datos['es_cronico'],
+                nombre_enfermedad=datos['nombre_enfermedad'],
+            )
+            for _, consulta, datos in validas
+        ])
+        if any(diagnostico.pk is None for diagnostico in diagnosticos):
+            # Backends que no devuelven los ids del bulk_create
+            ids_diagnostico = dict(
+                Diagnostico.objects.filter(consulta__in=[d.consulta_id for d in diagnosticos])
+                .values_list('consulta_id', 'id')
+            )
+            for diagnostico in diagnosticos:
+                diagnostico.pk = ids_diagnostico[diagnostico.consulta_id]
+
+        Receta.objects.bulk_create([
+            Receta(diagnostico=diagnostico, **receta)
+            for diagnostico, (_, _, datos) in zip(diagnosticos, validas)
+            for receta in datos['recetas']
+        ])
+        busqueda.programar([consulta.pk for _, consulta, _ in validas])
+
+        cronicas = [consulta.pk for _, consulta, datos in validas if datos['es_cronico'] and datos['nombre_enfermedad']]
+        if cronicas:
+            encolar('crear_controles_cronicos', {'consultas': cronicas})
+
+        for (posicion, consulta, _), diagnostico in zip(validas, diagnosticos):
+            consulta.estado = 'finalizada'
+            resultados[posicion] = (consulta, diagnostico)
+        publicar_cambios([consulta for _, consulta, _ in validas])
+
+    return resultados
+
+
+def motivo_control(nombre_enfermedad):
+    return f'Control Crónico: {nombre_enfermedad}'
+
+
+def ubicar_control(especialista, prevista):
+    """(especialista, inicio, fin, estado) del control que se quiere desde `prevista`.
+
+    Con el especialista bloqueado: el primer cupo libre suyo desde esa fecha, dentro de
+    su HorarioEspecialista y sin chocar con su agenda. Si no tiene ninguno en el mes,
+    el control queda pendiente y sin asignar.
+    """
+    if especialista is not None:
+        cupo = next(iter(cupos_libres(especialista.especialidad, 1, desde=prevista, especialista_id=especialista.pk)), None)
+        if cupo is not None:
+            return especialista, cupo['inicio'], cupo['fin'], 'aceptada'
+    return None, prevista, None, 'pendiente'
+
+
+@tarea('crear_controles_cronicos')
+def crear_controles_cronicos(consultas):
+    """Agenda un control a DIAS_CONTROL_CRONICO días de cada consulta finalizada con diagnóstico crónico.
+
+    Cada control va al primer cupo libre del especialista desde esa fecha (ver
+    ubicar_control), con el mismo lock que reservar(), y se guarda antes de ubicar
+    el siguiente. Si aun así otra reserva se cruza, ConflictoAgenda: la tarea reintenta.
+    Repetible: no crea un control si el paciente ya tiene uno de esa enfermedad
+    desde la fecha prevista (el control pudo correrse a un cupo posterior).
+    """
+    with transaction.atomic():
+        origenes = list(
+            Consulta.objects.select_for_update(of=('self',))
+            .select_related('diagnostico_data')
+            .filter(pk__in=consultas, estado='finalizada', diagnostico_data__es_cronico=True)
+            .exclude(diagnostico_data__nombre_enfermedad__isnull=True)
+            .exclude(diagnostico_data__nombre_enfermedad='')
+            .order_by('pk')
+        )
+        if not origenes:
+            return
+        # Mismo lock que reservar(), en orden de pk para no cruzarse con otra tarea
+        especialistas = Especialista.objects.select_for_update().order_by('pk').in_bulk(
+            {consulta.especialista_asignado_id for consulta in origenes} - {None}
+        )
+
+        creados = []
+        for consulta in origenes:
+            diagnostico = consulta.diagnostico_data
+            motivo = motivo_control(diagnostico.nombre_enfermedad)
+            # fecha_emision y no now(): un reintento calcula la misma fecha
+            prevista = (consulta.fecha_inicio or diagnostico.fecha_emision) + timedelta(days=DIAS_CONTROL_CRONICO)
+            if Consulta.objects.filter(
+                fk_idpaciente_id=consulta.fk_idpaciente_id, motivo=motivo, fecha_inicio__gte=prevista,
+            ).exists():
+                continue
+
+            especialista, inicio, fin, estado = ubicar_control(especialistas.get(consulta.especialista_asignado_id), prevista)
+            # De a uno: el siguiente control ya ve a éste en la agenda
+            control, = Consulta.objects.bulk_create([Consulta(
+                fk_idpaciente_id=consulta.fk_idpaciente_id,
+                fk_idespecialista_id=consulta.fk_idespecialista_id,
+                especialista_asignado=especialista,
+                motivo=motivo,
+                especialidad=consulta.especialidad,
+                fecha_inicio=inicio,
+                fecha_fin=fin,
+                estado=estado,
+            )])
+            if especialista is not None and choques(especialista.pk, inicio, fin, excluir=control.pk).exists():
+                # Otra reserva ganó el cupo (backend sin SELECT ... FOR UPDATE): rollback y la cola reintenta
+                raise ConflictoAgenda(f'El cupo del control de la consulta {consulta.pk} fue tomado', consulta.pk)
+            creados.append(control)
+
+        if creados:
+            # bulk_create no dispara signals (sin ids en backends que no los devuelven: reconstruir_estadisticas)
+            programar([control.pk for control in creados if control.pk is not None])
+            busqueda.programar([control.pk for control in creados])
@@ -0,0 +1,26 @@
+from django.db import models
+from django.db.models import OrderBy
+
+
+class NullsLastIndex(models.Index):
+    """Índice con expresiones `DESC NULLS LAST` que también se puede crear en SQLite y MySQL.
+
+    PostgreSQL necesita NULLS LAST en el índice para servir un
+    ORDER BY ... DESC NULLS LAST. SQLite y MySQL no aceptan el modificador en
+    CREATE INDEX, pero allí DESC ya deja los NULL al final, así que basta quitarlo.
+    """
+
+    vendors_sin_modificador = ('sqlite', 'mysql')
+
+    def create_sql(self, model, schema_editor, using='', **kwargs):
+        if schema_editor.connection.vendor in self.vendors_sin_modificador:
+            index = self.clone()
+            index.expressions = tuple(self._sin_nulls_last(e) for e in self.expressions)
+            return super(NullsLastIndex, index).create_sql(model, schema_editor, using=using, **kwargs)
+        return super().create_sql(model, schema_editor, using=using, **kwargs)
+
+    @staticmethod
+    def _sin_nulls_last(expression):
+        if isinstance(expression, OrderBy) and expression.descending and expression.nulls_last:
+            return OrderBy(expression.expression, descending=True)
+        return expression
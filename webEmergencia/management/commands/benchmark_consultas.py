@@ -0,0 +1,155 @@
+import json
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from webEmergencia.models import Consulta
+from webEmergencia.pagination import KeysetPagination
+from webEmergencia.queries import consultas_para_serializar
+from webEmergencia.seed import sembrar
+
+
+class Command(BaseCommand):
+    help = 'Mide las consultas calientes de Consulta con y sin los índices de Meta.indexes (EXPLAIN + latencia)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sembrar', action='store_true', help='Sembrar datos sintéticos antes de medir')
+        parser.add_argument('--pacientes', type=int, default=20000)
+        parser.add_argument('--especialistas', type=int, default=60)
+        parser.add_argument('--consultas', type=int, default=500000)
+        parser.add_argument('--prefijo', default='B', help='Prefijo de RUT para los datos sembrados')
+        parser.add_argument('--repeticiones', type=int, default=20)
+        parser.add_argument('--sin-explain', action='store_true', help='No imprimir los planes EXPLAIN')
+        parser.add_argument('--json', dest='json_path', help='Guardar los resultados en este archivo JSON')
+
+    def handle(self, *args, **options):
+        if options['sembrar']:
+            self.stdout.write('Sembrando datos...')
+            sembrar(
+                pacientes=options['pacientes'],
+                especialistas=options['especialistas'],
+                consultas=options['consultas'],
+                prefijo=options['prefijo'],
+                log=lambda mensaje: self.stdout.write(f'  {mensaje}'),
+            )
+
+        total = Consulta.objects.count()
+        if not total:
+            self.stdout.write(self.style.ERROR('No hay consultas. Use --sembrar.'))
+            return
+        self.stdout.write(f'Consultas en la tabla: {total}')
+
+        consultas = self.consultas_calientes(total)
+        indices = list(Consulta._meta.indexes)
+        repeticiones = options['repeticiones']
+
+        self.analizar()
+        con_indices = self.medir(consultas, repeticiones)
+
+        # Se quitan los índices, se mide y se vuelven a crear (también en backends sin DDL transaccional)
+        with connection.schema_editor(atomic=False) as editor:
+            for index in indices:
+                editor.remove_index(Consulta, index)
+        try:
+            self.analizar()
+            sin_indices = self.medir(consultas, repeticiones)
+        finally:
+            with connection.schema_editor(atomic=False) as editor:
+                for index in indices:
+                    editor.add_index(Consulta, index)
+            self.analizar()
+
+        self.stdout.write('')
+        self.stdout.write(f'{"consulta":<32}{"sin índices (ms)":>18}{"con índices (ms)":>18}{"mejora":>10}')
+        resultados = []
+        for nombre in consultas:
+            antes = sin_indices[nombre]['p50_ms']
+            despues = con_indices[nombre]['p50_ms']
+            mejora = antes / despues if despues else float('inf')
+            self.stdout.write(f'{nombre:<32}{antes:>18.2f}{despues:>18.2f}{mejora:>9.1f}x')
+            resultados.append({
+                'consulta': nombre,
+                'sin_indices': sin_indices[nombre],
+                'con_indices': con_indices[nombre],
+            })
+
+        if not options['sin_explain']:
+            for nombre in consultas:
+                for etiqueta, medicion in (('SIN índices', sin_indices), ('CON índices', con_indices)):
+                    self.stdout.write('')
+                    self.stdout.write(self.style.MIGRATE_HEADING(f'{nombre} - {etiqueta}'))
+                    self.stdout.write(medicion[nombre]['plan'])
+
+        if options['json_path']:
+            with open(options['json_path'], 'w', encoding='utf-8') as archivo:
+                json.dump({
+                    'vendor': connection.vendor,
+                    'consultas_en_tabla': total,
+                    'repeticiones': repeticiones,
+                    'resultados': resultados,
+                }, archivo, indent=2, ensure_ascii=False)
+            self.stdout.write(self.style.SUCCESS(f'Resultados guardados en {options["json_path"]}'))
+
+    def consultas_calientes(self, total):
+        """Querysets equivalentes a los de las vistas más usadas"""
+        paginator = KeysetPagination()
+        orden = paginator.get_ordering()
+        page = paginator.page_size + 1
+
+        # Parámetros realistas tomados de los mismos datos
+        mitad = Consulta.objects.order_by(*orden).values('fecha_inicio', 'id')[total // 2]
+        paciente_id = (
+            Consulta.objects.values_list('fk_idpaciente', flat=True).order_by('-id').first()
+        )
+        especialista_id = (
+            Consulta.objects.filter(especialista_asignado__isnull=False)
+            .values_list('especialista_asignado', flat=True).order_by('-id').first()
+        )
+        especialidad = Consulta.objects.values_list('especialidad', flat=True).order_by('-id').first()
+
+        # Igual que KeysetPagination: la página se elige por claves, sin los JOIN de serialización
+        return {
+            'listado_medico': Consulta.objects.order_by(*orden).values_list('pk', 'fecha_inicio')[:page],
+            'listado_medico_pagina_profunda': Consulta.objects
+                .filter(paginator.filtro_despues_de(mitad['fecha_inicio'], mitad['id']))
+                .order_by(*orden).values_list('pk', 'fecha_inicio')[:page],
+            'filtro_estado_aceptada': Consulta.objects
+                .filter(estado='aceptada').order_by(*orden).values_list('pk', 'fecha_inicio')[:page],
+            'pagina_por_pk': consultas_para_serializar().filter(pk__in=[
+                pk for pk, _ in Consulta.objects.order_by(*orden).values_list('pk', 'fecha_inicio')[:page]
+            ]),
+            'historial_paciente': Consulta.objects.filter(fk_idpaciente=paciente_id).order_by(*orden),
+            'agenda_especialista': Consulta.objects
+                .filter(especialista_asignado=especialista_id, estado='aceptada')
+                .order_by('fecha_inicio')[:50],
+            'pendientes_por_especialidad': Consulta.objects
+                .filter(estado='pendiente', especialidad=especialidad)
+                .order_by('fecha_inicio', 'id')[:page],
+        }
+
+    def medir(self, consultas, repeticiones):
+        resultados = {}
+        for nombre, queryset in consultas.items():
+            list(queryset.all())  # calentar caché
+            tiempos = []
+            for _ in range(repeticiones):
+                inicio = time.perf_counter()
+                list(queryset.all())
+                tiempos.append((time.perf_counter() - inicio) * 1000)
+            resultados[nombre] = {
+                'p50_ms': round(statistics.median(tiempos), 3),
+                'min_ms': round(min(tiempos), 3),
+                'max_ms': round(max(tiempos), 3),
+                'plan': queryset.explain(),
+            }
+        return resultados
+
+    def analizar(self):
+        """Actualiza las estadísticas del planificador para que use (o no) los índices"""
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('ANALYZE consulta')
+            elif connection.vendor == 'sqlite':
+                cursor.execute('ANALYZE')
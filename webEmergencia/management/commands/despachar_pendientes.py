@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from webEmergencia.despacho import repartir_pendientes
+from webEmergencia.models import Consulta, Especialista
+
+
+class Command(BaseCommand):
+    help = 'Asigna las consultas pendientes al especialista con menos citas abiertas de cada especialidad'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--especialidad', action='append', help='Sólo estas especialidades (se puede repetir)')
+        parser.add_argument('--limite', type=int, default=100, help='Pendientes por especialidad y pasada')
+        parser.add_argument('--intervalo', type=float, default=0,
+                            help='Segundos entre pasadas; 0 hace una sola pasada')
+
+    def handle(self, *args, **options):
+        while True:
+            especialidades = options['especialidad'] or list(
+                Especialista.objects.order_by().values_list('especialidad', flat=True).distinct()
+            )
+            total = 0
+            for especialidad in especialidades:
+                asignadas = repartir_pendientes(especialidad, limite=options['limite'])
+                if asignadas:
+                    self.stdout.write(f'{especialidad}: {len(asignadas)} asignadas')
+                total += len(asignadas)
+
+            restantes = Consulta.objects.filter(estado='pendiente', especialidad__in=especialidades).count()
+            self.stdout.write(self.style.SUCCESS(f'{total} consultas asignadas, {restantes} pendientes'))
+            if not options['intervalo']:
+                return
+            time.sleep(options['intervalo'])
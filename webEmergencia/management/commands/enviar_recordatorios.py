@@ -0,0 +1,49 @@
+import signal
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from webEmergencia.recordatorios import TAMANO_LOTE, entregar, escanear, limpiar, obtener_backend
+
+# Segundos entre limpiezas de recordatorios viejos
+LIMPIEZA = 3600
+
+
+class Command(BaseCommand):
+    help = 'Crea y entrega los recordatorios de citas aceptadas (24 h y 1 h antes, ver RECORDATORIOS_NIVELES)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--intervalo', type=float, default=60, help='Segundos entre pasadas')
+        parser.add_argument('--una-pasada', action='store_true', help='Una sola pasada (cron, pruebas)')
+        parser.add_argument('--lote', type=int, default=TAMANO_LOTE, help='Recordatorios por entrega al backend')
+        parser.add_argument('--backend', help='Ruta del backend; por defecto RECORDATORIOS_BACKEND')
+
+    def handle(self, *args, **options):
+        backend = obtener_backend(options['backend'])
+        detener = threading.Event()
+
+        def pedir_detencion(signum, frame):
+            # Termina la pasada en curso y sale
+            detener.set()
+
+        signal.signal(signal.SIGTERM, pedir_detencion)
+        signal.signal(signal.SIGINT, pedir_detencion)
+
+        ultima_limpieza = 0
+        while not detener.is_set():
+            inicio = time.perf_counter()
+            revisadas = escanear()
+            totales = entregar(backend, options['lote'])
+            if time.monotonic() - ultima_limpieza > LIMPIEZA:
+                limpiar()
+                ultima_limpieza = time.monotonic()
+
+            if any(revisadas.values()) or totales or options['verbosity'] >= 2:
+                self.stdout.write(
+                    f"citas revisadas {revisadas}; enviados {totales['enviados']}, descartados {totales['descartados']}, "
+                    f"fallidos {totales['fallidos']} ({time.perf_counter() - inicio:.2f}s)"
+                )
+            if options['una_pasada']:
+                return
+            detener.wait(options['intervalo'])
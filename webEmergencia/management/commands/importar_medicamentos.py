@@ -0,0 +1,168 @@
+import csv
+import io
+import json
+import os
+import time
+import zipfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from webEmergencia.catalogo import catalogo, escribir_indice, normalizar, ruta_indice
+from webEmergencia.models import Medicamento
+
+
+def iterar_resultados_openfda(archivo, tamano_bloque=1 << 20):
+    """Recorre el arreglo "results" de un dump de OpenFDA sin cargar el JSON completo.
+
+    Los dumps de drug/label pesan cientos de MB; json.load los duplicaría en memoria.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    en_resultados = False
+    fin_archivo = False
+
+    while True:
+        if not en_resultados:
+            inicio = buffer.find('"results"')
+            if inicio != -1:
+                corchete = buffer.find('[', inicio)
+                if corchete != -1:
+                    pos = corchete + 1
+                    en_resultados = True
+                    continue
+        else:
+            # Saltar separadores entre objetos
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos < len(buffer) and buffer[pos] == ']':
+                return
+            if pos < len(buffer):
+                try:
+                    objeto, fin = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if fin_archivo:
+                        raise
+                else:
+                    yield objeto
+                    pos = fin
+                    continue
+
+        if fin_archivo:
+            if en_resultados:
+                raise CommandError('El archivo terminó antes de cerrar "results"')
+            return
+        bloque = archivo.read(tamano_bloque)
+        if not bloque:
+            fin_archivo = True
+        buffer = buffer[pos:] + bloque if en_resultados else buffer + bloque
+        if en_resultados:
+            pos = 0
+
+
+def medicamentos_openfda(resultado):
+    openfda = resultado.get('openfda') or {}
+    genericos = openfda.get('generic_name') or []
+    generico = genericos[0] if genericos else None
+    for marca in openfda.get('brand_name') or []:
+        yield marca, generico
+
+
+def medicamentos_csv(archivo):
+    """CSV con columna nombre (o brand_name) y opcionalmente generico (o generic_name)"""
+    for fila in csv.DictReader(archivo):
+        nombre = fila.get('nombre') or fila.get('brand_name')
+        generico = fila.get('generico') or fila.get('generic_name') or None
+        if nombre:
+            yield nombre, generico
+
+
+def leer_archivo(ruta):
+    """Pares (nombre, generico) de un .json, .json.zip o .csv"""
+    if ruta.endswith('.zip'):
+        with zipfile.ZipFile(ruta) as zip_file:
+            for miembro in zip_file.namelist():
+                if not miembro.endswith('.json'):
+                    continue
+                with zip_file.open(miembro) as crudo:
+                    texto = io.TextIOWrapper(crudo, encoding='utf-8')
+                    for resultado in iterar_resultados_openfda(texto):
+                        yield from medicamentos_openfda(resultado)
+    elif ruta.endswith('.json'):
+        with open(ruta, encoding='utf-8') as texto:
+            for resultado in iterar_resultados_openfda(texto):
+                yield from medicamentos_openfda(resultado)
+    elif ruta.endswith('.csv'):
+        with open(ruta, encoding='utf-8', newline='') as texto:
+            yield from medicamentos_csv(texto)
+    else:
+        raise CommandError(f'Formato no soportado: {ruta} (use .json, .json.zip o .csv)')
+
+
+class Command(BaseCommand):
+    help = 'Importa medicamentos desde dumps de OpenFDA (drug/label .json o .json.zip) o CSV y reconstruye el índice local'
+
+    def add_arguments(self, parser):
+        parser.add_argument('archivos', nargs='*', help='Archivos a importar')
+        parser.add_argument('--fuente', default='openfda')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--reemplazar', action='store_true', help='Borrar el catálogo antes de importar')
+        parser.add_argument('--solo-indice', action='store_true', help='No importar, sólo reconstruir el índice desde la tabla')
+
+    def handle(self, *args, **options):
+        if not options['archivos'] and not options['solo_indice']:
+            raise CommandError('Indique al menos un archivo o use --solo-indice')
+
+        if not options['solo_indice']:
+            self.importar(options)
+
+        inicio = time.perf_counter()
+        ruta = ruta_indice()
+        total = Medicamento.objects.count()
+        tamano = escribir_indice(Medicamento.objects.values_list('nombre', 'generico').iterator(), ruta)
+        catalogo.invalidar()
+        self.stdout.write(self.style.SUCCESS(
+            f'Índice con {total} medicamentos escrito en {ruta} '
+            f'({tamano / 1024:.0f} KB, {time.perf_counter() - inicio:.1f} s)'
+        ))
+
+    def importar(self, options):
+        batch_size = options['batch_size']
+        if options['reemplazar']:
+            Medicamento.objects.all().delete()
+
+        vistos = set(Medicamento.objects.values_list('nombre_normalizado', flat=True))
+        lote = []
+        nuevos = 0
+        inicio = time.perf_counter()
+
+        def guardar(lote):
+            with transaction.atomic():
+                Medicamento.objects.bulk_create(lote, batch_size=batch_size, ignore_conflicts=True)
+
+        for ruta in options['archivos']:
+            if not os.path.exists(ruta):
+                raise CommandError(f'No existe el archivo {ruta}')
+            self.stdout.write(f'Leyendo {ruta}...')
+            for nombre, generico in leer_archivo(ruta):
+                nombre = ' '.join(nombre.split())[:255]
+                clave = normalizar(nombre)[:255]
+                if not clave or clave in vistos:
+                    continue
+                vistos.add(clave)
+                lote.append(Medicamento(
+                    nombre=nombre,
+                    nombre_normalizado=clave,
+                    generico=' '.join(generico.split())[:255] if generico else None,
+                    fuente=options['fuente'],
+                ))
+                if len(lote) >= batch_size:
+                    guardar(lote)
+                    nuevos += len(lote)
+                    lote = []
+        if lote:
+            guardar(lote)
+            nuevos += len(lote)
+
+        self.stdout.write(f'{nuevos} medicamentos nuevos en {time.perf_counter() - inicio:.1f} s')
@@ -0,0 +1,335 @@
+import csv
+import gzip
+import json
+import os
+import secrets
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX, make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from webEmergencia.forms import CitaForm
+from webEmergencia.models import Consulta, Paciente, Persona
+
+ESPECIALIDADES = {valor for valor, _ in CitaForm.ESPECIALIDADES}
+
+# Contraseñas que ya vienen hasheadas (exportadas de otro sistema) se guardan tal cual
+PREFIJOS_HASH = ('pbkdf2_sha256$', 'bcrypt$', 'bcrypt_sha256$', 'argon2$', '$2')
+
+# Contraseñas por tarea del pool: suficientes para amortizar el envío entre procesos
+HASHES_POR_TAREA = 16
+
+
+class FilaInvalida(Exception):
+    pass
+
+
+def iniciar_proceso():
+    """Los procesos del pool (spawn) necesitan Django configurado para make_password"""
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+
+def hashear(contrasenas):
+    return [make_password(contrasena) for contrasena in contrasenas]
+
+
+def abrir(ruta):
+    if ruta.endswith('.gz'):
+        return gzip.open(ruta, 'rt', encoding='utf-8', newline='')
+    return open(ruta, encoding='utf-8', newline='')
+
+
+def leer_filas(ruta):
+    """(número de fila, dict) de un .csv o .ndjson/.jsonl (opcionalmente .gz), sin cargar el archivo"""
+    nombre = ruta[:-3] if ruta.endswith('.gz') else ruta
+    with abrir(ruta) as archivo:
+        if nombre.endswith('.csv'):
+            for numero, fila in enumerate(csv.DictReader(archivo), start=1):
+                yield numero, fila
+        elif nombre.endswith(('.ndjson', '.jsonl')):
+            for numero, linea in enumerate(archivo, start=1):
+                if not linea.strip():
+                    continue
+                try:
+                    fila = json.loads(linea)
+                except json.JSONDecodeError as e:
+                    fila = {'_error': f'JSON inválido: {e}'}
+                yield numero, fila if isinstance(fila, dict) else {'_error': 'Se esperaba un objeto JSON'}
+        else:
+            raise CommandError(f'Formato no soportado: {ruta} (use .csv, .ndjson o .jsonl, opcionalmente .gz)')
+
+
+def _texto(fila, campo, maximo, requerido=False):
+    valor = fila.get(campo)
+    valor = '' if valor is None else str(valor).strip()
+    if requerido and not valor:
+        raise FilaInvalida(f'Falta {campo}')
+    if len(valor) > maximo:
+        raise FilaInvalida(f'{campo} supera {maximo} caracteres')
+    return valor
+
+
+def validar(fila):
+    """Fila del archivo -> datos limpios, o FilaInvalida"""
+    if '_error' in fila:
+        raise FilaInvalida(fila['_error'])
+
+    datos = {
+        'rut': _texto(fila, 'rut', 10, requerido=True),
+        'nombre': _texto(fila, 'nombre', 100, requerido=True),
+        'apellido': _texto(fila, 'apellido', 100, requerido=True),
+        'correo': _texto(fila, 'correo', 100, requerido=True).lower(),
+        'contrasena': _texto(fila, 'contrasena', 128),
+        'telefono': _texto(fila, 'telefono', 20),
+        'direccion': _texto(fila, 'direccion', 100),
+        'motivo': _texto(fila, 'motivo', 255),
+        'sintomas': _texto(fila, 'sintomas', 255),
+    }
+    if '@' not in datos['correo'][1:-1]:
+        raise FilaInvalida('correo inválido')
+
+    try:
+        datos['fecha_nacimiento'] = parse_date(_texto(fila, 'fecha_nacimiento', 10, requerido=True))
+    except ValueError:
+        datos['fecha_nacimiento'] = None
+    if datos['fecha_nacimiento'] is None:
+        raise FilaInvalida('fecha_nacimiento debe ser YYYY-MM-DD')
+
+    # La consulta es opcional: sólo si la fila trae motivo
+    if datos['motivo']:
+        valor = _texto(fila, 'fecha_inicio', 40)
+        fecha = None
+        if valor:
+            try:
+                fecha = parse_datetime(valor)
+            except ValueError:
+                fecha = None
+            if fecha is None:
+                raise FilaInvalida('fecha_inicio debe ser una fecha ISO')
+            if timezone.is_naive(fecha):
+                fecha = timezone.make_aware(fecha)
+        datos['fecha_inicio'] = fecha
+        datos['especialidad'] = _texto(fila, 'especialidad', 100) or 'Medicina General'
+        if datos['especialidad'] not in ESPECIALIDADES:
+            raise FilaInvalida(f"especialidad desconocida: {datos['especialidad']}")
+    return datos
+
+
+class Command(BaseCommand):
+    help = ('Importa pacientes (y opcionalmente una consulta por paciente) desde CSV o NDJSON en lotes, '
+            'hasheando las contraseñas en un pool de procesos')
+
+    def add_arguments(self, parser):
+        parser.add_argument('archivo', help='.csv, .ndjson o .jsonl (opcionalmente .gz)')
+        parser.add_argument('--lote', type=int, default=5000, help='Filas por transacción')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Filas por INSERT')
+        parser.add_argument('--procesos', type=int, default=os.cpu_count() or 1,
+                            help='Procesos para hashear contraseñas; 0 hashea en el proceso principal')
+        parser.add_argument('--progreso', help='Archivo de avance (por defecto <archivo>.progreso)')
+        parser.add_argument('--reanudar', action='store_true', help='Saltar las filas ya confirmadas según --progreso')
+        parser.add_argument('--errores', help='Escribir aquí las filas rechazadas (CSV: fila, error)')
+
+    def handle(self, *args, **options):
+        ruta = options['archivo']
+        if not os.path.exists(ruta):
+            raise CommandError(f'No existe el archivo {ruta}')
+        self.batch_size = options['batch_size']
+        ruta_progreso = options['progreso'] or f'{ruta}.progreso'
+
+        saltar = 0
+        if options['reanudar'] and os.path.exists(ruta_progreso):
+            with open(ruta_progreso) as archivo:
+                saltar = json.load(archivo)['filas']
+            self.stdout.write(f'Reanudando después de la fila {saltar}')
+
+        errores = open(options['errores'], 'w', newline='', encoding='utf-8') if options['errores'] else None
+        escritor_errores = csv.writer(errores) if errores else None
+
+        # El pool se crea antes de abrir conexiones: los procesos no heredan sockets de la base de datos
+        connections.close_all()
+        pool = None
+        if options['procesos'] > 0:
+            pool = ProcessPoolExecutor(options['procesos'], initializer=iniciar_proceso)
+
+        totales = {'filas': 0, 'pacientes': 0, 'consultas': 0, 'existentes': 0, 'rechazadas': 0}
+        inicio = time.perf_counter()
+        ultima_fila = saltar
+        try:
+            # Mientras se escribe un lote, el pool ya hashea las contraseñas del siguiente
+            en_vuelo = None
+            for lote in self.lotes(leer_filas(ruta), options['lote'], saltar):
+                totales['filas'] += len(lote)
+                validas = []
+                for numero, fila in lote:
+                    try:
+                        validas.append((numero, validar(fila)))
+                    except FilaInvalida as e:
+                        totales['rechazadas'] += 1
+                        if escritor_errores:
+                            escritor_errores.writerow([numero, str(e)])
+                hashes = self.encargar_hashes(pool, validas)
+                if en_vuelo:
+                    ultima_fila = self.confirmar(en_vuelo, totales, escritor_errores, ruta_progreso, inicio)
+                en_vuelo = (lote[-1][0], validas, hashes)
+            if en_vuelo:
+                ultima_fila = self.confirmar(en_vuelo, totales, escritor_errores, ruta_progreso, inicio)
+        finally:
+            if pool:
+                pool.shutdown(cancel_futures=True)
+            if errores:
+                errores.close()
+
+        duracion = time.perf_counter() - inicio
+        self.stdout.write(self.style.SUCCESS(
+            f"{totales['filas']} filas en {duracion:.1f} s ({totales['filas'] / max(duracion, 1e-9):.0f} filas/s): "
+            f"{totales['pacientes']} pacientes y {totales['consultas']} consultas nuevas, "
+            f"{totales['existentes']} pacientes ya existían, {totales['rechazadas']} filas rechazadas "
+            f"(última fila {ultima_fila})"
+        ))
+
+    @staticmethod
+    def lotes(filas, tamano, saltar):
+        lote = []
+        for numero, fila in filas:
+            if numero <= saltar:
+                continue
+            lote.append((numero, fila))
+            if len(lote) >= tamano:
+                yield lote
+                lote = []
+        if lote:
+            yield lote
+
+    @staticmethod
+    def encargar_hashes(pool, validas):
+        """Futuros con los hashes de las contraseñas en texto plano del lote"""
+        planas = [
+            datos['contrasena'] for _, datos in validas
+            if datos['contrasena'] and not datos['contrasena'].startswith(PREFIJOS_HASH)
+        ]
+        if pool is None:
+            return [hashear(planas)]
+        return [
+            pool.submit(hashear, planas[i:i + HASHES_POR_TAREA])
+            for i in range(0, len(planas), HASHES_POR_TAREA)
+        ]
+
+    def confirmar(self, en_vuelo, totales, escritor_errores, ruta_progreso, inicio):
+        ultima_fila, validas, hashes = en_vuelo
+        hashes = iter([
+            contrasena
+            for parte in hashes
+            for contrasena in (parte if isinstance(parte, list) else parte.result())
+        ])
+        for _, datos in validas:
+            contrasena = datos['contrasena']
+            if not contrasena:
+                # Sin contraseña: inutilizable hasta que la persona la restablezca. Es lo mismo que
+                # make_password(None), sin sus 40 llamadas a urandom por fila
+                datos['contrasena'] = UNUSABLE_PASSWORD_PREFIX + secrets.token_urlsafe(30)
+            elif not contrasena.startswith(PREFIJOS_HASH):
+                datos['contrasena'] = next(hashes)
+
+        rechazos = self.escribir(validas, totales)
+        totales['rechazadas'] += len(rechazos)
+        if escritor_errores:
+            escritor_errores.writerows(rechazos)
+
+        # Después del commit: si el proceso muere aquí, el lote se repite y no duplica nada (ver escribir)
+        temporal = f'{ruta_progreso}.tmp'
+        with open(temporal, 'w') as archivo:
+            json.dump({'filas': ultima_fila}, archivo)
+        os.replace(temporal, ruta_progreso)
+
+        duracion = time.perf_counter() - inicio
+        self.stdout.write(
+            f"  fila {ultima_fila}: {totales['pacientes']} pacientes, {totales['consultas']} consultas "
+            f"({totales['pacientes'] / max(duracion, 1e-9):.0f} pacientes/s)"
+        )
+        return ultima_fila
+
+    def escribir(self, validas, totales):
+        """Inserta un lote en una transacción; devuelve las filas rechazadas [(fila, error)].
+
+        Es idempotente: las personas que ya existen no se vuelven a crear y una consulta
+        igual (paciente, fecha, motivo) a una existente no se duplica.
+        """
+        rechazos = []
+        with transaction.atomic():
+            ruts = {datos['rut'] for _, datos in validas}
+            correos = {datos['correo'] for _, datos in validas}
+            existentes = dict(Persona.objects.filter(rut__in=ruts).values_list('rut', 'correo'))
+            correo_a_rut = dict(Persona.objects.filter(correo__in=correos).values_list('correo', 'rut'))
+            pacientes = dict(Paciente.objects.filter(fk_rut__in=ruts).values_list('fk_rut', 'id'))
+
+            personas, nuevos_pacientes, filas_consulta = [], [], []
+            vistos_rut, vistos_correo = set(), set()
+            for numero, datos in validas:
+                rut, correo = datos['rut'], datos['correo']
+                if rut in existentes or rut in vistos_rut:
+                    if rut in vistos_rut and rut not in existentes:
+                        rechazos.append([numero, f'rut {rut} repetido en el archivo'])
+                        continue
+                    totales['existentes'] += 1
+                else:
+                    if correo in correo_a_rut or correo in vistos_correo:
+                        rechazos.append([numero, f'correo {correo} ya usado por otra persona'])
+                        continue
+                    vistos_rut.add(rut)
+                    vistos_correo.add(correo)
+                    persona = Persona(
+                        rut=rut, nombre=datos['nombre'], apellido=datos['apellido'],
+                        correo=correo, contrasena=datos['contrasena'],
+                    )
+                    # bulk_create no pasa por save()
+                    persona.completar_busqueda()
+                    personas.append(persona)
+                    nuevos_pacientes.append(Paciente(
+                        fk_rut_id=rut, fecha_nacimiento=datos['fecha_nacimiento'],
+                        telefono=datos['telefono'], direccion=datos['direccion'],
+                    ))
+                if datos['motivo']:
+                    filas_consulta.append((numero, datos))
+
+            Persona.objects.bulk_create(personas, batch_size=self.batch_size)
+            Paciente.objects.bulk_create(nuevos_pacientes, batch_size=self.batch_size)
+            if any(paciente.pk is None for paciente in nuevos_pacientes):
+                # Backends que no devuelven los ids del bulk_create
+                pacientes.update(Paciente.objects.filter(fk_rut__in=vistos_rut).values_list('fk_rut', 'id'))
+            else:
+                pacientes.update((paciente.fk_rut_id, paciente.pk) for paciente in nuevos_pacientes)
+
+            # Consultas ya importadas de pacientes que existían (reintento de un lote)
+            previas = set(Consulta.objects.filter(
+                fk_idpaciente_id__in=[pacientes[rut] for rut in existentes if rut in pacientes],
+            ).values_list('fk_idpaciente_id', 'fecha_inicio', 'motivo'))
+
+            consultas = []
+            for numero, datos in filas_consulta:
+                paciente_id = pacientes.get(datos['rut'])
+                if paciente_id is None:
+                    rechazos.append([numero, f"la persona {datos['rut']} existe pero no es paciente"])
+                    continue
+                clave = (paciente_id, datos['fecha_inicio'], datos['motivo'])
+                if clave in previas:
+                    continue
+                previas.add(clave)
+                consultas.append(Consulta(
+                    fk_idpaciente_id=paciente_id,
+                    motivo=datos['motivo'],
+                    sintomas=datos['sintomas'] or None,
+                    fecha_inicio=datos['fecha_inicio'],
+                    especialidad=datos['especialidad'],
+                ))
+            Consulta.objects.bulk_create(consultas, batch_size=self.batch_size)
+
+        totales['pacientes'] += len(personas)
+        totales['consultas'] += len(consultas)
+        return rechazos
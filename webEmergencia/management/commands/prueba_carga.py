@@ -0,0 +1,148 @@
+import json
+import subprocess
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from webEmergencia.carga import RONDAS, ejecutar, limpiar_usuarios, preparar, resumir
+from webEmergencia.models import Consulta, Persona
+from webEmergencia.seed import limpiar, sembrar
+
+
+class Command(BaseCommand):
+    help = ('Prueba de carga HTTP contra un servidor en marcha (runserver o gunicorn con la misma base de datos): '
+            'sesiones de pacientes y médicos, latencias p50/p95/p99 y consultas SQL por endpoint')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='Servidor a probar')
+        parser.add_argument('--sembrar', action='store_true', help='Sembrar datos sintéticos antes de medir')
+        parser.add_argument('--pacientes', type=int, default=2000)
+        parser.add_argument('--especialistas', type=int, default=40)
+        parser.add_argument('--consultas', type=int, default=50000)
+        parser.add_argument('--prefijo', default='C', help='Prefijo de RUT de los datos sembrados y sus usuarios')
+        parser.add_argument('--semilla', type=int, default=42)
+        parser.add_argument('--usuarios-paciente', type=int, default=8, help='Pacientes simultáneos (un hilo cada uno)')
+        parser.add_argument('--usuarios-medico', type=int, default=4, help='Médicos simultáneos (un hilo cada uno)')
+        parser.add_argument('--duracion', type=float, default=30, help='Segundos de carga')
+        parser.add_argument('--rondas', type=int, default=RONDAS, help='Recorridos por sesión antes de volver a iniciar sesión')
+        parser.add_argument('--pausa-ms', type=float, default=0, help='Pausa de cada usuario entre peticiones')
+        parser.add_argument('--json', dest='json_path', help='Guardar los resultados en este archivo JSON')
+        parser.add_argument('--comparar', help='JSON de una corrida anterior para mostrar las diferencias')
+        parser.add_argument('--limpiar', action='store_true', help='Borrar al final los datos y usuarios con el prefijo')
+
+    def handle(self, *args, **options):
+        prefijo = options['prefijo']
+        if options['sembrar']:
+            self.stdout.write('Sembrando datos...')
+            limpiar(prefijo)
+            sembrar(
+                pacientes=options['pacientes'],
+                especialistas=options['especialistas'],
+                consultas=options['consultas'],
+                prefijo=prefijo,
+                semilla=options['semilla'],
+                log=lambda mensaje: self.stdout.write(f'  {mensaje}'),
+            )
+
+        pacientes, medicos = preparar(prefijo, options['usuarios_paciente'], options['usuarios_medico'])
+        if len(pacientes) < options['usuarios_paciente'] or len(medicos) < options['usuarios_medico']:
+            raise CommandError(f'Faltan pacientes o especialistas con prefijo "{prefijo}". Use --sembrar.')
+        # Sin conexiones abiertas mientras el servidor escribe (SQLite bloquea la base completa)
+        connection.close()
+
+        self.stdout.write(
+            f'{len(pacientes)} pacientes y {len(medicos)} médicos contra {options["url"]} '
+            f'durante {options["duracion"]:.0f}s...'
+        )
+        segundos, muestras = ejecutar(
+            options['url'], pacientes, medicos, options['duracion'],
+            rondas=options['rondas'], pausa=options['pausa_ms'] / 1000, semilla=options['semilla'],
+        )
+        if not muestras:
+            raise CommandError('No se hizo ninguna petición')
+
+        endpoints = {endpoint: resumir(lista, segundos) for endpoint, lista in sorted(muestras.items())}
+        total = resumir([muestra for lista in muestras.values() for muestra in lista], segundos)
+        self.imprimir(endpoints, total, segundos)
+
+        resultado = {
+            'fecha': timezone.now().isoformat(),
+            'commit': self.commit(),
+            'url': options['url'],
+            'base_de_datos': connection.vendor,
+            'datos': {'personas': Persona.objects.count(), 'consultas': Consulta.objects.count()},
+            'usuarios': {'pacientes': len(pacientes), 'medicos': len(medicos)},
+            'duracion_s': round(segundos, 2),
+            'rondas': options['rondas'],
+            'pausa_ms': options['pausa_ms'],
+            'total': total,
+            'endpoints': endpoints,
+        }
+        if options['comparar']:
+            self.comparar(options['comparar'], resultado)
+        if options['json_path']:
+            with open(options['json_path'], 'w', encoding='utf-8') as archivo:
+                json.dump(resultado, archivo, indent=2, ensure_ascii=False)
+            self.stdout.write(self.style.SUCCESS(f'Resultados guardados en {options["json_path"]}'))
+
+        if options['limpiar']:
+            limpiar_usuarios(prefijo)
+            limpiar(prefijo)
+            self.stdout.write(f'Datos con prefijo "{prefijo}" borrados')
+
+    def imprimir(self, endpoints, total, segundos):
+        self.stdout.write('')
+        self.stdout.write(
+            f'{"endpoint":<42}{"pet.":>7}{"pet/s":>8}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"SQL":>7}{"err.":>6}'
+        )
+        for endpoint, datos in [*endpoints.items(), ('TOTAL', total)]:
+            sql = f'{datos["sql_media"]:.1f}' if datos['sql_media'] is not None else '-'
+            self.stdout.write(
+                f'{endpoint:<42}{datos["peticiones"]:>7}{datos["por_segundo"]:>8.1f}{datos["p50_ms"]:>9.1f}'
+                f'{datos["p95_ms"]:>9.1f}{datos["p99_ms"]:>9.1f}{sql:>7}{datos["errores"]:>6}'
+            )
+        if total['sql_media'] is None:
+            self.stdout.write('(Para contar consultas SQL, iniciar el servidor con CONTAR_CONSULTAS_SQL=1)')
+        otros = {estado: n for estado, n in total['estados'].items() if not estado.startswith('2')}
+        if otros:
+            self.stdout.write(f'Respuestas no 2xx: {otros} (0 = sin respuesta)')
+        self.stdout.write(f'{total["peticiones"]} peticiones en {segundos:.1f}s')
+
+    def comparar(self, ruta, actual):
+        try:
+            with open(ruta, encoding='utf-8') as archivo:
+                anterior = json.load(archivo)
+        except (OSError, ValueError) as e:
+            raise CommandError(f'No se pudo leer {ruta}: {e}')
+
+        self.stdout.write('')
+        self.stdout.write(self.style.MIGRATE_HEADING(f'Comparación con {ruta} (commit {anterior.get("commit")})'))
+        self.stdout.write(f'{"endpoint":<42}{"p95 antes":>11}{"p95 ahora":>11}{"pet/s antes":>13}{"pet/s ahora":>13}{"SQL antes -> ahora":>22}')
+        filas = {**actual['endpoints'], 'TOTAL': actual['total']}
+        previas = {**anterior.get('endpoints', {}), 'TOTAL': anterior.get('total', {})}
+        for endpoint, datos in filas.items():
+            antes = previas.get(endpoint)
+            if not antes:
+                continue
+            sql = f'{antes.get("sql_media", "-")} -> {datos["sql_media"]}' if datos['sql_media'] is not None else '-'
+            linea = (
+                f'{endpoint:<42}{antes["p95_ms"]:>11.1f}{datos["p95_ms"]:>11.1f}'
+                f'{antes["por_segundo"]:>13.1f}{datos["por_segundo"]:>13.1f}{sql:>22}'
+            )
+            # Más de un 20 % peor en p95 o con más consultas SQL
+            peor = datos['p95_ms'] > antes['p95_ms'] * 1.2 or (
+                datos['sql_media'] is not None and antes.get('sql_media') is not None
+                and datos['sql_media'] > antes['sql_media']
+            )
+            self.stdout.write(self.style.WARNING(linea) if peor else linea)
+
+    def commit(self):
+        try:
+            salida = subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=5,
+            )
+        except (OSError, subprocess.SubprocessError):
+            return None
+        return salida.stdout.strip() or None
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from webEmergencia import personas
+from webEmergencia.busqueda import TAMANO_LOTE, faltan, reconstruir
+
+
+class Command(BaseCommand):
+    help = 'Vuelve a cargar el texto buscable de consultas y personas (tras importaciones, seed o las migraciones 0017 y 0018)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=TAMANO_LOTE, help='Filas por lectura y por inserción')
+        parser.add_argument('--si-faltan', action='store_true',
+                            help='Sólo si hay consultas sin indexar (build.sh lo corre en cada despliegue)')
+
+    def handle(self, *args, **options):
+        if options['si_faltan'] and not faltan():
+            self.stdout.write('Búsqueda al día')
+            return
+        inicio = time.perf_counter()
+        consultas = reconstruir(tamano=options['lote'])
+        cambiadas = personas.reconstruir(tamano=options['lote'])
+        self.stdout.write(self.style.SUCCESS(
+            f'{consultas} consultas indexadas para búsqueda, {cambiadas} personas actualizadas '
+            f'({time.perf_counter() - inicio:.1f}s)'
+        ))
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from webEmergencia.estadisticas import TAMANO_LOTE, faltan, reconstruir
+
+
+class Command(BaseCommand):
+    help = 'Recalcula las estadísticas diarias de consultas en una sola pasada (tras importaciones o si se desfasaron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=TAMANO_LOTE, help='Filas por lectura y por inserción')
+        parser.add_argument('--si-faltan', action='store_true',
+                            help='Sólo si hay consultas sin contar (build.sh lo corre en cada despliegue)')
+
+    def handle(self, *args, **options):
+        if options['si_faltan'] and not faltan():
+            self.stdout.write('Estadísticas al día')
+            return
+        inicio = time.perf_counter()
+        consultas, filas = reconstruir(tamano=options['lote'])
+        self.stdout.write(self.style.SUCCESS(
+            f'{consultas} consultas resumidas en {filas} filas de estadística ({time.perf_counter() - inicio:.1f}s)'
+        ))
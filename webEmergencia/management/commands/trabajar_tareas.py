@@ -0,0 +1,102 @@
+import signal
+import threading
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from webEmergencia.tareas import (
+    HANDLERS, ejecutar, iniciar_proceso, limpiar_terminadas, nombre_trabajador, reclamar, recuperar_vencidas,
+)
+
+# Segundos entre revisiones de tareas con plazo vencido y limpieza de las terminadas
+MANTENIMIENTO = 60
+
+
+class Command(BaseCommand):
+    help = 'Ejecuta las tareas en segundo plano de la cola en base de datos (webEmergencia/tareas.py)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrencia', type=int, default=4, help='Tareas en paralelo')
+        parser.add_argument('--procesos', action='store_true',
+                            help='Pool de procesos en vez de hilos (tareas que usan CPU)')
+        parser.add_argument('--tipo', action='append', help='Sólo estos tipos de tarea (se puede repetir)')
+        parser.add_argument('--intervalo', type=float, default=1.0,
+                            help='Segundos de espera cuando no hay tareas listas')
+        parser.add_argument('--una-pasada', action='store_true',
+                            help='Terminar cuando no queden tareas listas (cron, pruebas)')
+
+    def handle(self, *args, **options):
+        concurrencia = max(options['concurrencia'], 1)
+        trabajador = nombre_trabajador()
+        detener = threading.Event()
+
+        def pedir_detencion(signum, frame):
+            # Deja de reclamar y espera a las que están corriendo
+            detener.set()
+
+        signal.signal(signal.SIGTERM, pedir_detencion)
+        signal.signal(signal.SIGINT, pedir_detencion)
+
+        # Los procesos del pool no deben heredar sockets de la base de datos
+        connections.close_all()
+        if options['procesos']:
+            pool = ProcessPoolExecutor(concurrencia, initializer=iniciar_proceso)
+        else:
+            pool = ThreadPoolExecutor(concurrencia, thread_name_prefix='tarea')
+
+        self.stdout.write(
+            f"{trabajador}: {concurrencia} {'procesos' if options['procesos'] else 'hilos'}, "
+            f"tipos {', '.join(options['tipo'] or sorted(HANDLERS))}"
+        )
+        totales = Counter()
+        en_curso = {}
+        ultimo_mantenimiento = 0
+        try:
+            while not detener.is_set():
+                if time.monotonic() - ultimo_mantenimiento > MANTENIMIENTO:
+                    recuperadas = recuperar_vencidas()
+                    if recuperadas:
+                        self.stdout.write(self.style.WARNING(f'{recuperadas} tareas con plazo vencido vuelven a la cola'))
+                    limpiar_terminadas()
+                    ultimo_mantenimiento = time.monotonic()
+
+                libres = concurrencia - len(en_curso)
+                reclamadas = reclamar(libres, trabajador, options['tipo']) if libres else []
+                for tarea_id in reclamadas:
+                    en_curso[pool.submit(ejecutar, tarea_id)] = tarea_id
+
+                if not en_curso:
+                    if options['una_pasada']:
+                        break
+                    detener.wait(options['intervalo'])
+                    continue
+                # Con cupos libres y la cola vacía, se vuelve a mirar la cola cada `intervalo`
+                listas, _ = wait(
+                    en_curso, timeout=None if len(en_curso) == concurrencia else options['intervalo'],
+                    return_when=FIRST_COMPLETED,
+                )
+                for futuro in listas:
+                    self.registrar(en_curso.pop(futuro), futuro, totales, options['verbosity'])
+        finally:
+            for futuro in wait(en_curso).done:
+                self.registrar(en_curso[futuro], futuro, totales, options['verbosity'])
+            pool.shutdown()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{sum(totales.values())} tareas: {totales['hecha']} hechas, {totales['pendiente']} para reintentar, "
+            f"{totales['fallida']} fallidas, {totales['error']} con error del trabajador"
+        ))
+
+    def registrar(self, tarea_id, futuro, totales, verbosity):
+        try:
+            estado = futuro.result()
+        except Exception as e:
+            # La tarea queda en_curso hasta que venza su plazo y otro trabajador la retome
+            estado = 'error'
+            self.stderr.write(f'Tarea {tarea_id}: {e!r}')
+        totales[estado] += 1
+        if verbosity >= 2:
+            self.stdout.write(f'Tarea {tarea_id}: {estado}')
@@ -0,0 +1,257 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from asgiref.wsgi import WsgiToAsgi
+from django.conf import settings
+from django.db import connection
+from django.db.models import F
+from django.utils.functional import SimpleLazyObject
+from whitenoise.base import WhiteNoise
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from .models import Persona, Paciente, Especialista
+from .query_budget import QueryCounter
+
+
+# Clave de sesión donde se guarda el principal ya resuelto
+PRINCIPAL_SESSION_KEY = 'principal'
+
+# Segundos que el rol cacheado en sesión se considera vigente antes de volver a consultarlo
+PRINCIPAL_CACHE_SECONDS = getattr(settings, 'PRINCIPAL_CACHE_SECONDS', 300)
+
+
+class Principal:
+    """Usuario de la petición actual (persona + rol) resuelto una sola vez"""
+
+    def __init__(self, rut=None, rol=None, persona=None, especialista=None, paciente=None):
+        self.rut = rut
+        self.rol = rol
+        self.persona = persona
+        self.especialista = especialista
+        self.paciente = paciente
+
+    @property
+    def is_authenticated(self):
+        return self.persona is not None
+
+    @property
+    def es_especialista(self):
+        return self.rol == 'especialista'
+
+    @property
+    def es_paciente(self):
+        return self.rol == 'paciente'
+
+    @property
+    def rol_obj(self):
+        """Especialista o Paciente según el rol (el especialista tiene prioridad)"""
+        if self.especialista is not None:
+            return self.especialista
+        return self.paciente
+
+    @property
+    def rol_api(self):
+        """Rol con el nombre que usan las vistas API: 'medico' o 'paciente'"""
+        if self.es_especialista:
+            return 'medico'
+        if self.es_paciente:
+            return 'paciente'
+        return None
+
+    def to_session(self):
+        persona = self.persona
+        return {
+            'rut': self.rut,
+            'rol': self.rol,
+            'nombre': persona.nombre,
+            'apellido': persona.apellido,
+            'correo': persona.correo,
+            'especialista_id': self.especialista.id if self.especialista else None,
+            'especialidad': self.especialista.especialidad if self.especialista else None,
+            'duracion_cita': self.especialista.duracion_cita if self.especialista else None,
+            'paciente_id': self.paciente.id if self.paciente else None,
+            'version_rol': persona.version_rol,
+            'resuelto_en': time.time(),
+        }
+
+    @classmethod
+    def from_session(cls, data):
+        """Reconstruye el principal sin tocar la base de datos.
+
+        Las instancias se crean con from_db y sólo con los campos guardados;
+        el resto de campos quedan diferidos y se cargan si alguna vista los usa.
+        """
+        persona = Persona.from_db(
+            'default',
+            ['rut', 'nombre', 'apellido', 'correo', 'version_rol'],
+            [data['rut'], data['nombre'], data['apellido'], data['correo'], data['version_rol']],
+        )
+        especialista = None
+        if data.get('especialista_id') is not None:
+            especialista = Especialista.from_db(
+                'default',
+                ['id', 'fk_rutp_id', 'especialidad', 'duracion_cita'],
+                [data['especialista_id'], data['rut'], data['especialidad'], data['duracion_cita']],
+            )
+            especialista.fk_rutp = persona
+        paciente = None
+        if data.get('paciente_id') is not None:
+            paciente = Paciente.from_db(
+                'default',
+                ['id', 'fk_rut_id'],
+                [data['paciente_id'], data['rut']],
+            )
+            paciente.fk_rut = persona
+        return cls(data['rut'], data['rol'], persona, especialista, paciente)
+
+    @classmethod
+    def from_db(cls, rut):
+        """Resuelve persona, especialista y paciente con una sola consulta (LEFT JOIN)"""
+        persona = (
+            Persona.objects
+            .select_related('especialista', 'paciente')
+            .filter(rut=rut)
+            .first()
+        )
+        if persona is None:
+            return cls(rut=rut)
+
+        especialista = getattr(persona, 'especialista', None)
+        paciente = getattr(persona, 'paciente', None)
+
+        # Verificar Especialista primero (tiene prioridad)
+        if especialista is not None:
+            rol = 'especialista'
+        elif paciente is not None:
+            rol = 'paciente'
+        else:
+            rol = 'desconocido'
+        return cls(rut, rol, persona, especialista, paciente)
+
+
+ANONIMO = Principal()
+
+
+def marcar_cambio_rol(rut):
+    """Las sesiones de `rut` vuelven a leer su rol en su próxima petición (ver signals.py).
+
+    La versión vive en la base de datos: la ven todos los workers, no sólo este proceso.
+    """
+    Persona.objects.filter(rut=rut).update(version_rol=F('version_rol') + 1)
+
+
+def version_rol(rut):
+    return Persona.objects.filter(rut=rut).values_list('version_rol', flat=True).first()
+
+
+def guardar_principal(request, principal):
+    """Cachea en sesión un principal ya resuelto y lo deja disponible en la petición"""
+    if principal.is_authenticated:
+        request.session[PRINCIPAL_SESSION_KEY] = principal.to_session()
+    else:
+        request.session.pop(PRINCIPAL_SESSION_KEY, None)
+    request._principal_cache = principal
+
+
+def get_principal(request):
+    cached = getattr(request, '_principal_cache', None)
+    if cached is not None:
+        return cached
+
+    rut = request.session.get('user_rut')
+    if not rut:
+        request._principal_cache = ANONIMO
+        return ANONIMO
+
+    data = request.session.get(PRINCIPAL_SESSION_KEY)
+    vigente = (
+        data is not None
+        and data.get('rut') == rut
+        and 'duracion_cita' in data
+        and data.get('rol') == request.session.get('user_rol', data.get('rol'))
+        and time.time() - data.get('resuelto_en', 0) < PRINCIPAL_CACHE_SECONDS
+        # Una consulta por la clave primaria en vez de tres JOIN: revocar un rol vale de inmediato
+        and data.get('version_rol', -1) == version_rol(rut)
+    )
+    if vigente:
+        principal = Principal.from_session(data)
+        request._principal_cache = principal
+        return principal
+
+    # Cache vacío, de otro usuario, vencido, con un rol distinto al de la sesión o cambiado después
+    principal = Principal.from_db(rut)
+    guardar_principal(request, principal)
+    if principal.is_authenticated and request.session.get('user_rol') != principal.rol:
+        request.session['user_rol'] = principal.rol
+    return principal
+
+
+class PrincipalMiddleware:
+    """Adjunta request.principal, resuelto de forma perezosa una vez por petición.
+
+    Debe ir después de SessionMiddleware. Soporta ASGI sin pasar por un hilo:
+    el principal sólo se resuelve (con acceso a BD) si una vista lo usa.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request.principal = SimpleLazyObject(lambda: get_principal(request))
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        request.principal = SimpleLazyObject(lambda: get_principal(request))
+        return await self.get_response(request)
+
+
+class ConsultasSQLMiddleware:
+    """Agrega a cada respuesta X-Consultas-SQL con las consultas SQL de la petición.
+
+    Para pruebas de carga (prueba_carga); se activa con CONTAR_CONSULTAS_SQL y va
+    primero para contar también las de sesión y autenticación. Sólo síncrono: las
+    respuestas en streaming cuentan hasta que la vista retorna.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        contador = QueryCounter()
+        with connection.execute_wrapper(contador):
+            response = self.get_response(request)
+        response['X-Consultas-SQL'] = str(len(contador))
+        return response
+
+
+class EstaticosASGI:
+    """Aplicación ASGI que sirve STATIC_URL con WhiteNoise y pasa el resto a Django.
+
+    WhiteNoiseMiddleware es sólo síncrono: en MIDDLEWARE haría correr cada petición
+    ASGI entera en un hilo. Aquí sólo los archivos estáticos van a un hilo (WSGI
+    de WhiteNoise vía WsgiToAsgi); el resto sigue en el event loop. Usa la misma
+    configuración que el middleware (STATIC_ROOT, manifiesto, WHITENOISE_*).
+    """
+
+    def __init__(self, application):
+        self.application = application
+        self.whitenoise = WhiteNoiseMiddleware()
+
+    def buscar(self, ruta):
+        if self.whitenoise.autorefresh:
+            return self.whitenoise.find_file(ruta)
+        return self.whitenoise.files.get(ruta)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope['path'].startswith(self.whitenoise.static_prefix):
+            estatico = self.buscar(scope['path'])
+            if estatico is not None:
+                servir = WsgiToAsgi(lambda environ, start_response: WhiteNoise.serve(estatico, environ, start_response))
+                return await servir(scope, receive, send)
+        return await self.application(scope, receive, send)
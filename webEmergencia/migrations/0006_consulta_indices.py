@@ -0,0 +1,34 @@
+# Generated by Django 5.2.6 on 2026-10-18 07:32
+
+import webEmergencia.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webEmergencia', '0005_alter_consulta_estado_diagnostico_receta'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='consulta',
+            index=webEmergencia.indexes.NullsLastIndex(models.OrderBy(models.F('fecha_inicio'), descending=True, nulls_last=True), models.OrderBy(models.F('id'), descending=True), name='consulta_fecha_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='consulta',
+            index=webEmergencia.indexes.NullsLastIndex(models.F('fk_idpaciente'), models.OrderBy(models.F('fecha_inicio'), descending=True, nulls_last=True), models.OrderBy(models.F('id'), descending=True), name='consulta_paciente_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='consulta',
+            index=webEmergencia.indexes.NullsLastIndex(models.F('estado'), models.OrderBy(models.F('fecha_inicio'), descending=True, nulls_last=True), models.OrderBy(models.F('id'), descending=True), name='consulta_estado_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='consulta',
+            index=models.Index(fields=['especialista_asignado', 'estado', 'fecha_inicio'], name='consulta_esp_estado_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='consulta',
+            index=models.Index(condition=models.Q(('estado', 'pendiente')), fields=['especialidad', 'fecha_inicio', 'id'], name='consulta_pendientes_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.6 on 2026-10-18 07:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webEmergencia', '0006_consulta_indices'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Medicamento',
+            fields=[
+                ('id', models.AutoField(db_column='ID', primary_key=True, serialize=False)),
+                ('nombre', models.CharField(db_column='NOMBRE', max_length=255)),
+                ('nombre_normalizado', models.CharField(db_column='NOMBRE_NORMALIZADO', max_length=255, unique=True)),
+                ('generico', models.CharField(blank=True, db_column='GENERICO', max_length=255, null=True)),
+                ('fuente', models.CharField(db_column='FUENTE', default='openfda', max_length=50)),
+            ],
+            options={
+                'db_table': 'medicamento',
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.6 on 2026-10-18 07:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webEmergencia', '0007_medicamento'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventoConsulta',
+            fields=[
+                ('id', models.BigAutoField(db_column='ID', primary_key=True, serialize=False)),
+                ('consulta_id', models.IntegerField(db_column='CONSULTA_ID')),
+                ('datos', models.JSONField(db_column='DATOS', default=dict)),
+                ('creado', models.DateTimeField(auto_now_add=True, db_column='CREADO', db_index=True)),
+            ],
+            options={
+                'db_table': 'evento_consulta',
+            },
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.6 on 2026-10-18 07:48
+
+import datetime
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def completar_fecha_fin(apps, schema_editor):
+    # Las citas ya asignadas ocupan la duración por defecto (30 minutos)
+    Consulta = apps.get_model('webEmergencia', 'Consulta')
+    Consulta.objects.filter(especialista_asignado__isnull=False, fecha_inicio__isnull=False).update(
+        fecha_fin=models.F('fecha_inicio') + datetime.timedelta(minutes=30)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webEmergencia', '0008_evento_consulta'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='consulta',
+            name='fecha_fin',
+            field=models.DateTimeField(blank=True, db_column='FECHA_FIN', null=True),
+        ),
+        migrations.AddField(
+            model_name='especialista',
+            name='duracion_cita',
+            field=models.PositiveSmallIntegerField(db_column='DURACION_CITA', default=30),
+        ),
+        migrations.CreateModel(
+            name='HorarioEspecialista',
+            fields=[
+                ('id', models.AutoField(db_column='ID', primary_key=True, serialize=False)),
+                ('dia_semana', models.PositiveSmallIntegerField(choices=[(0, 'Lunes'), (1, 'Martes'), (2, 'Miércoles'), (3, 'Jueves'), (4, 'Viernes'), (5, 'Sábado'), (6, 'Domingo')], db_column='DIA_SEMANA')),
+                ('hora_inicio', models.TimeField(db_column='HORA_INICIO')),
+                ('hora_fin', models.TimeField(db_column='HORA_FIN')),
+                ('especialista', models.ForeignKey(db_column='FK_ESPECIALISTA', on_delete=django.db.models.deletion.CASCADE, related_name='horarios', to='webEmergencia.especialista')),
+            ],
+            options={
+                'db_table': 'horario_especialista',
+                'ordering': ['especialista', 'dia_semana', 'hora_inicio'],
+                'constraints': [models.UniqueConstraint(fields=('especialista', 'dia_semana', 'hora_inicio'), name='horario_unico'), models.CheckConstraint(condition=models.Q(('hora_fin__gt', models.F('hora_inicio'))), name='horario_fin_despues_inicio')],
+            },
+        ),
+        migrations.RunPython(completar_fecha_fin, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 08:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webEmergencia', '0009_agenda'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='diagnostico',
+            name='actualizado',
+            field=models.DateTimeField(auto_now=True, db_column='ACTUALIZADO'),
+        ),
+    ]
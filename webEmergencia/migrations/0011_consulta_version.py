@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-18 08:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webEmergencia', '0010_diagnostico_actualizado'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='consulta',
+            name='actualizado',
+            field=models.DateTimeField(auto_now=True, db_column='ACTUALIZADO'),
+        ),
+        migrations.AddField(
+            model_name='consulta',
+            name='version',
+            field=models.PositiveIntegerField(db_column='VERSION', default=1),
+        ),
+    ]
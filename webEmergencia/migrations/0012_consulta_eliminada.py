@@ -0,0 +1,41 @@
+# Generated by Django 5.2.6 on 2026-10-18 08:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webEmergencia', '0011_consulta_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConsultaEliminada',
+            fields=[
+                ('id', models.BigAutoField(db_column='ID', primary_key=True, serialize=False)),
+                ('consulta_id', models.IntegerField(db_column='CONSULTA_ID')),
+                ('paciente_id', models.IntegerField(db_column='PACIENTE_ID')),
+                ('eliminada', models.DateTimeField(auto_now_add=True, db_column='ELIMINADA')),
+            ],
+            options={
+                'db_table': 'consulta_eliminada',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='consulta',
+            index=models.Index(fields=['actualizado', 'id'], name='consulta_actualizado_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='consulta',
+            index=models.Index(fields=['fk_idpaciente', 'actualizado', 'id'], name='consulta_paciente_act_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='consultaeliminada',
+            index=models.Index(fields=['eliminada', 'consulta_id'], name='eliminada_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='consultaeliminada',
+            index=models.Index(fields=['paciente_id', 'eliminada', 'consulta_id'], name='eliminada_paciente_idx'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.6 on 2026-10-18 08:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webEmergencia', '0012_consulta_eliminada'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConsultaContada',
+            fields=[
+                ('consulta_id', models.IntegerField(db_column='CONSULTA_ID', primary_key=True, serialize=False)),
+                ('dia', models.DateField(db_column='DIA', null=True)),
+                ('especialidad', models.CharField(db_column='ESPECIALIDAD', max_length=100, null=True)),
+                ('estado', models.CharField(db_column='ESTADO', max_length=20, null=True)),
+                ('especialista_id', models.IntegerField(db_column='ESPECIALISTA_ID', null=True)),
+                ('razon', models.CharField(db_column='RAZON', max_length=100, null=True)),
+                ('cronico', models.BooleanField(db_column='CRONICO', null=True)),
+            ],
+            options={
+                'db_table': 'consulta_contada',
+            },
+        ),
+        migrations.CreateModel(
+            name='EstadisticaDiaria',
+            fields=[
+                ('id', models.BigAutoField(db_column='ID', primary_key=True, serialize=False)),
+                ('dia', models.DateField(db_column='DIA')),
+                ('especialidad', models.CharField(db_column='ESPECIALIDAD', max_length=100)),
+                ('estado', models.CharField(db_column='ESTADO', max_length=20)),
+                ('especialista_id', models.IntegerField(db_column='ESPECIALISTA_ID', default=0)),
+                ('razon', models.CharField(db_column='RAZON', default='', max_length=100)),
+                ('cronico', models.BooleanField(db_column='CRONICO', default=False)),
+                ('cantidad', models.IntegerField(db_column='CANTIDAD', default=0)),
+            ],
+            options={
+                'db_table': 'estadistica_diaria',
+                'constraints': [models.UniqueConstraint(fields=('dia', 'especialidad', 'estado', 'especialista_id', 'razon', 'cronico'), name='estadistica_diaria_unica')],
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.6 on 2026-10-18 08:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webEmergencia', '0013_estadisticas_diarias'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tarea',
+            fields=[
+                ('id', models.BigAutoField(db_column='ID', primary_key=True, serialize=False)),
+                ('tipo', models.CharField(db_column='TIPO', max_length=100)),
+                ('datos', models.JSONField(db_column='DATOS', default=dict)),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('en_curso', 'En curso'), ('hecha', 'Hecha'), ('fallida', 'Fallida')], db_column='ESTADO', default='pendiente', max_length=20)),
+                ('prioridad', models.SmallIntegerField(db_column='PRIORIDAD', default=0)),
+                ('ejecutar_en', models.DateTimeField(db_column='EJECUTAR_EN')),
+                ('intentos', models.PositiveSmallIntegerField(db_column='INTENTOS', default=0)),
+                ('max_intentos', models.PositiveSmallIntegerField(db_column='MAX_INTENTOS', default=5)),
+                ('bloqueada_hasta', models.DateTimeField(blank=True, db_column='BLOQUEADA_HASTA', null=True)),
+                ('trabajador', models.CharField(blank=True, db_column='TRABAJADOR', default='', max_length=100)),
+                ('ultimo_error', models.TextField(blank=True, db_column='ULTIMO_ERROR', default='')),
+                ('creada', models.DateTimeField(auto_now_add=True, db_column='CREADA')),
+                ('terminada', models.DateTimeField(blank=True, db_column='TERMINADA', null=True)),
+            ],
+            options={
+                'db_table': 'tarea',
+                'indexes': [models.Index(models.OrderBy(models.F('prioridad'), descending=True), models.F('ejecutar_en'), models.F('id'), condition=models.Q(('estado', 'pendiente')), name='tarea_pendientes_idx'), models.Index(condition=models.Q(('estado', 'en_curso')), fields=['bloqueada_hasta'], name='tarea_en_curso_idx'), models.Index(fields=['estado', 'terminada'], name='tarea_estado_terminada_idx')],
+            },
+        ),
+    ]
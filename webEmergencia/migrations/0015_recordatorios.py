@@ -0,0 +1,44 @@
+# Generated by Django 5.2.6 on 2026-10-18 08:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webEmergencia', '0014_tarea'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MarcaRecordatorio',
+            fields=[
+                ('nivel', models.CharField(db_column='NIVEL', max_length=10, primary_key=True, serialize=False)),
+                ('hasta', models.DateTimeField(db_column='HASTA')),
+                ('revisado', models.DateTimeField(db_column='REVISADO')),
+            ],
+            options={
+                'db_table': 'marca_recordatorio',
+            },
+        ),
+        migrations.CreateModel(
+            name='Recordatorio',
+            fields=[
+                ('id', models.BigAutoField(db_column='ID', primary_key=True, serialize=False)),
+                ('nivel', models.CharField(db_column='NIVEL', max_length=10)),
+                ('fecha_inicio', models.DateTimeField(db_column='FECHA_INICIO')),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('enviado', 'Enviado'), ('fallido', 'Fallido'), ('descartado', 'Descartado')], db_column='ESTADO', default='pendiente', max_length=20)),
+                ('intentos', models.PositiveSmallIntegerField(db_column='INTENTOS', default=0)),
+                ('error', models.TextField(blank=True, db_column='ERROR', default='')),
+                ('creado', models.DateTimeField(auto_now_add=True, db_column='CREADO')),
+                ('enviado', models.DateTimeField(blank=True, db_column='ENVIADO', null=True)),
+                ('consulta', models.ForeignKey(db_column='FK_CONSULTA', on_delete=django.db.models.deletion.CASCADE, related_name='recordatorios', to='webEmergencia.consulta')),
+            ],
+            options={
+                'db_table': 'recordatorio',
+                'indexes': [models.Index(condition=models.Q(('estado', 'pendiente')), fields=['fecha_inicio', 'id'], name='recordatorio_pendientes_idx')],
+                'constraints': [models.UniqueConstraint(fields=('consulta', 'nivel', 'fecha_inicio'), name='recordatorio_unico')],
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-18 08:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webEmergencia', '0015_recordatorios'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='seguimiento',
+            constraint=models.UniqueConstraint(fields=('fk_idpac', 'dispositivo', 'fecha_registro'), name='seguimiento_lectura_unica'),
+        ),
+    ]
@@ -0,0 +1,95 @@
+# Generated by Django 5.2.6 on 2026-10-18 08:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Índice de texto según la base de datos; con otras (MySQL) la búsqueda usa LIKE
+INDICE_TEXTO = {
+    'postgresql': [
+        """
+        ALTER TABLE consulta_busqueda ADD COLUMN vector tsvector GENERATED ALWAYS AS (
+            setweight(to_tsvector('spanish', "MOTIVO"), 'A')
+            || setweight(to_tsvector('spanish', "DIAGNOSTICO"), 'B')
+            || setweight(to_tsvector('spanish', "SINTOMAS"), 'C')
+        ) STORED
+        """,
+        'CREATE INDEX consulta_busqueda_vector_idx ON consulta_busqueda USING GIN (vector)',
+    ],
+    'sqlite': [
+        """
+        CREATE VIRTUAL TABLE consulta_busqueda_fts USING fts5(
+            motivo, sintomas, diagnostico,
+            content='consulta_busqueda', content_rowid='FK_CONSULTA',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        """,
+        """
+        CREATE TRIGGER consulta_busqueda_ai AFTER INSERT ON consulta_busqueda BEGIN
+            INSERT INTO consulta_busqueda_fts (rowid, motivo, sintomas, diagnostico)
+            VALUES (new."FK_CONSULTA", new."MOTIVO", new."SINTOMAS", new."DIAGNOSTICO");
+        END
+        """,
+        """
+        CREATE TRIGGER consulta_busqueda_ad AFTER DELETE ON consulta_busqueda BEGIN
+            INSERT INTO consulta_busqueda_fts (consulta_busqueda_fts, rowid, motivo, sintomas, diagnostico)
+            VALUES ('delete', old."FK_CONSULTA", old."MOTIVO", old."SINTOMAS", old."DIAGNOSTICO");
+        END
+        """,
+        """
+        CREATE TRIGGER consulta_busqueda_au AFTER UPDATE ON consulta_busqueda BEGIN
+            INSERT INTO consulta_busqueda_fts (consulta_busqueda_fts, rowid, motivo, sintomas, diagnostico)
+            VALUES ('delete', old."FK_CONSULTA", old."MOTIVO", old."SINTOMAS", old."DIAGNOSTICO");
+            INSERT INTO consulta_busqueda_fts (rowid, motivo, sintomas, diagnostico)
+            VALUES (new."FK_CONSULTA", new."MOTIVO", new."SINTOMAS", new."DIAGNOSTICO");
+        END
+        """,
+    ],
+}
+
+QUITAR_INDICE_TEXTO = {
+    'postgresql': [
+        'DROP INDEX IF EXISTS consulta_busqueda_vector_idx',
+        'ALTER TABLE consulta_busqueda DROP COLUMN IF EXISTS vector',
+    ],
+    'sqlite': [
+        'DROP TRIGGER IF EXISTS consulta_busqueda_ai',
+        'DROP TRIGGER IF EXISTS consulta_busqueda_ad',
+        'DROP TRIGGER IF EXISTS consulta_busqueda_au',
+        'DROP TABLE IF EXISTS consulta_busqueda_fts',
+    ],
+}
+
+
+def crear_indice_texto(apps, schema_editor):
+    for sql in INDICE_TEXTO.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql, params=None)
+
+
+def quitar_indice_texto(apps, schema_editor):
+    for sql in QUITAR_INDICE_TEXTO.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql, params=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webEmergencia', '0016_seguimiento_lectura_unica'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConsultaBusqueda',
+            fields=[
+                ('consulta', models.OneToOneField(db_column='FK_CONSULTA', on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='busqueda', serialize=False, to='webEmergencia.consulta')),
+                ('motivo', models.TextField(blank=True, db_column='MOTIVO', default='')),
+                ('sintomas', models.TextField(blank=True, db_column='SINTOMAS', default='')),
+                ('diagnostico', models.TextField(blank=True, db_column='DIAGNOSTICO', default='')),
+            ],
+            options={
+                'db_table': 'consulta_busqueda',
+            },
+        ),
+        # Las consultas existentes se cargan con `python manage.py reconstruir_busqueda`
+        migrations.RunPython(crear_indice_texto, quitar_indice_texto),
+    ]
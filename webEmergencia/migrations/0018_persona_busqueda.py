@@ -0,0 +1,110 @@
+# Generated by Django 5.2.6 on 2026-10-18 08:27
+
+import re
+import unicodedata
+
+from django.db import migrations, models
+
+
+# Copia de webEmergencia.personas al momento de esta migración
+def normalizar_rut(valor):
+    return re.sub(r'[^0-9K]', '', (valor or '').upper()).lstrip('0')
+
+
+def normalizar_texto(valor):
+    sin_tildes = unicodedata.normalize('NFKD', valor or '').encode('ascii', 'ignore').decode('ascii')
+    return ' '.join(sin_tildes.lower().split())
+
+
+def completar_personas(apps, schema_editor):
+    Persona = apps.get_model('webEmergencia', 'Persona')
+    personas = []
+    for persona in Persona.objects.only('rut', 'nombre', 'apellido').iterator(chunk_size=2000):
+        persona.rut_normalizado = normalizar_rut(persona.rut)
+        persona.nombre_normalizado = normalizar_texto(f'{persona.nombre} {persona.apellido}')
+        personas.append(persona)
+        if len(personas) >= 2000:
+            Persona.objects.bulk_update(personas, ['rut_normalizado', 'nombre_normalizado'])
+            personas = []
+    Persona.objects.bulk_update(personas, ['rut_normalizado', 'nombre_normalizado'])
+
+
+# Índices de trigramas según la base de datos; con otras (MySQL) la búsqueda usa LIKE
+INDICE_TRIGRAMAS = {
+    'postgresql': [
+        'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+        'CREATE INDEX persona_nombre_trgm_idx ON persona USING GIN ("NOMBRE_NORMALIZADO" gin_trgm_ops)',
+        'CREATE INDEX persona_rut_trgm_idx ON persona USING GIN ("RUT_NORMALIZADO" gin_trgm_ops)',
+    ],
+    'sqlite': [
+        """
+        CREATE VIRTUAL TABLE persona_busqueda_fts USING fts5(
+            nombre_normalizado, content='persona', content_rowid='rowid', tokenize='trigram'
+        )
+        """,
+        """
+        CREATE TRIGGER persona_busqueda_ai AFTER INSERT ON persona BEGIN
+            INSERT INTO persona_busqueda_fts (rowid, nombre_normalizado) VALUES (new.rowid, new."NOMBRE_NORMALIZADO");
+        END
+        """,
+        """
+        CREATE TRIGGER persona_busqueda_ad AFTER DELETE ON persona BEGIN
+            INSERT INTO persona_busqueda_fts (persona_busqueda_fts, rowid, nombre_normalizado)
+            VALUES ('delete', old.rowid, old."NOMBRE_NORMALIZADO");
+        END
+        """,
+        """
+        CREATE TRIGGER persona_busqueda_au AFTER UPDATE ON persona BEGIN
+            INSERT INTO persona_busqueda_fts (persona_busqueda_fts, rowid, nombre_normalizado)
+            VALUES ('delete', old.rowid, old."NOMBRE_NORMALIZADO");
+            INSERT INTO persona_busqueda_fts (rowid, nombre_normalizado) VALUES (new.rowid, new."NOMBRE_NORMALIZADO");
+        END
+        """,
+        "INSERT INTO persona_busqueda_fts (persona_busqueda_fts) VALUES ('rebuild')",
+    ],
+}
+
+QUITAR_INDICE_TRIGRAMAS = {
+    'postgresql': [
+        'DROP INDEX IF EXISTS persona_rut_trgm_idx',
+        'DROP INDEX IF EXISTS persona_nombre_trgm_idx',
+    ],
+    'sqlite': [
+        'DROP TRIGGER IF EXISTS persona_busqueda_ai',
+        'DROP TRIGGER IF EXISTS persona_busqueda_ad',
+        'DROP TRIGGER IF EXISTS persona_busqueda_au',
+        'DROP TABLE IF EXISTS persona_busqueda_fts',
+    ],
+}
+
+
+def crear_indice_trigramas(apps, schema_editor):
+    for sql in INDICE_TRIGRAMAS.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql, params=None)
+
+
+def quitar_indice_trigramas(apps, schema_editor):
+    for sql in QUITAR_INDICE_TRIGRAMAS.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql, params=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webEmergencia', '0017_consulta_busqueda'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='persona',
+            name='nombre_normalizado',
+            field=models.CharField(db_column='NOMBRE_NORMALIZADO', default='', max_length=201),
+        ),
+        migrations.AddField(
+            model_name='persona',
+            name='rut_normalizado',
+            field=models.CharField(db_column='RUT_NORMALIZADO', db_index=True, default='', max_length=10),
+        ),
+        migrations.RunPython(completar_personas, migrations.RunPython.noop),
+        migrations.RunPython(crear_indice_trigramas, quitar_indice_trigramas),
+    ]
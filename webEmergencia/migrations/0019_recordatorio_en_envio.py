@@ -0,0 +1,27 @@
+# Generated by Django 5.2.6 on 2026-10-18 08:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webEmergencia', '0018_persona_busqueda'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recordatorio',
+            name='bloqueado_hasta',
+            field=models.DateTimeField(blank=True, db_column='BLOQUEADO_HASTA', null=True),
+        ),
+        migrations.AlterField(
+            model_name='recordatorio',
+            name='estado',
+            field=models.CharField(choices=[('pendiente', 'Pendiente'), ('en_envio', 'En envío'), ('enviado', 'Enviado'), ('fallido', 'Fallido'), ('descartado', 'Descartado')], db_column='ESTADO', default='pendiente', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='recordatorio',
+            index=models.Index(condition=models.Q(('estado', 'en_envio')), fields=['bloqueado_hasta'], name='recordatorio_en_envio_idx'),
+        ),
+    ]
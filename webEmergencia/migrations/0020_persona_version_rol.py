@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 08:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webEmergencia', '0019_recordatorio_en_envio'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='persona',
+            name='version_rol',
+            field=models.PositiveIntegerField(db_column='VERSION_ROL', default=0),
+        ),
+    ]
@@ -0,0 +1,47 @@
+from django.db import migrations
+
+
+# En SQLite, 0020 rehízo la tabla persona: se perdieron los triggers de persona_busqueda_fts
+# y los rowid del índice ya no corresponden. Copia de 0018; en PostgreSQL no hace falta nada.
+TRIGGERS = [
+    'DROP TRIGGER IF EXISTS persona_busqueda_ai',
+    'DROP TRIGGER IF EXISTS persona_busqueda_ad',
+    'DROP TRIGGER IF EXISTS persona_busqueda_au',
+    """
+    CREATE TRIGGER persona_busqueda_ai AFTER INSERT ON persona BEGIN
+        INSERT INTO persona_busqueda_fts (rowid, nombre_normalizado) VALUES (new.rowid, new."NOMBRE_NORMALIZADO");
+    END
+    """,
+    """
+    CREATE TRIGGER persona_busqueda_ad AFTER DELETE ON persona BEGIN
+        INSERT INTO persona_busqueda_fts (persona_busqueda_fts, rowid, nombre_normalizado)
+        VALUES ('delete', old.rowid, old."NOMBRE_NORMALIZADO");
+    END
+    """,
+    """
+    CREATE TRIGGER persona_busqueda_au AFTER UPDATE ON persona BEGIN
+        INSERT INTO persona_busqueda_fts (persona_busqueda_fts, rowid, nombre_normalizado)
+        VALUES ('delete', old.rowid, old."NOMBRE_NORMALIZADO");
+        INSERT INTO persona_busqueda_fts (rowid, nombre_normalizado) VALUES (new.rowid, new."NOMBRE_NORMALIZADO");
+    END
+    """,
+    "INSERT INTO persona_busqueda_fts (persona_busqueda_fts) VALUES ('rebuild')",
+]
+
+
+def restaurar_indice(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in TRIGGERS:
+        schema_editor.execute(sql, params=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webEmergencia', '0020_persona_version_rol'),
+    ]
+
+    operations = [
+        migrations.RunPython(restaurar_indice, migrations.RunPython.noop),
+    ]
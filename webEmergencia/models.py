@@ -1,5 +1,7 @@
 from django.db import models
 
+from .indexes import NullsLastIndex
+
 
 class Consulta(models.Model):
     ESTADO_CHOICES = [
@@ -21,22 +23,78 @@ class Consulta(models.Model):
     estado = models.CharField(db_column='ESTADO', max_length=20, choices=ESTADO_CHOICES, default='pendiente')  # Field name made lowercase.
     especialista_asignado = models.ForeignKey('Especialista', models.SET_NULL, db_column='ESPECIALISTA_ASIGNADO', blank=True, null=True, related_name='citas_asignadas')  # Field name made lowercase.
     razon_cancelacion = models.TextField(db_column='RAZON_CANCELACION', blank=True, null=True)  # Field name made lowercase.
+    # Fin del bloque reservado (fecha_inicio + duración de cita del especialista), ver agenda.py
+    fecha_fin = models.DateTimeField(db_column='FECHA_FIN', blank=True, null=True)
+    # Validadores de ETag / Last-Modified de la API (ver condicional.py). Los UPDATE masivos
+    # los mueven con transiciones.actualizar; save() con auto_now y signals.py
+    actualizado = models.DateTimeField(db_column='ACTUALIZADO', auto_now=True)
+    version = models.PositiveIntegerField(db_column='VERSION', default=1)
 
     class Meta:
          
         db_table = 'consulta'
+        indexes = [
+            # Listado del médico y paginación por cursor: ORDER BY fecha_inicio DESC NULLS LAST, id DESC
+            NullsLastIndex(models.F('fecha_inicio').desc(nulls_last=True), models.F('id').desc(), name='consulta_fecha_id_idx'),
+            # Historial de un paciente (consultar_citas, perfil, mis_documentos)
+            NullsLastIndex(models.F('fk_idpaciente'), models.F('fecha_inicio').desc(nulls_last=True), models.F('id').desc(), name='consulta_paciente_fecha_idx'),
+            # Filtro por estado en el listado
+            NullsLastIndex(models.F('estado'), models.F('fecha_inicio').desc(nulls_last=True), models.F('id').desc(), name='consulta_estado_fecha_idx'),
+            # Agenda de un especialista por estado
+            models.Index(fields=['especialista_asignado', 'estado', 'fecha_inicio'], name='consulta_esp_estado_fecha_idx'),
+            # Cola de pendientes por especialidad, de la más antigua a la más nueva (índice parcial)
+            models.Index(
+                fields=['especialidad', 'fecha_inicio', 'id'],
+                name='consulta_pendientes_idx',
+                condition=models.Q(estado='pendiente'),
+            ),
+            # Sincronización incremental (sincronizacion.py): cambios desde una marca, de médicos y de un paciente
+            models.Index(fields=['actualizado', 'id'], name='consulta_actualizado_idx'),
+            models.Index(fields=['fk_idpaciente', 'actualizado', 'id'], name='consulta_paciente_act_idx'),
+        ]
 
 
 class Especialista(models.Model):
     id = models.AutoField(db_column='ID', primary_key=True)  # Field name made lowercase.
     fk_rutp = models.OneToOneField('Persona', models.DO_NOTHING, db_column='FK_RUTP')  # Field name made lowercase.
     especialidad = models.CharField(db_column='ESPECIALIDAD', max_length=100)  # Field name made lowercase.
+    duracion_cita = models.PositiveSmallIntegerField(db_column='DURACION_CITA', default=30)  # minutos
 
     class Meta:
          
         db_table = 'especialista'
 
 
+class HorarioEspecialista(models.Model):
+    """Bloque de atención semanal de un especialista (puede haber varios por día)"""
+    DIAS_SEMANA = [
+        (0, 'Lunes'),
+        (1, 'Martes'),
+        (2, 'Miércoles'),
+        (3, 'Jueves'),
+        (4, 'Viernes'),
+        (5, 'Sábado'),
+        (6, 'Domingo'),
+    ]
+
+    id = models.AutoField(db_column='ID', primary_key=True)
+    especialista = models.ForeignKey(Especialista, models.CASCADE, db_column='FK_ESPECIALISTA', related_name='horarios')
+    dia_semana = models.PositiveSmallIntegerField(db_column='DIA_SEMANA', choices=DIAS_SEMANA)
+    hora_inicio = models.TimeField(db_column='HORA_INICIO')
+    hora_fin = models.TimeField(db_column='HORA_FIN')
+
+    class Meta:
+        db_table = 'horario_especialista'
+        ordering = ['especialista', 'dia_semana', 'hora_inicio']
+        constraints = [
+            models.UniqueConstraint(fields=['especialista', 'dia_semana', 'hora_inicio'], name='horario_unico'),
+            models.CheckConstraint(condition=models.Q(hora_fin__gt=models.F('hora_inicio')), name='horario_fin_despues_inicio'),
+        ]
+
+    def __str__(self):
+        return f"{self.especialista} - {self.get_dia_semana_display()} {self.hora_inicio:%H:%M}-{self.hora_fin:%H:%M}"
+
+
 class Paciente(models.Model):
     id = models.AutoField(db_column='ID', primary_key=True)  # Field name made lowercase.
     fk_rut = models.OneToOneField('Persona', models.DO_NOTHING, db_column='FK_RUT')  # Field name made lowercase.
@@ -55,11 +113,29 @@ class Persona(models.Model):
     apellido = models.CharField(db_column='APELLIDO', max_length=100)  # Field name made lowercase.
     correo = models.CharField(db_column='CORREO', unique=True, max_length=100)  # Field name made lowercase.
     contrasena = models.CharField(db_column='CONTRASENA', max_length=100)  # Field name made lowercase.
+    # Columnas de búsqueda derivadas del rut y el nombre, ver personas.py
+    rut_normalizado = models.CharField(db_column='RUT_NORMALIZADO', max_length=10, default='', db_index=True)
+    nombre_normalizado = models.CharField(db_column='NOMBRE_NORMALIZADO', max_length=201, default='')
+    # Sube con cada alta, cambio o baja de su Paciente/Especialista: invalida el rol cacheado en sesión
+    version_rol = models.PositiveIntegerField(db_column='VERSION_ROL', default=0)
 
     class Meta:
          
         db_table = 'persona'
 
+    def completar_busqueda(self):
+        """Calcula las columnas de búsqueda; bulk_create no pasa por save(), así que se llama antes"""
+        from .personas import normalizar_rut, normalizar_texto
+        self.rut_normalizado = normalizar_rut(self.rut)
+        self.nombre_normalizado = normalizar_texto(f'{self.nombre} {self.apellido}')
+
+    def save(self, *args, **kwargs):
+        self.completar_busqueda()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'rut_normalizado', 'nombre_normalizado'}
+        super().save(*args, **kwargs)
+
 
 class Seguimiento(models.Model):
     id = models.AutoField(db_column='ID', primary_key=True)  # Field name made lowercase.
@@ -73,6 +149,10 @@ class Seguimiento(models.Model):
     class Meta:
          
         db_table = 'seguimiento'
+        constraints = [
+            # Una lectura por (paciente, dispositivo, hora): reenviar un lote no la duplica (ver seguimiento.py)
+            models.UniqueConstraint(fields=['fk_idpac', 'dispositivo', 'fecha_registro'], name='seguimiento_lectura_unica'),
+        ]
 
 
 class Diagnostico(models.Model):
@@ -82,6 +162,8 @@ class Diagnostico(models.Model):
     es_cronico = models.BooleanField(db_column='ES_CRONICO', default=False)
     nombre_enfermedad = models.CharField(db_column='NOMBRE_ENFERMEDAD', max_length=255, null=True, blank=True)
     fecha_emision = models.DateTimeField(db_column='FECHA_EMISION', auto_now_add=True)
+    # Versión del documento para el caché de mis_documentos: cambia al editar el diagnóstico o sus recetas
+    actualizado = models.DateTimeField(db_column='ACTUALIZADO', auto_now=True)
 
     class Meta:
         db_table = 'diagnostico'
@@ -103,5 +185,205 @@ class Receta(models.Model):
     def __str__(self):
         return f"{self.medicamento} - {self.dosis}"
 
+
+class Medicamento(models.Model):
+    id = models.AutoField(db_column='ID', primary_key=True)
+    nombre = models.CharField(db_column='NOMBRE', max_length=255)
+    nombre_normalizado = models.CharField(db_column='NOMBRE_NORMALIZADO', max_length=255, unique=True)
+    generico = models.CharField(db_column='GENERICO', max_length=255, null=True, blank=True)
+    fuente = models.CharField(db_column='FUENTE', max_length=50, default='openfda')
+
+    class Meta:
+        db_table = 'medicamento'
+
+    def __str__(self):
+        return self.nombre
+
+
+class EventoConsulta(models.Model):
+    """Cambio de estado de una consulta, para empujarlo a los navegadores (ver eventos.py)"""
+    id = models.BigAutoField(db_column='ID', primary_key=True)
+    # Sin FK: el evento sobrevive aunque la consulta se borre
+    consulta_id = models.IntegerField(db_column='CONSULTA_ID')
+    datos = models.JSONField(db_column='DATOS', default=dict)
+    creado = models.DateTimeField(db_column='CREADO', auto_now_add=True, db_index=True)
+
+    class Meta:
+        db_table = 'evento_consulta'
+
+    def __str__(self):
+        return f"Evento {self.id} - consulta {self.consulta_id}"
+
+
+class ConsultaEliminada(models.Model):
+    """Lápida de una consulta borrada, para que la sincronización incremental la informe"""
+    id = models.BigAutoField(db_column='ID', primary_key=True)
+    # Sin FK: la consulta ya no existe
+    consulta_id = models.IntegerField(db_column='CONSULTA_ID')
+    paciente_id = models.IntegerField(db_column='PACIENTE_ID')
+    eliminada = models.DateTimeField(db_column='ELIMINADA', auto_now_add=True)
+
+    class Meta:
+        db_table = 'consulta_eliminada'
+        indexes = [
+            models.Index(fields=['eliminada', 'consulta_id'], name='eliminada_fecha_idx'),
+            models.Index(fields=['paciente_id', 'eliminada', 'consulta_id'], name='eliminada_paciente_idx'),
+        ]
+
+    def __str__(self):
+        return f"Consulta {self.consulta_id} eliminada"
+
+
+class EstadisticaDiaria(models.Model):
+    """Cantidad de consultas por día y dimensiones, mantenida por estadisticas.py"""
+    id = models.BigAutoField(db_column='ID', primary_key=True)
+    # Día local de fecha_inicio (estadisticas.SIN_FECHA si no tiene)
+    dia = models.DateField(db_column='DIA')
+    especialidad = models.CharField(db_column='ESPECIALIDAD', max_length=100)
+    estado = models.CharField(db_column='ESTADO', max_length=20)
+    # Sin FK: 0 es "sin asignar" y la estadística sobrevive al especialista
+    especialista_id = models.IntegerField(db_column='ESPECIALISTA_ID', default=0)
+    razon = models.CharField(db_column='RAZON', max_length=100, default='')
+    cronico = models.BooleanField(db_column='CRONICO', default=False)
+    cantidad = models.IntegerField(db_column='CANTIDAD', default=0)
+
+    class Meta:
+        db_table = 'estadistica_diaria'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dia', 'especialidad', 'estado', 'especialista_id', 'razon', 'cronico'],
+                name='estadistica_diaria_unica',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.dia} {self.especialidad} {self.estado}: {self.cantidad}"
+
+
+class Tarea(models.Model):
+    """Trabajo en segundo plano de la cola en base de datos (ver tareas.py)"""
+    ESTADO_CHOICES = [
+        ('pendiente', 'Pendiente'),
+        ('en_curso', 'En curso'),
+        ('hecha', 'Hecha'),
+        ('fallida', 'Fallida'),
+    ]
+
+    id = models.BigAutoField(db_column='ID', primary_key=True)
+    tipo = models.CharField(db_column='TIPO', max_length=100)
+    datos = models.JSONField(db_column='DATOS', default=dict)
+    estado = models.CharField(db_column='ESTADO', max_length=20, choices=ESTADO_CHOICES, default='pendiente')
+    # Mayor primero
+    prioridad = models.SmallIntegerField(db_column='PRIORIDAD', default=0)
+    ejecutar_en = models.DateTimeField(db_column='EJECUTAR_EN')
+    intentos = models.PositiveSmallIntegerField(db_column='INTENTOS', default=0)
+    max_intentos = models.PositiveSmallIntegerField(db_column='MAX_INTENTOS', default=5)
+    # Un trabajador que muere deja la tarea en_curso: vencido este plazo otro la retoma
+    bloqueada_hasta = models.DateTimeField(db_column='BLOQUEADA_HASTA', null=True, blank=True)
+    trabajador = models.CharField(db_column='TRABAJADOR', max_length=100, blank=True, default='')
+    ultimo_error = models.TextField(db_column='ULTIMO_ERROR', blank=True, default='')
+    creada = models.DateTimeField(db_column='CREADA', auto_now_add=True)
+    terminada = models.DateTimeField(db_column='TERMINADA', null=True, blank=True)
+
+    class Meta:
+        db_table = 'tarea'
+        indexes = [
+            # Próximas tareas listas (índice parcial: las terminadas no lo engordan)
+            models.Index(
+                models.F('prioridad').desc(), models.F('ejecutar_en'), models.F('id'),
+                name='tarea_pendientes_idx',
+                condition=models.Q(estado='pendiente'),
+            ),
+            models.Index(fields=['bloqueada_hasta'], name='tarea_en_curso_idx', condition=models.Q(estado='en_curso')),
+            models.Index(fields=['estado', 'terminada'], name='tarea_estado_terminada_idx'),
+        ]
+
+    def __str__(self):
+        return f"Tarea {self.id} {self.tipo} ({self.estado})"
+
+
+class Recordatorio(models.Model):
+    """Recordatorio de una cita por nivel de anticipación (24h, 1h), ver recordatorios.py"""
+    ESTADO_CHOICES = [
+        ('pendiente', 'Pendiente'),
+        ('en_envio', 'En envío'),
+        ('enviado', 'Enviado'),
+        ('fallido', 'Fallido'),
+        ('descartado', 'Descartado'),
+    ]
+
+    id = models.BigAutoField(db_column='ID', primary_key=True)
+    consulta = models.ForeignKey(Consulta, models.CASCADE, db_column='FK_CONSULTA', related_name='recordatorios')
+    nivel = models.CharField(db_column='NIVEL', max_length=10)
+    # Hora de la cita que se recuerda: si se reagenda, la nueva hora tiene su propio recordatorio
+    fecha_inicio = models.DateTimeField(db_column='FECHA_INICIO')
+    estado = models.CharField(db_column='ESTADO', max_length=20, choices=ESTADO_CHOICES, default='pendiente')
+    intentos = models.PositiveSmallIntegerField(db_column='INTENTOS', default=0)
+    error = models.TextField(db_column='ERROR', blank=True, default='')
+    creado = models.DateTimeField(db_column='CREADO', auto_now_add=True)
+    enviado = models.DateTimeField(db_column='ENVIADO', null=True, blank=True)
+    # Mientras está en_envio: si el demonio muere, vencido este plazo vuelve a pendiente
+    bloqueado_hasta = models.DateTimeField(db_column='BLOQUEADO_HASTA', null=True, blank=True)
+
+    class Meta:
+        db_table = 'recordatorio'
+        constraints = [
+            models.UniqueConstraint(fields=['consulta', 'nivel', 'fecha_inicio'], name='recordatorio_unico'),
+        ]
+        indexes = [
+            models.Index(fields=['fecha_inicio', 'id'], name='recordatorio_pendientes_idx', condition=models.Q(estado='pendiente')),
+            models.Index(fields=['bloqueado_hasta'], name='recordatorio_en_envio_idx', condition=models.Q(estado='en_envio')),
+        ]
+
+    def __str__(self):
+        return f"Recordatorio {self.nivel} de la consulta {self.consulta_id} ({self.estado})"
+
+
+class MarcaRecordatorio(models.Model):
+    """Hasta qué fecha_inicio ya se revisaron las citas de un nivel de recordatorio"""
+    nivel = models.CharField(db_column='NIVEL', max_length=10, primary_key=True)
+    hasta = models.DateTimeField(db_column='HASTA')
+    # Última pasada: las citas aceptadas o reagendadas después, con hora ya cubierta, se revisan aparte
+    revisado = models.DateTimeField(db_column='REVISADO')
+
+    class Meta:
+        db_table = 'marca_recordatorio'
+
+    def __str__(self):
+        return f"{self.nivel}: hasta {self.hasta}"
+
+
+class ConsultaContada(models.Model):
+    """Con qué dimensiones está contada cada consulta en EstadisticaDiaria (estado NULL: todavía en ninguna)"""
+    consulta_id = models.IntegerField(db_column='CONSULTA_ID', primary_key=True)
+    dia = models.DateField(db_column='DIA', null=True)
+    especialidad = models.CharField(db_column='ESPECIALIDAD', max_length=100, null=True)
+    estado = models.CharField(db_column='ESTADO', max_length=20, null=True)
+    especialista_id = models.IntegerField(db_column='ESPECIALISTA_ID', null=True)
+    razon = models.CharField(db_column='RAZON', max_length=100, null=True)
+    cronico = models.BooleanField(db_column='CRONICO', null=True)
+
+    class Meta:
+        db_table = 'consulta_contada'
+
+
+class ConsultaBusqueda(models.Model):
+    """Texto buscable de cada consulta, mantenido por busqueda.py.
+
+    En PostgreSQL la tabla tiene además la columna generada `vector` (tsvector en
+    español) con índice GIN, y en SQLite la acompaña la tabla FTS5
+    consulta_busqueda_fts con sus triggers. Los crea la migración 0017 y no están
+    en el modelo: si un cambio de este modelo hace que SQLite rehaga la tabla,
+    hay que volver a crear los triggers.
+    """
+    consulta = models.OneToOneField(Consulta, models.CASCADE, db_column='FK_CONSULTA', primary_key=True, related_name='busqueda')
+    motivo = models.TextField(db_column='MOTIVO', blank=True, default='')
+    sintomas = models.TextField(db_column='SINTOMAS', blank=True, default='')
+    # Consulta.diagnostico, nombre de la enfermedad y descripción del Diagnostico
+    diagnostico = models.TextField(db_column='DIAGNOSTICO', blank=True, default='')
+
+    class Meta:
+        db_table = 'consulta_busqueda'
+
 def __str__(self):
     return str(self.xx) + " " + self.xxxx + "(SCORE: " + str(self.score) + ")"
\ No newline at end of file
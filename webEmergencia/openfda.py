@@ -0,0 +1,354 @@
+"""Cliente de OpenFDA para el autocompletado de medicamentos, con caché.
+
+- Caché acotado (LRU) por prefijo normalizado, con TTL y stale-while-revalidate.
+- Si un prefijo más corto ya está en caché y su respuesta vino completa
+  (menos filas que el límite pedido), las consultas más largas se responden
+  filtrando esa respuesta: 'ibu' sirve para 'ibup', 'ibupr', ...
+- Varias peticiones simultáneas por la misma clave comparten una sola llamada
+  a OpenFDA (request coalescing).
+- Se pide sólo el conteo de marcas (count=openfda.brand_name.exact), no las
+  etiquetas completas: cada fila es {term, count} y no decenas de KB de texto.
+
+Bajo WSGI se usa requests con una Session; bajo ASGI, httpx.AsyncClient con un
+pool keep-alive por event loop (ver async_views.py).
+"""
+import asyncio
+import logging
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+import httpx
+import requests
+from django.conf import settings
+
+from .catalogo import normalizar
+
+
+logger = logging.getLogger(__name__)
+
+OPENFDA_URL = 'https://api.fda.gov/drug/label.json'
+
+
+class ErrorOpenFDA(Exception):
+    pass
+
+
+def url_openfda():
+    return getattr(settings, 'MEDICAMENTOS_OPENFDA_URL', OPENFDA_URL)
+
+
+def parametros_openfda(clave, limite):
+    palabras = clave.split()
+    terminos = [f'openfda.brand_name:{p}' for p in palabras[:-1]] + [f'openfda.brand_name:{palabras[-1]}*']
+    return {'search': ' AND '.join(terminos), 'count': 'openfda.brand_name.exact', 'limit': limite}
+
+
+def procesar_respuesta(status_code, leer_json, clave, limite):
+    """Marcas de la respuesta de OpenFDA. Devuelve (resultados, completo)."""
+    # OpenFDA responde 404 cuando no hay coincidencias
+    if status_code == 404:
+        return [], True
+    if status_code != 200:
+        raise ErrorOpenFDA(f'OpenFDA respondió {status_code}')
+
+    items = leer_json().get('results', [])
+    # El conteo trae todas las marcas de cada etiqueta encontrada, no sólo la que coincidió
+    palabras = clave.split()
+    resultados = [item['term'] for item in items if coincide(item['term'], palabras)]
+    return resultados, len(items) < limite
+
+
+def consultar_openfda(clave, limite, session=None, url=None, timeout=5):
+    """Marcas que empiezan con `clave`. Devuelve (resultados, completo)."""
+    try:
+        response = (session or requests).get(
+            url or url_openfda(), params=parametros_openfda(clave, limite), timeout=timeout,
+        )
+    except requests.RequestException as e:
+        raise ErrorOpenFDA(str(e)) from e
+    return procesar_respuesta(response.status_code, response.json, clave, limite)
+
+
+_clientes_async = weakref.WeakKeyDictionary()
+
+
+def get_cliente_async():
+    """httpx.AsyncClient con keep-alive, uno por event loop (uno por worker ASGI)"""
+    loop = asyncio.get_running_loop()
+    cliente = _clientes_async.get(loop)
+    if cliente is None:
+        cliente = _clientes_async[loop] = httpx.AsyncClient(
+            timeout=getattr(settings, 'MEDICAMENTOS_OPENFDA_TIMEOUT', 5),
+            limits=httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=60),
+        )
+    return cliente
+
+
+async def consultar_openfda_async(clave, limite):
+    """Versión async de consultar_openfda sobre el pool compartido.
+
+    Si la tarea se cancela (el cliente se desconectó) httpx cierra la petición en curso.
+    """
+    try:
+        response = await get_cliente_async().get(url_openfda(), params=parametros_openfda(clave, limite))
+    except httpx.HTTPError as e:
+        raise ErrorOpenFDA(str(e)) from e
+    return procesar_respuesta(response.status_code, response.json, clave, limite)
+
+
+def coincide(nombre, palabras):
+    """Misma regla que la búsqueda de OpenFDA: cada palabra es prefijo de alguna palabra del nombre"""
+    palabras_nombre = normalizar(nombre).split()
+    return all(any(n.startswith(p) for n in palabras_nombre) for p in palabras)
+
+
+class Entrada:
+    __slots__ = ('resultados', 'completo', 'expira', 'vence')
+
+    def __init__(self, resultados, completo, expira, vence):
+        self.resultados = resultados
+        self.completo = completo
+        self.expira = expira    # hasta aquí está fresca
+        self.vence = vence      # hasta aquí se puede servir vencida mientras se revalida
+
+
+class Vuelo:
+    """Una llamada a OpenFDA en curso, compartida por todos los que pidan la misma clave"""
+
+    def __init__(self):
+        self.evento = threading.Event()
+        self.entrada = None
+
+
+class VueloAsync:
+    """Igual que Vuelo pero en un event loop: la llamada es una tarea compartida"""
+
+    def __init__(self, tarea, en_segundo_plano):
+        self.tarea = tarea
+        self.esperando = 0
+        self.en_segundo_plano = en_segundo_plano
+
+
+class CacheMedicamentos:
+
+    def __init__(self, fetch=None, ttl=3600, stale=86400, ttl_error=30, max_entradas=5000,
+                 limite_upstream=100, espera=6, reloj=time.monotonic):
+        self.fetch = fetch or consultar_openfda
+        self.ttl = ttl
+        self.stale = stale
+        self.ttl_error = ttl_error
+        self.max_entradas = max_entradas
+        self.limite_upstream = limite_upstream
+        self.espera = espera
+        self.reloj = reloj
+        self._lock = threading.Lock()
+        self._entradas = OrderedDict()
+        self._vuelos = {}
+        self._vuelos_async = weakref.WeakKeyDictionary()
+        self.contadores = dict.fromkeys(
+            ('hits', 'hits_prefijo', 'hits_vencidos', 'misses', 'compartidas', 'errores', 'llamadas',
+             'canceladas'), 0
+        )
+
+    def stats(self):
+        with self._lock:
+            return dict(self.contadores, entradas=len(self._entradas))
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
+
+    def _contar(self, nombre):
+        self.contadores[nombre] += 1
+
+    def _get(self, clave):
+        entrada = self._entradas.get(clave)
+        if entrada is not None:
+            self._entradas.move_to_end(clave)
+        return entrada
+
+    def _guardar(self, clave, entrada):
+        self._entradas[clave] = entrada
+        self._entradas.move_to_end(clave)
+        while len(self._entradas) > self.max_entradas:
+            self._entradas.popitem(last=False)
+
+    def _consultar(self, clave, limite):
+        """Busca en el caché. Devuelve (resultados o None si hay que ir a OpenFDA, revalidar)"""
+        palabras = clave.split()
+        ahora = self.reloj()
+
+        with self._lock:
+            entrada = self._get(clave)
+            if entrada is not None and ahora < entrada.expira:
+                self._contar('hits')
+                return entrada.resultados[:limite], False
+
+            if entrada is not None and ahora < entrada.vence:
+                # Vencida pero utilizable: se responde ya y se revalida en segundo plano
+                self._contar('hits_vencidos')
+                return entrada.resultados[:limite], True
+
+            # Un prefijo más corto con respuesta completa y fresca alcanza para filtrar
+            for n in range(len(clave) - 1, 1, -1):
+                corta = self._entradas.get(clave[:n])
+                if corta is not None and corta.completo and ahora < corta.expira:
+                    self._contar('hits_prefijo')
+                    self._entradas.move_to_end(clave[:n])
+                    return [r for r in corta.resultados if coincide(r, palabras)][:limite], False
+
+            self._contar('misses')
+            return None, False
+
+    def _registrar(self, clave, resultados, completo):
+        ahora = self.reloj()
+        entrada = Entrada(resultados, completo, ahora + self.ttl, ahora + self.ttl + self.stale)
+        with self._lock:
+            self._contar('llamadas')
+            self._guardar(clave, entrada)
+        return entrada
+
+    def _registrar_error(self, clave, error):
+        logger.warning('Error en OpenFDA para %r: %s', clave, error)
+        ahora = self.reloj()
+        with self._lock:
+            self._contar('llamadas')
+            self._contar('errores')
+            anterior = self._entradas.get(clave)
+            if anterior is not None:
+                # Mejor una respuesta vieja que ninguna; se reintenta después de ttl_error
+                entrada = Entrada(anterior.resultados, anterior.completo,
+                                  ahora + self.ttl_error, max(anterior.vence, ahora + self.ttl_error))
+            else:
+                # Caché negativo corto para no martillar un upstream caído
+                entrada = Entrada([], False, ahora + self.ttl_error, ahora + self.ttl_error)
+            self._guardar(clave, entrada)
+        return entrada
+
+    # --- Camino síncrono (WSGI): una llamada por clave, el resto espera en un Event ---
+
+    def buscar(self, query, limite=10):
+        clave = normalizar(query)
+        if not clave:
+            return []
+
+        resultados, revalidar = self._consultar(clave, limite)
+        if revalidar:
+            with self._lock:
+                en_vuelo = clave in self._vuelos
+            if not en_vuelo:
+                threading.Thread(target=self._cargar, args=(clave,), daemon=True).start()
+        if resultados is not None:
+            return resultados
+
+        entrada = self._cargar(clave)
+        return entrada.resultados[:limite] if entrada is not None else []
+
+    def _cargar(self, clave):
+        with self._lock:
+            vuelo = self._vuelos.get(clave)
+            lider = vuelo is None
+            if lider:
+                vuelo = self._vuelos[clave] = Vuelo()
+            else:
+                self._contar('compartidas')
+
+        if not lider:
+            vuelo.evento.wait(self.espera)
+            return vuelo.entrada
+
+        try:
+            try:
+                entrada = self._registrar(clave, *self.fetch(clave, self.limite_upstream))
+            except Exception as e:
+                entrada = self._registrar_error(clave, e)
+            vuelo.entrada = entrada
+            return entrada
+        finally:
+            with self._lock:
+                self._vuelos.pop(clave, None)
+            vuelo.evento.set()
+
+    # --- Camino async (ASGI): una tarea por clave; se cancela si todos sus clientes se van ---
+
+    async def abuscar(self, query, limite=10, fetch=None):
+        clave = normalizar(query)
+        if not clave:
+            return []
+        fetch = fetch or consultar_openfda_async
+
+        resultados, revalidar = self._consultar(clave, limite)
+        if revalidar:
+            self._vuelo_async(clave, fetch, en_segundo_plano=True)
+        if resultados is not None:
+            return resultados
+
+        vuelo = self._vuelo_async(clave, fetch)
+        vuelo.esperando += 1
+        try:
+            entrada = await asyncio.shield(vuelo.tarea)
+        except asyncio.CancelledError:
+            # El cliente se desconectó: si era el último esperando, no tiene sentido seguir
+            vuelo.esperando -= 1
+            if vuelo.esperando == 0 and not vuelo.en_segundo_plano and not vuelo.tarea.done():
+                vuelo.tarea.cancel()
+                with self._lock:
+                    self._contar('canceladas')
+            raise
+        vuelo.esperando -= 1
+        return entrada.resultados[:limite] if entrada is not None else []
+
+    def _vuelo_async(self, clave, fetch, en_segundo_plano=False):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            vuelos = self._vuelos_async.setdefault(loop, {})
+            vuelo = vuelos.get(clave)
+            if vuelo is not None:
+                if not en_segundo_plano:
+                    self._contar('compartidas')
+                return vuelo
+
+        async def cargar():
+            try:
+                resultados, completo = await fetch(clave, self.limite_upstream)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                return self._registrar_error(clave, e)
+            return self._registrar(clave, resultados, completo)
+
+        vuelo = VueloAsync(loop.create_task(cargar()), en_segundo_plano)
+
+        def terminar(tarea):
+            with self._lock:
+                if vuelos.get(clave) is vuelo:
+                    del vuelos[clave]
+            if not tarea.cancelled():
+                tarea.exception()  # evitar "Task exception was never retrieved"
+
+        vuelo.tarea.add_done_callback(terminar)
+        with self._lock:
+            vuelos[clave] = vuelo
+        return vuelo
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache_medicamentos():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                session = requests.Session()
+                _cache = CacheMedicamentos(
+                    fetch=lambda clave, limite: consultar_openfda(clave, limite, session=session),
+                    ttl=getattr(settings, 'MEDICAMENTOS_CACHE_TTL', 3600),
+                    stale=getattr(settings, 'MEDICAMENTOS_CACHE_STALE', 86400),
+                    max_entradas=getattr(settings, 'MEDICAMENTOS_CACHE_MAX', 5000),
+                    limite_upstream=getattr(settings, 'MEDICAMENTOS_OPENFDA_LIMITE', 100),
+                )
+    return _cache
@@ -0,0 +1,134 @@
+import base64
+import binascii
+
+from django.db.models import F, Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """Paginación por cursor (keyset) sobre (ordering_field, id), ambos descendentes.
+
+    En vez de OFFSET, cada página filtra a partir de la última fila entregada,
+    así que el costo de una página no depende del tamaño de la tabla.
+    El cursor es opaco para el cliente: base64 de "<valor>|<id>".
+    Las filas con ordering_field NULL van al final.
+    La página se resuelve en dos pasos: primero las claves (por el índice, sin
+    JOIN) y después las filas completas por clave primaria. Entre ambos la vista
+    puede revisar las claves, por ejemplo para responder 304 (condicional.py).
+    `extra_fields` son columnas de la tabla que se leen junto con las claves.
+    """
+
+    ordering_field = 'fecha_inicio'
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Cursor inválido'
+    extra_fields = ()
+
+    def get_page_size(self, request):
+        valor = request.query_params.get(self.page_size_query_param)
+        if not valor:
+            return self.page_size
+        try:
+            page_size = int(valor)
+        except ValueError:
+            raise ValidationError({'error': f'{self.page_size_query_param} debe ser un número entero'})
+        return max(1, min(page_size, self.max_page_size))
+
+    def encode_cursor(self, valor, pk):
+        valor = '' if valor is None else valor.isoformat()
+        raw = f'{valor}|{pk}'.encode('utf-8')
+        return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            padding = '=' * (-len(cursor) % 4)
+            raw = base64.urlsafe_b64decode(cursor + padding).decode('utf-8')
+            valor, pk = raw.rsplit('|', 1)
+            pk = int(pk)
+            valor = parse_datetime(valor) if valor else None
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            raise ValidationError({'error': self.invalid_cursor_message})
+        if valor is None and raw.split('|', 1)[0]:
+            raise ValidationError({'error': self.invalid_cursor_message})
+        return valor, pk
+
+    def get_ordering(self):
+        return (F(self.ordering_field).desc(nulls_last=True), F('id').desc())
+
+    def filtro_despues_de(self, valor, pk):
+        """Filas con ordering_field no nulo que van después de (valor, pk).
+
+        Se escribe como rango sobre la primera columna del índice
+        (campo <= valor) para que la base de datos pueda hacer un seek.
+        """
+        campo = self.ordering_field
+        return Q(**{f'{campo}__lte': valor}) & (Q(**{f'{campo}__lt': valor}) | Q(id__lt=pk))
+
+    def get_claves(self, queryset, posicion, limite):
+        """Hasta `limite` tuplas (pk, valor, *extra_fields) a partir de `posicion` (None = primera página)"""
+        campo = self.ordering_field
+        columnas = ('pk', campo, *self.extra_fields)
+        claves = queryset.order_by(*self.get_ordering()).values_list(*columnas)
+        nulos = queryset.filter(**{f'{campo}__isnull': True}).order_by('-id').values_list(*columnas)
+
+        if posicion is None:
+            return list(claves[:limite])
+
+        valor, pk = posicion
+        if valor is None:
+            # Ya estamos en la cola de NULLs: sólo queda desempatar por id
+            return list(nulos.filter(id__lt=pk)[:limite])
+
+        filas = list(claves.filter(self.filtro_despues_de(valor, pk))[:limite])
+        if len(filas) < limite:
+            # Se acabaron las filas con fecha: completar con la cola de NULLs
+            filas += list(nulos[:limite - len(filas)])
+        return filas
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.get_filas(queryset, self.paginate_claves(queryset, request))
+
+    def paginate_claves(self, queryset, request):
+        """Paso 1: claves de la página pedida (y el cursor de la siguiente)"""
+        self.request = request
+        page_size = self.get_page_size(request)
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        posicion = self.decode_cursor(cursor) if cursor else None
+
+        # 1) Claves de la página recorriendo sólo el índice de la tabla (sin los JOIN de select_related,
+        #    que pueden llevar al planificador a ordenar la tabla completa). Se pide una fila extra
+        #    sólo para saber si hay página siguiente.
+        claves = self.get_claves(queryset, posicion, page_size + 1)
+        self.has_next = len(claves) > page_size
+        claves = claves[:page_size]
+
+        self.next_cursor = None
+        if self.has_next:
+            pk, valor = claves[-1][:2]
+            self.next_cursor = self.encode_cursor(valor, pk)
+        return claves
+
+    def get_filas(self, queryset, claves):
+        """Paso 2: filas completas (con sus select_related / prefetch) por clave primaria, en el mismo orden"""
+        por_pk = queryset.in_bulk([clave[0] for clave in claves])
+        return [por_pk[clave[0]] for clave in claves if clave[0] in por_pk]
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'next_cursor': self.next_cursor,
+            'results': data,
+        })
@@ -0,0 +1,184 @@
+"""Búsqueda de personas por nombre o RUT mientras se escribe (recepción, médicos).
+
+Persona guarda al escribirse (save() o completar_busqueda() antes de un
+bulk_create) dos columnas derivadas:
+- rut_normalizado: sólo dígitos y K, sin puntos, guion ni ceros a la izquierda
+  ("12.345.678-9" -> "123456789"). Así "12.345.678-9", "12345678-9",
+  "123456789" y "12345678" (sin dígito verificador) encuentran a la misma persona.
+- nombre_normalizado: "nombre apellido" en minúsculas y sin tildes.
+
+Índices (migración 0018; en SQLite, 0021 los repone tras 0020):
+- PostgreSQL: pg_trgm, con índices GIN de trigramas sobre ambas columnas. Los
+  nombres se buscan por similitud de palabras (tolera errores de tipeo).
+- SQLite: tabla FTS5 con tokenizador trigram sobre nombre_normalizado
+  (coincidencia por subcadenas, sin tolerancia a errores) sincronizada por
+  triggers, y el índice B-tree de rut_normalizado.
+
+Los update() masivos sobre nombre o apellido no pasan por save(): después
+correr `python manage.py reconstruir_busqueda`, que también rehace la tabla
+FTS5 (necesario si una migración vuelve a crear la tabla persona en SQLite).
+"""
+import re
+import unicodedata
+
+from django.db import connection
+from django.db.models import Case, IntegerField, Value, When
+from django.db.models.functions import Length
+
+from .models import Paciente, Persona
+
+
+LIMITE = 10
+LIMITE_MAXIMO = 20
+MIN_CARACTERES = 3
+MAX_PALABRAS = 5
+TAMANO_LOTE = 2000
+
+# Sólo dígitos, puntos, guion y K: se busca por RUT
+PARECE_RUT = re.compile(r'[\d.\-\s]*\d[\d.\-\s]*[kK]?')
+
+NOMBRES = {
+    'postgresql': '''
+        SELECT "RUT" FROM persona
+        WHERE {condiciones}
+        ORDER BY {rango} DESC, "NOMBRE_NORMALIZADO", "RUT"
+        LIMIT %s
+    ''',
+    # Primero quienes tienen una palabra que empieza con lo escrito
+    'sqlite': '''
+        SELECT persona."RUT" FROM persona_busqueda_fts
+        JOIN persona ON persona.rowid = persona_busqueda_fts.rowid
+        WHERE persona_busqueda_fts MATCH %s
+        ORDER BY instr(' ' || persona."NOMBRE_NORMALIZADO", ' ' || %s) > 0 DESC,
+                 bm25(persona_busqueda_fts), persona."NOMBRE_NORMALIZADO", persona."RUT"
+        LIMIT %s
+    ''',
+}
+
+
+def normalizar_rut(valor):
+    rut = re.sub(r'[^0-9K]', '', (valor or '').upper())
+    return rut.lstrip('0')
+
+
+def digito_verificador(cuerpo):
+    """Dígito verificador (módulo 11) de un cuerpo de RUT sólo con dígitos"""
+    suma = sum(int(digito) * (2 + posicion % 6) for posicion, digito in enumerate(reversed(cuerpo)))
+    resto = 11 - suma % 11
+    return {11: '0', 10: 'K'}.get(resto, str(resto))
+
+
+def variantes_rut(valor):
+    """rut_normalizado posibles para lo escrito: tal cual, o como cuerpo sin dígito verificador"""
+    rut = normalizar_rut(valor)
+    if not rut:
+        return []
+    if rut.isdigit():
+        return [rut, rut + digito_verificador(rut)]
+    return [rut]
+
+
+def pacientes_por_rut(valor):
+    """Pacientes cuyo RUT coincide con lo escrito; primero el que coincide tal cual"""
+    return Paciente.objects.filter(fk_rut__rut_normalizado__in=variantes_rut(valor)).order_by(
+        Length('fk_rut__rut_normalizado'), 'id',
+    )
+
+
+def normalizar_texto(valor):
+    sin_tildes = unicodedata.normalize('NFKD', valor or '').encode('ascii', 'ignore').decode('ascii')
+    return ' '.join(sin_tildes.lower().split())
+
+
+def buscar(texto, limite=LIMITE):
+    """Personas que coinciden con lo escrito, de la más a la menos parecida:
+    [{'rut', 'nombre', 'apellido', 'paciente_id', 'especialista_id'}]"""
+    texto = (texto or '').strip()
+    if len(texto) < MIN_CARACTERES:
+        return []
+    if PARECE_RUT.fullmatch(texto):
+        ruts = _por_rut(texto, limite)
+    else:
+        ruts = _por_nombre(normalizar_texto(texto).split()[:MAX_PALABRAS], limite)
+    if not ruts:
+        return []
+    filas = {
+        fila['rut']: fila
+        for fila in Persona.objects.filter(rut__in=ruts).values(
+            'rut', 'nombre', 'apellido', 'paciente__id', 'especialista__id',
+        )
+    }
+    return [
+        {
+            'rut': rut,
+            'nombre': filas[rut]['nombre'],
+            'apellido': filas[rut]['apellido'],
+            'paciente_id': filas[rut]['paciente__id'],
+            'especialista_id': filas[rut]['especialista__id'],
+        }
+        for rut in ruts if rut in filas
+    ]
+
+
+def _por_rut(texto, limite):
+    rut = normalizar_rut(texto)
+    if connection.vendor == 'postgresql':
+        # LIKE 'prefijo%' lo resuelve el índice de trigramas
+        personas = Persona.objects.filter(rut_normalizado__startswith=rut)
+    else:
+        # Rango sobre el índice B-tree (LIKE no lo usa en SQLite)
+        personas = Persona.objects.filter(rut_normalizado__gte=rut, rut_normalizado__lt=rut + '\uffff')
+    exactos = Case(When(rut_normalizado__in=variantes_rut(texto), then=Value(0)), default=Value(1), output_field=IntegerField())
+    return list(
+        personas.order_by(exactos, Length('rut_normalizado'), 'rut_normalizado')
+        .values_list('rut', flat=True)[:limite]
+    )
+
+
+def _por_nombre(palabras, limite):
+    vendor = connection.vendor
+    if vendor == 'postgresql':
+        # word_similarity: qué tanto se parece cada palabra a alguna parte del nombre
+        sql = NOMBRES[vendor].format(
+            condiciones=' AND '.join(['%s <%% "NOMBRE_NORMALIZADO"'] * len(palabras)),
+            rango=' + '.join(['word_similarity(%s, "NOMBRE_NORMALIZADO")'] * len(palabras)),
+        )
+        params = palabras + palabras + [limite]
+    elif vendor == 'sqlite':
+        # El tokenizador trigram necesita al menos 3 caracteres por término
+        terminos = [palabra for palabra in palabras if len(palabra) >= 3]
+        if not terminos:
+            return []
+        sql = NOMBRES[vendor]
+        params = [' '.join('"{}"'.format(termino.replace('"', '""')) for termino in terminos), palabras[0], limite]
+    else:
+        personas = Persona.objects.all()
+        for palabra in palabras:
+            personas = personas.filter(nombre_normalizado__contains=palabra)
+        return list(personas.order_by('nombre_normalizado', 'rut').values_list('rut', flat=True)[:limite])
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [rut for rut, in cursor.fetchall()]
+
+
+def reconstruir(tamano=TAMANO_LOTE):
+    """Recalcula las columnas normalizadas que quedaron desactualizadas; devuelve cuántas personas cambiaron"""
+    cambiadas = []
+    total = 0
+    for persona in Persona.objects.only('rut', 'nombre', 'apellido', 'rut_normalizado', 'nombre_normalizado').iterator(chunk_size=tamano):
+        antes = (persona.rut_normalizado, persona.nombre_normalizado)
+        persona.completar_busqueda()
+        if (persona.rut_normalizado, persona.nombre_normalizado) != antes:
+            cambiadas.append(persona)
+        if len(cambiadas) >= tamano:
+            Persona.objects.bulk_update(cambiadas, ['rut_normalizado', 'nombre_normalizado'])
+            total += len(cambiadas)
+            cambiadas = []
+    Persona.objects.bulk_update(cambiadas, ['rut_normalizado', 'nombre_normalizado'])
+    total += len(cambiadas)
+
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO persona_busqueda_fts (persona_busqueda_fts) VALUES ('rebuild')")
+    return total
@@ -0,0 +1,78 @@
+from django.db.models import Count, IntegerField, Max, OuterRef, Prefetch, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Consulta, Paciente, Receta
+from .personas import normalizar_rut, normalizar_texto
+
+
+ESTADOS_ABIERTOS = ('pendiente', 'aceptada', 'aplazada')
+
+
+def consultas_para_serializar(queryset=None):
+    """Queryset de Consulta listo para ConsultaSerializer sin consultas N+1.
+
+    - paciente y su persona (paciente_nombre / paciente_rut / paciente_correo)
+    - especialista asignado y su persona (especialista_nombre)
+    - diagnostico_data por JOIN y sus recetas con un solo prefetch
+
+    Serializar una página completa cuesta 2 consultas: las filas y las recetas.
+    """
+    if queryset is None:
+        queryset = Consulta.objects.all()
+    return queryset.select_related(
+        'fk_idpaciente__fk_rut',
+        'especialista_asignado__fk_rutp',
+        'diagnostico_data',
+    ).prefetch_related(
+        Prefetch('diagnostico_data__recetas', queryset=Receta.objects.order_by('id')),
+    )
+
+
+def _subconsulta_por_paciente(consultas, agregado):
+    """Agregado correlacionado de Consulta para el paciente de la fila externa"""
+    return Subquery(
+        consultas.filter(fk_idpaciente=OuterRef('pk'))
+        .order_by()
+        .values('fk_idpaciente')
+        .annotate(valor=agregado)
+        .values('valor')[:1]
+    )
+
+
+def pacientes_con_resumen(busqueda=''):
+    """Pacientes con persona y resumen de consultas en una sola consulta SQL.
+
+    Anota num_consultas, ultima_visita (última consulta finalizada) y
+    citas_abiertas. Son subconsultas correlacionadas: con LIMIT la base de datos
+    sólo las calcula para las filas de la página, no para todo el directorio.
+
+    busqueda filtra por prefijo de RUT (ignorando puntos, guion y ceros a la
+    izquierda) o por nombre/apellido sin importar mayúsculas ni tildes; con
+    varias palabras todas deben coincidir. Usa las columnas normalizadas de
+    Persona (personas.py), que en PostgreSQL tienen índices de trigramas.
+    """
+    pacientes = Paciente.objects.select_related('fk_rut')
+
+    busqueda = (busqueda or '').strip()
+    if busqueda:
+        rut = normalizar_rut(busqueda)
+        filtro = Q()
+        for palabra in normalizar_texto(busqueda).split():
+            filtro &= Q(fk_rut__nombre_normalizado__contains=palabra)
+        if rut:
+            filtro |= Q(fk_rut__rut_normalizado__startswith=rut)
+        pacientes = pacientes.filter(filtro)
+
+    consultas = Consulta.objects.all()
+    return pacientes.annotate(
+        num_consultas=Coalesce(
+            _subconsulta_por_paciente(consultas, Count('id')), 0, output_field=IntegerField()
+        ),
+        ultima_visita=_subconsulta_por_paciente(
+            consultas.filter(estado='finalizada'), Max('fecha_inicio')
+        ),
+        citas_abiertas=Coalesce(
+            _subconsulta_por_paciente(consultas.filter(estado__in=ESTADOS_ABIERTOS), Count('id')),
+            0, output_field=IntegerField()
+        ),
+    ).order_by('fk_rut__apellido', 'fk_rut__nombre', 'id')
@@ -0,0 +1,89 @@
+import functools
+import logging
+
+from django.conf import settings
+from django.db import connection
+
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    """Una vista ejecutó más consultas SQL que las declaradas en su presupuesto"""
+
+
+def get_mode():
+    """Modo de control: 'raise' (tests), 'warn' (desarrollo) u 'off' (producción)"""
+    return getattr(settings, 'QUERY_BUDGET_MODE', 'warn' if settings.DEBUG else 'off')
+
+
+class QueryCounter:
+    """execute_wrapper que cuenta (y guarda) las consultas ejecutadas"""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append(sql)
+        return execute(sql, params, many, context)
+
+    def __len__(self):
+        return len(self.queries)
+
+
+def check_budget(nombre, budget, counter, mode):
+    if len(counter) <= budget:
+        return
+    detalle = '\n'.join(counter.queries)
+    mensaje = f'{nombre} ejecutó {len(counter)} consultas SQL (presupuesto: {budget})'
+    if mode == 'raise':
+        raise QueryBudgetExceeded(f'{mensaje}\n{detalle}')
+    logger.warning('%s\n%s', mensaje, detalle)
+
+
+class assert_query_budget:
+    """Context manager para tests: falla si el bloque supera `budget` consultas.
+
+        with assert_query_budget(4):
+            client.get('/api/consultas/')
+    """
+
+    def __init__(self, budget, nombre='bloque'):
+        self.budget = budget
+        self.nombre = nombre
+        self.counter = QueryCounter()
+
+    def __enter__(self):
+        self._wrapper = connection.execute_wrapper(self.counter)
+        self._wrapper.__enter__()
+        return self.counter
+
+    def __exit__(self, exc_type, exc, tb):
+        self._wrapper.__exit__(exc_type, exc, tb)
+        if exc_type is None:
+            check_budget(self.nombre, self.budget, self.counter, 'raise')
+
+
+def query_budget(budget):
+    """Declara cuántas consultas SQL puede ejecutar una vista.
+
+    Según QUERY_BUDGET_MODE registra un warning o lanza QueryBudgetExceeded
+    cuando la vista se pasa. Con 'off' no agrega ningún costo.
+    Va debajo de @api_view para medir sólo la vista (no la autenticación de DRF).
+    """
+    def decorator(view_func):
+        @functools.wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            mode = get_mode()
+            if mode == 'off':
+                return view_func(request, *args, **kwargs)
+
+            counter = QueryCounter()
+            with connection.execute_wrapper(counter):
+                response = view_func(request, *args, **kwargs)
+            check_budget(view_func.__name__, budget, counter, mode)
+            return response
+
+        wrapper.query_budget = budget
+        return wrapper
+    return decorator
@@ -0,0 +1,263 @@
+"""Recordatorios de citas aceptadas (por defecto 24 h y 1 h antes).
+
+`python manage.py enviar_recordatorios` avanza por las citas aceptadas según
+fecha_inicio, con una marca por nivel (MarcaRecordatorio.hasta): en cada pasada
+sólo lee las citas entre la marca y ahora + anticipación, por el índice
+consulta_estado_fecha_idx. Las citas aceptadas o reagendadas después de que su
+hora quedó detrás de la marca se encuentran por `actualizado` (el índice de la
+sincronización). El costo de una pasada depende de las citas próximas y de los
+cambios recientes, no de la historia.
+
+Cada (consulta, nivel, hora de la cita) genera un único Recordatorio (restricción
+única), que después se entrega por lotes al backend configurado en
+RECORDATORIOS_BACKEND. Antes de llamar al backend el lote queda en_envio y se
+confirma; el backend devuelve los mensajes que fallaron y sólo ésos se
+reintentan en la pasada siguiente. Si la cita se canceló o cambió de hora, el
+recordatorio se descarta.
+"""
+import json
+import sys
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Consulta, MarcaRecordatorio, Recordatorio
+
+
+NIVELES = {'24h': 24 * 3600, '1h': 3600}
+TAMANO_LOTE = 100
+MAX_INTENTOS = 5
+# Segundos que un recordatorio puede quedar en_envio antes de darlo por perdido
+PLAZO_ENVIO = 300
+
+# Margen para citas cuya transacción confirmó después de la pasada anterior
+SOLAPE = timedelta(minutes=1)
+
+
+def niveles():
+    """[(nivel, anticipación)] de la mayor anticipación a la menor"""
+    configurados = getattr(settings, 'RECORDATORIOS_NIVELES', NIVELES)
+    return sorted(
+        ((nivel, timedelta(seconds=segundos)) for nivel, segundos in configurados.items()),
+        key=lambda par: par[1], reverse=True,
+    )
+
+
+def escanear(ahora=None):
+    """Crea los recordatorios de las citas que entraron en la ventana de cada nivel; {nivel: citas revisadas}"""
+    ahora = ahora or timezone.now()
+    lista = niveles()
+    revisadas = {}
+    for posicion, (nivel, anticipacion) in enumerate(lista):
+        # Una cita más cercana que el nivel siguiente recibe sólo ese aviso, no dos juntos
+        piso = ahora + lista[posicion + 1][1] if posicion + 1 < len(lista) else ahora
+        fin = ahora + anticipacion
+        with transaction.atomic():
+            marca, _ = MarcaRecordatorio.objects.select_for_update().get_or_create(
+                nivel=nivel, defaults={'hasta': ahora, 'revisado': ahora},
+            )
+            aceptadas = Consulta.objects.filter(estado='aceptada')
+            citas = set(
+                aceptadas.filter(fecha_inicio__gt=max(marca.hasta, piso), fecha_inicio__lte=fin)
+                .values_list('id', 'fecha_inicio')
+            )
+            if marca.hasta > piso:
+                citas.update(
+                    aceptadas.filter(
+                        actualizado__gte=marca.revisado - SOLAPE,
+                        fecha_inicio__gt=piso,
+                        fecha_inicio__lte=min(marca.hasta, fin),
+                    ).values_list('id', 'fecha_inicio')
+                )
+            # Las que ya tienen recordatorio de este nivel para esa hora se ignoran (restricción única)
+            Recordatorio.objects.bulk_create(
+                [Recordatorio(consulta_id=pk, nivel=nivel, fecha_inicio=inicio) for pk, inicio in sorted(citas)],
+                ignore_conflicts=True, batch_size=500,
+            )
+            marca.hasta = max(marca.hasta, fin)
+            marca.revisado = ahora
+            marca.save(update_fields=['hasta', 'revisado'])
+        revisadas[nivel] = len(citas)
+    return revisadas
+
+
+def mensaje(recordatorio):
+    consulta = recordatorio.consulta
+    persona = consulta.fk_idpaciente.fk_rut
+    especialista = consulta.especialista_asignado
+    nombre_especialista = f'{especialista.fk_rutp.nombre} {especialista.fk_rutp.apellido}' if especialista else None
+    inicio = timezone.localtime(recordatorio.fecha_inicio)
+    texto = (
+        f'Hola {persona.nombre}, le recordamos su cita de {consulta.especialidad} '
+        f'el {inicio:%d-%m-%Y} a las {inicio:%H:%M}'
+        + (f' con {nombre_especialista}.' if nombre_especialista else '.')
+    )
+    return {
+        'recordatorio_id': recordatorio.id,
+        'consulta_id': consulta.id,
+        'nivel': recordatorio.nivel,
+        'correo': persona.correo,
+        'nombre': f'{persona.nombre} {persona.apellido}',
+        'fecha_inicio': inicio.isoformat(),
+        'especialidad': consulta.especialidad,
+        'especialista': nombre_especialista,
+        'texto': texto,
+    }
+
+
+def obtener_backend(ruta=None):
+    ruta = ruta or getattr(settings, 'RECORDATORIOS_BACKEND', 'webEmergencia.recordatorios.ConsolaBackend')
+    return import_string(ruta)()
+
+
+def plazo_envio():
+    return timedelta(seconds=getattr(settings, 'RECORDATORIOS_PLAZO_ENVIO', PLAZO_ENVIO))
+
+
+def _lote_pendiente(tamano, excluir=()):
+    pendientes = Recordatorio.objects.filter(estado='pendiente').exclude(id__in=excluir).select_related(
+        'consulta__fk_idpaciente__fk_rut', 'consulta__especialista_asignado__fk_rutp',
+    ).order_by('fecha_inicio', 'id')
+    if connection.features.has_select_for_update_skip_locked:
+        # Dos demonios a la vez no toman el mismo lote
+        pendientes = pendientes.select_for_update(skip_locked=True, of=('self',))
+    return list(pendientes[:tamano])
+
+
+def _liberar_vencidos(max_intentos):
+    """Los en_envio de un demonio que murió vuelven a pendiente (o fallido si agotaron los intentos)"""
+    vencidos = Recordatorio.objects.filter(estado='en_envio', bloqueado_hasta__lt=timezone.now())
+    vencidos.filter(intentos__gte=max_intentos).update(estado='fallido', bloqueado_hasta=None)
+    vencidos.update(estado='pendiente', bloqueado_hasta=None)
+
+
+def _reclamar(tamano, totales, excluir):
+    """Toma un lote, descarta los que ya no corresponden y deja en_envio los vigentes.
+
+    Se confirma antes de llamar al backend: las filas no quedan bloqueadas durante
+    el envío. Devuelve (recordatorios vigentes, hubo lote completo).
+    """
+    with transaction.atomic():
+        lote = _lote_pendiente(tamano, excluir)
+        ahora = timezone.now()
+        vigentes, descartados = [], []
+        for recordatorio in lote:
+            consulta = recordatorio.consulta
+            if (consulta.estado == 'aceptada' and consulta.fecha_inicio == recordatorio.fecha_inicio
+                    and recordatorio.fecha_inicio > ahora):
+                vigentes.append(recordatorio)
+            else:
+                descartados.append(recordatorio.id)
+        if descartados:
+            Recordatorio.objects.filter(id__in=descartados).update(estado='descartado')
+            totales['descartados'] += len(descartados)
+        if vigentes:
+            Recordatorio.objects.filter(id__in=[recordatorio.id for recordatorio in vigentes]).update(
+                estado='en_envio', bloqueado_hasta=ahora + plazo_envio(), intentos=F('intentos') + 1,
+            )
+    return vigentes, len(lote) >= tamano
+
+
+def _registrar(vigentes, errores, max_intentos, totales):
+    """Anota el resultado de cada recordatorio: enviado, o pendiente/fallido con su error"""
+    enviados = [recordatorio.id for recordatorio in vigentes if recordatorio.id not in errores]
+    with transaction.atomic():
+        if enviados:
+            Recordatorio.objects.filter(id__in=enviados).update(
+                estado='enviado', enviado=timezone.now(), bloqueado_hasta=None, error='',
+            )
+        por_error = defaultdict(list)
+        for recordatorio_id, error in errores.items():
+            por_error[error].append(recordatorio_id)
+        for error, ids in por_error.items():
+            fallidos = Recordatorio.objects.filter(id__in=ids, estado='en_envio')
+            fallidos.filter(intentos__gte=max_intentos).update(estado='fallido', bloqueado_hasta=None, error=error)
+            # El resto se reintenta en la pasada siguiente
+            fallidos.update(estado='pendiente', bloqueado_hasta=None, error=error)
+    if enviados:
+        totales['enviados'] += len(enviados)
+    if errores:
+        totales['fallidos'] += len(errores)
+
+
+def entregar(backend=None, tamano=TAMANO_LOTE):
+    """Entrega los recordatorios pendientes por lotes; Counter de resultados.
+
+    El backend informa qué mensajes fallaron ({recordatorio_id: error}); sólo esos se
+    reintentan. Si lanza una excepción, fallan todos los del lote. Si el proceso muere
+    durante el envío, los en_envio vuelven a pendiente tras RECORDATORIOS_PLAZO_ENVIO
+    y pueden repetirse.
+    """
+    backend = backend or obtener_backend()
+    max_intentos = getattr(settings, 'RECORDATORIOS_MAX_INTENTOS', MAX_INTENTOS)
+    totales = Counter()
+    _liberar_vencidos(max_intentos)
+    # Los que fallan en esta pasada no se vuelven a tomar hasta la siguiente
+    fallidos = set()
+    while True:
+        vigentes, lleno = _reclamar(tamano, totales, fallidos)
+        if vigentes:
+            try:
+                errores = backend.enviar([mensaje(recordatorio) for recordatorio in vigentes]) or {}
+            except Exception as e:
+                error = f'{type(e).__name__}: {e}'
+                errores = {recordatorio.id: error for recordatorio in vigentes}
+            _registrar(vigentes, errores, max_intentos, totales)
+            fallidos.update(errores)
+            if len(errores) == len(vigentes):
+                # Backend caído: el resto espera a la pasada siguiente
+                return totales
+        if not lleno:
+            return totales
+
+
+def limpiar(dias=30):
+    """Borra los recordatorios de citas que pasaron hace más de `dias`"""
+    return Recordatorio.objects.filter(fecha_inicio__lt=timezone.now() - timedelta(days=dias)).delete()[0]
+
+
+class ConsolaBackend:
+    """Escribe los recordatorios en la salida estándar (desarrollo)"""
+
+    def __init__(self, salida=None):
+        self.salida = salida or sys.stdout
+
+    def enviar(self, mensajes):
+        for m in mensajes:
+            self.salida.write(f"[recordatorio {m['nivel']}] {m['correo']}: {m['texto']}\n")
+        self.salida.flush()
+
+
+class ArchivoBackend:
+    """Agrega los recordatorios como NDJSON a RECORDATORIOS_ARCHIVO (para otro proceso o para revisar)"""
+
+    def __init__(self, ruta=None):
+        self.ruta = ruta or getattr(settings, 'RECORDATORIOS_ARCHIVO', 'recordatorios.ndjson')
+
+    def enviar(self, mensajes):
+        with open(self.ruta, 'a', encoding='utf-8') as archivo:
+            archivo.write(''.join(json.dumps(m, ensure_ascii=False) + '\n' for m in mensajes))
+
+
+class CorreoBackend:
+    """Un correo por recordatorio con el EMAIL_BACKEND de Django, en una sola conexión por lote"""
+
+    asunto = 'Recordatorio de su cita'
+
+    def enviar(self, mensajes):
+        remitente = getattr(settings, 'DEFAULT_FROM_EMAIL', None)
+        errores = {}
+        # Si no se puede abrir la conexión la excepción sube y falla todo el lote
+        with get_connection(fail_silently=False) as conexion:
+            for m in mensajes:
+                try:
+                    EmailMessage(self.asunto, m['texto'], remitente, [m['correo']], connection=conexion).send()
+                except Exception as e:
+                    errores[m['recordatorio_id']] = f'{type(e).__name__}: {e}'
+        return errores
@@ -0,0 +1,162 @@
+"""Datos sintéticos para benchmarks y pruebas de carga.
+
+Todo lo sembrado usa RUTs con un prefijo propio (por defecto 'B'), así se puede
+borrar sin tocar datos reales.
+"""
+import random
+from datetime import date, timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+
+from .forms import CitaForm
+from .models import Persona, Paciente, Especialista, Consulta, Diagnostico, Receta
+
+
+ESPECIALIDADES = [valor for valor, _ in CitaForm.ESPECIALIDADES]
+
+# Distribución aproximada de estados en una clínica con historial
+ESTADOS_PESOS = [
+    ('finalizada', 60),
+    ('pendiente', 15),
+    ('aceptada', 10),
+    ('cancelada', 10),
+    ('aplazada', 5),
+]
+
+CONTRASENA_SEMILLA = 'semilla123'
+
+
+def rut_semilla(prefijo, numero):
+    return f'{prefijo}{numero:08d}'
+
+
+def _en_lotes(generador, tamano):
+    lote = []
+    for item in generador:
+        lote.append(item)
+        if len(lote) >= tamano:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+def sembrar(pacientes=1000, especialistas=20, consultas=10000, prefijo='B', semilla=42,
+            batch_size=2000, con_diagnosticos=True, log=None):
+    """Crea personas, pacientes, especialistas y consultas con bulk_create por lotes.
+
+    Es determinista para una misma semilla. Devuelve un dict con lo creado.
+    """
+    rnd = random.Random(semilla)
+    log = log or (lambda mensaje: None)
+    contrasena = make_password(CONTRASENA_SEMILLA)
+    ahora = timezone.now()
+
+    def personas(desde, cantidad, etiqueta):
+        for numero in range(desde, desde + cantidad):
+            rut = rut_semilla(prefijo, numero)
+            persona = Persona(
+                rut=rut,
+                nombre=f'{etiqueta}{numero}',
+                apellido=rnd.choice(['González', 'Muñoz', 'Rojas', 'Díaz', 'Pérez', 'Soto', 'Silva', 'Torres']),
+                correo=f'{rut.lower()}@semilla.local',
+                contrasena=contrasena,
+            )
+            # bulk_create no pasa por save()
+            persona.completar_busqueda()
+            yield persona
+
+    with transaction.atomic():
+        for lote in _en_lotes(personas(1, especialistas, 'Especialista'), batch_size):
+            Persona.objects.bulk_create(lote, batch_size=batch_size)
+            Especialista.objects.bulk_create(
+                [Especialista(fk_rutp=p, especialidad=ESPECIALIDADES[i % len(ESPECIALIDADES)])
+                 for i, p in enumerate(lote)],
+                batch_size=batch_size,
+            )
+    log(f'{especialistas} especialistas')
+
+    for lote in _en_lotes(personas(especialistas + 1, pacientes, 'Paciente'), batch_size):
+        with transaction.atomic():
+            Persona.objects.bulk_create(lote, batch_size=batch_size)
+            Paciente.objects.bulk_create(
+                [Paciente(fk_rut=p, fecha_nacimiento=date(1940, 1, 1) + timedelta(days=rnd.randrange(30000)))
+                 for p in lote],
+                batch_size=batch_size,
+            )
+    log(f'{pacientes} pacientes')
+
+    paciente_ids = list(
+        Paciente.objects.filter(fk_rut__rut__startswith=prefijo).values_list('id', flat=True)
+    )
+    especialistas_por_especialidad = {}
+    for esp_id, especialidad in Especialista.objects.filter(
+        fk_rutp__rut__startswith=prefijo
+    ).values_list('id', 'especialidad'):
+        especialistas_por_especialidad.setdefault(especialidad, []).append(esp_id)
+
+    estados = [estado for estado, _ in ESTADOS_PESOS]
+    pesos = [peso for _, peso in ESTADOS_PESOS]
+
+    def generar_consultas():
+        for _ in range(consultas):
+            estado = rnd.choices(estados, pesos)[0]
+            especialidad = rnd.choice(ESPECIALIDADES)
+            if estado in ('pendiente', 'aceptada'):
+                fecha = ahora + timedelta(minutes=rnd.randrange(60 * 24 * 60))
+            else:
+                fecha = ahora - timedelta(minutes=rnd.randrange(60 * 24 * 365 * 3))
+            candidatos = especialistas_por_especialidad.get(especialidad)
+            asignado = rnd.choice(candidatos) if candidatos and estado != 'pendiente' else None
+            yield Consulta(
+                fk_idpaciente_id=rnd.choice(paciente_ids),
+                especialista_asignado_id=asignado,
+                motivo=rnd.choice(['Dolor de cabeza', 'Control', 'Fiebre', 'Dolor abdominal', 'Tos', 'Chequeo']),
+                sintomas='Síntomas de prueba',
+                fecha_inicio=fecha,
+                fecha_fin=fecha + timedelta(minutes=30) if asignado else None,
+                especialidad=especialidad,
+                estado=estado,
+            )
+
+    creadas = 0
+    diagnosticos = 0
+    for lote in _en_lotes(generar_consultas(), batch_size):
+        with transaction.atomic():
+            Consulta.objects.bulk_create(lote, batch_size=batch_size)
+            if con_diagnosticos:
+                # Sólo posible si el backend devuelve los ids del bulk_create (PostgreSQL, SQLite >= 3.35)
+                finalizadas = [c for c in lote if c.estado == 'finalizada' and c.pk is not None]
+                nuevos = Diagnostico.objects.bulk_create(
+                    [Diagnostico(consulta=c, descripcion='Diagnóstico de prueba') for c in finalizadas],
+                    batch_size=batch_size,
+                )
+                Receta.objects.bulk_create(
+                    [Receta(diagnostico=d, medicamento='Paracetamol', dosis='500 mg', horario='Cada 8 horas')
+                     for d in nuevos if d.pk is not None],
+                    batch_size=batch_size,
+                )
+                diagnosticos += len(nuevos)
+        creadas += len(lote)
+        log(f'{creadas}/{consultas} consultas')
+
+    return {
+        'especialistas': especialistas,
+        'pacientes': pacientes,
+        'consultas': creadas,
+        'diagnosticos': diagnosticos,
+    }
+
+
+def limpiar(prefijo='B'):
+    """Borra todo lo sembrado con `prefijo` (las FK son DO_NOTHING, se borra en orden)"""
+    with transaction.atomic():
+        consultas = Consulta.objects.filter(fk_idpaciente__fk_rut__rut__startswith=prefijo)
+        Receta.objects.filter(diagnostico__consulta__in=consultas).delete()
+        Diagnostico.objects.filter(consulta__in=consultas).delete()
+        consultas.delete()
+        Paciente.objects.filter(fk_rut__rut__startswith=prefijo).delete()
+        Especialista.objects.filter(fk_rutp__rut__startswith=prefijo).delete()
+        Persona.objects.filter(rut__startswith=prefijo).delete()
@@ -0,0 +1,301 @@
+"""Lecturas de seguimiento que envían los dispositivos y apps de los pacientes.
+
+POST /api/seguimiento/ recibe un lote (arreglo JSON o NDJSON). Se valida por
+columnas en una sola pasada, sin consultas por lectura: los RUT del lote se
+resuelven en una consulta. Las válidas se escriben juntas, con bulk_create o,
+en PostgreSQL y lotes grandes, con COPY a una tabla temporal e
+INSERT ... ON CONFLICT DO NOTHING. La restricción seguimiento_lectura_unica
+(paciente, dispositivo, fecha_registro) hace que reenviar un lote no duplique.
+SQLite admite pocos parámetros por INSERT: allí un lote grande son varias
+sentencias y puede superar el presupuesto de consultas de la vista.
+
+Un dispositivo que mide cada minuto debería juntar sus lecturas y enviarlas
+cada varios minutos: una transacción por lote en vez de una por lectura.
+
+GET /api/seguimiento/ devuelve las lecturas de un rango; si son más de `puntos`,
+una por intervalo (la última) con cuántas había, agrupadas en la base de datos.
+"""
+import io
+import json
+import math
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Func, IntegerField, Max, Min
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Paciente, Seguimiento
+
+
+MAX_LOTE = 5000
+PUNTOS = 500
+PUNTOS_MAXIMO = 2000
+TAMANO_LOTE = 1000
+
+# Tolerancia para relojes de dispositivos adelantados
+FUTURO = timedelta(minutes=5)
+
+CAMPOS = ('dispositivo', 'fecha_registro', 'medicacion', 'instruccion', 'control')
+
+
+class LoteInvalido(Exception):
+    """El cuerpo no es un lote de lecturas (no se valida lectura por lectura)"""
+
+
+def leer_lote(datos=None, cuerpo=None):
+    """Lista de lecturas de un JSON ya parseado (arreglo o {"lecturas": [...]}) o de un cuerpo NDJSON"""
+    if cuerpo is not None:
+        lecturas = []
+        for linea in cuerpo.decode('utf-8', errors='replace').splitlines():
+            if not linea.strip():
+                continue
+            try:
+                lectura = json.loads(linea)
+            except json.JSONDecodeError as e:
+                lectura = {'_error': f'JSON inválido: {e}'}
+            lecturas.append(lectura)
+    elif isinstance(datos, dict) and 'lecturas' in datos:
+        lecturas = datos['lecturas']
+    else:
+        lecturas = datos
+    if not isinstance(lecturas, list):
+        raise LoteInvalido('Se esperaba un arreglo de lecturas, {"lecturas": [...]} o NDJSON')
+    if not lecturas:
+        raise LoteInvalido('El lote no trae lecturas')
+    maximo = getattr(settings, 'SEGUIMIENTO_MAX_LOTE', MAX_LOTE)
+    if len(lecturas) > maximo:
+        raise LoteInvalido(f'El lote trae {len(lecturas)} lecturas; el máximo es {maximo}')
+    return lecturas
+
+
+def _texto(largo, obligatorio=False):
+    def validar(valor):
+        if valor is None or valor == '':
+            return None, 'es obligatorio' if obligatorio else None
+        if isinstance(valor, bool) or not isinstance(valor, (str, int, float)):
+            return None, 'debe ser texto o número'
+        valor = str(valor).strip()
+        if len(valor) > largo:
+            return None, f'admite hasta {largo} caracteres'
+        return valor, None
+    return validar
+
+
+def _fecha(limite):
+    def validar(valor):
+        if isinstance(valor, bool):
+            return None, 'debe ser una fecha ISO o segundos desde 1970'
+        try:
+            if isinstance(valor, (int, float)):
+                fecha = datetime.fromtimestamp(valor, tz=dt_timezone.utc)
+            elif isinstance(valor, str):
+                fecha = parse_datetime(valor)
+            else:
+                fecha = None
+        except (ValueError, OverflowError, OSError):
+            fecha = None
+        if fecha is None:
+            return None, 'es obligatoria' if valor in (None, '') else 'debe ser una fecha ISO o segundos desde 1970'
+        if timezone.is_naive(fecha):
+            fecha = timezone.make_aware(fecha)
+        if fecha > limite:
+            return None, 'está en el futuro'
+        return fecha, None
+    return validar
+
+
+def validar(lecturas, paciente_id=None):
+    """Valida el lote columna por columna.
+
+    Con paciente_id todas son de ese paciente; si no, cada lectura trae su `rut`.
+    Devuelve (Seguimiento sin guardar, rechazadas [{'indice', 'error'}], repetidas dentro del lote).
+    """
+    errores = [[] for _ in lecturas]
+    filas = []
+    for indice, lectura in enumerate(lecturas):
+        if not isinstance(lectura, dict):
+            errores[indice].append('Se esperaba un objeto JSON')
+            lectura = {}
+        elif '_error' in lectura:
+            errores[indice].append(lectura['_error'])
+        filas.append(lectura)
+
+    validadores = {
+        'dispositivo': _texto(100, obligatorio=True),
+        'fecha_registro': _fecha(timezone.now() + FUTURO),
+        'medicacion': _texto(100),
+        'instruccion': _texto(255),
+        'control': _texto(255),
+    }
+    columnas = {}
+    for campo, validador in validadores.items():
+        columnas[campo] = []
+        for indice, (valor, error) in enumerate(map(validador, (fila.get(campo) for fila in filas))):
+            if error:
+                errores[indice].append(f'{campo} {error}')
+            columnas[campo].append(valor)
+
+    if paciente_id is not None:
+        columnas['paciente'] = [paciente_id] * len(filas)
+    else:
+        ruts = [str(fila.get('rut') or '').strip() for fila in filas]
+        pacientes = dict(
+            Paciente.objects.filter(fk_rut_id__in={rut for rut in ruts if rut}).values_list('fk_rut_id', 'id')
+        )
+        columnas['paciente'] = [pacientes.get(rut) for rut in ruts]
+        for indice, (rut, paciente) in enumerate(zip(ruts, columnas['paciente'])):
+            if paciente is None:
+                errores[indice].append('rut es obligatorio' if not rut else f'rut {rut} no corresponde a un paciente')
+
+    validas, rechazadas, vistas = [], [], set()
+    repetidas = 0
+    for indice, (paciente, dispositivo, fecha, medicacion, instruccion, control) in enumerate(zip(
+        columnas['paciente'], *(columnas[campo] for campo in CAMPOS),
+    )):
+        if not errores[indice] and medicacion is None and instruccion is None and control is None:
+            errores[indice].append('La lectura no trae medicacion, instruccion ni control')
+        if errores[indice]:
+            rechazadas.append({'indice': indice, 'error': '; '.join(errores[indice])})
+            continue
+        clave = (paciente, dispositivo, fecha)
+        if clave in vistas:
+            repetidas += 1
+            continue
+        vistas.add(clave)
+        validas.append(Seguimiento(
+            fk_idpac_id=paciente, dispositivo=dispositivo, fecha_registro=fecha,
+            medicacion=medicacion or '', instruccion=instruccion or '', control=control,
+        ))
+    return validas, rechazadas, repetidas
+
+
+def guardar(lecturas):
+    """Escribe las lecturas que no estaban ya guardadas; devuelve cuántas se insertaron"""
+    if not lecturas:
+        return 0
+    with transaction.atomic():
+        minimo = getattr(settings, 'SEGUIMIENTO_COPY_MINIMO', TAMANO_LOTE)
+        if connection.vendor == 'postgresql' and len(lecturas) >= minimo:
+            return _copiar(lecturas)
+        return _insertar(lecturas)
+
+
+def _insertar(lecturas):
+    # Las ya guardadas salen en una lectura del índice único, acotada al rango de horas del lote
+    fechas = [lectura.fecha_registro for lectura in lecturas]
+    existentes = set(Seguimiento.objects.filter(
+        fk_idpac_id__in={lectura.fk_idpac_id for lectura in lecturas},
+        dispositivo__in={lectura.dispositivo for lectura in lecturas},
+        fecha_registro__gte=min(fechas),
+        fecha_registro__lte=max(fechas),
+    ).values_list('fk_idpac_id', 'dispositivo', 'fecha_registro'))
+    nuevas = [
+        lectura for lectura in lecturas
+        if (lectura.fk_idpac_id, lectura.dispositivo, lectura.fecha_registro) not in existentes
+    ]
+    # Si otro envío guarda la misma lectura al mismo tiempo, la restricción única la ignora
+    Seguimiento.objects.bulk_create(nuevas, ignore_conflicts=True, batch_size=TAMANO_LOTE)
+    return len(nuevas)
+
+
+def _valor_copy(valor):
+    """Valor en el formato de texto de COPY"""
+    if valor is None:
+        return '\\N'
+    if isinstance(valor, datetime):
+        return valor.isoformat()
+    return str(valor).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def _copiar(lecturas):
+    campos = [Seguimiento._meta.get_field(campo) for campo in ('fk_idpac',) + CAMPOS]
+    columnas = ', '.join(connection.ops.quote_name(campo.column) for campo in campos)
+    tabla = connection.ops.quote_name(Seguimiento._meta.db_table)
+    datos = ''.join(
+        '\t'.join(_valor_copy(getattr(lectura, campo.attname)) for campo in campos) + '\n'
+        for lectura in lecturas
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'CREATE TEMP TABLE seguimiento_carga ON COMMIT DROP AS SELECT {columnas} FROM {tabla} WITH NO DATA'
+        )
+        copia = f'COPY seguimiento_carga ({columnas}) FROM STDIN'
+        crudo = cursor.cursor
+        if hasattr(crudo, 'copy_expert'):
+            crudo.copy_expert(copia, io.StringIO(datos))  # psycopg2
+        else:
+            with crudo.copy(copia) as destino:  # psycopg 3
+                destino.write(datos)
+        cursor.execute(
+            f'INSERT INTO {tabla} ({columnas}) SELECT {columnas} FROM seguimiento_carga ON CONFLICT DO NOTHING'
+        )
+        return cursor.rowcount
+
+
+class Intervalo(Func):
+    """Número del intervalo de `ancho` segundos desde `origen` en que cae un DateTimeField"""
+
+    output_field = IntegerField()
+    segundos = {
+        'postgresql': 'EXTRACT(EPOCH FROM {})',
+        'mysql': "TIMESTAMPDIFF(SECOND, '1970-01-01', {})",
+        'sqlite': '(julianday({}) - 2440587.5) * 86400',
+    }
+    entero = {'postgresql': 'bigint', 'mysql': 'signed'}
+
+    def __init__(self, campo, origen, ancho):
+        super().__init__(campo)
+        self.origen = int(origen.timestamp())
+        self.ancho = int(ancho)
+
+    def as_sql(self, compiler, connection, **extra):
+        campo, params = compiler.compile(self.source_expressions[0])
+        segundos = self.segundos[connection.vendor].format(campo)
+        division = f'({segundos} - %s) / %s'
+        if connection.vendor == 'sqlite':
+            # Sólo se agrupan filas desde `origen`: truncar es lo mismo que redondear hacia abajo
+            return f'CAST({division} AS integer)', (*params, self.origen, self.ancho)
+        return f'CAST(FLOOR({division}) AS {self.entero[connection.vendor]})', (*params, self.origen, self.ancho)
+
+
+def _lectura(fila):
+    return {campo: fila[campo] for campo in CAMPOS}
+
+
+def consultar(paciente_id, desde, hasta, dispositivo=None, puntos=PUNTOS):
+    """Lecturas entre desde (inclusive) y hasta; con más de `puntos`, una por intervalo.
+
+    Devuelve (total de lecturas del rango, segundos por intervalo o None, lecturas).
+    """
+    filas = Seguimiento.objects.filter(fk_idpac_id=paciente_id, fecha_registro__gte=desde, fecha_registro__lt=hasta)
+    if dispositivo:
+        filas = filas.filter(dispositivo=dispositivo)
+    total = filas.count()
+    if total <= puntos:
+        return total, None, [
+            _lectura(fila) for fila in filas.values(*CAMPOS).order_by('fecha_registro', 'dispositivo')
+        ]
+
+    ancho = max(math.ceil((hasta - desde).total_seconds() / puntos), 1)
+    grupos = list(
+        filas.annotate(intervalo=Intervalo('fecha_registro', desde, ancho))
+        .values('dispositivo', 'intervalo')
+        .annotate(cantidad=Count('id'), primera=Min('fecha_registro'), ultima=Max('fecha_registro'))
+        .order_by('intervalo', 'dispositivo')
+    )
+    # La última lectura de cada intervalo (única por paciente, dispositivo y hora)
+    ultimas = {
+        (fila['dispositivo'], fila['fecha_registro']): fila
+        for fila in filas.filter(fecha_registro__in={grupo['ultima'] for grupo in grupos}).values(*CAMPOS)
+    }
+    return total, ancho, [
+        dict(
+            _lectura(ultimas[(grupo['dispositivo'], grupo['ultima'])]),
+            intervalo_inicio=desde + timedelta(seconds=int(grupo['intervalo']) * ancho),
+            primera=grupo['primera'],
+            cantidad=grupo['cantidad'],
+        )
+        for grupo in grupos
+    ]
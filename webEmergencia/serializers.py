@@ -24,7 +24,11 @@ class ConsultaSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Consulta
-        fields = '__all__'
+        # actualizado y version viajan en las cabeceras ETag / Last-Modified (condicional.py)
+        exclude = ['actualizado', 'version']
+        # El estado sólo cambia por las transiciones de transiciones.py; el especialista y el fin
+        # del bloque los fija la agenda (agenda.reservar / agenda.reprogramar)
+        read_only_fields = ['estado', 'especialista_asignado', 'fecha_fin']
     
     def get_paciente_nombre(self, obj):
         try:
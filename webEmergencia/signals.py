@@ -0,0 +1,74 @@
+"""Invalidación de cachés derivados de Consulta, Diagnostico y Receta.
+
+- Documentos de mis_documentos (documentos.py): las ediciones del diagnóstico ya
+  cambian su versión (actualizado es auto_now); aquí se cubren las recetas.
+- ETag de la API de consultas (condicional.py): el diagnóstico y las recetas van
+  en el payload de la consulta, así que sus cambios también la marcan.
+- Sincronización incremental (sincronizacion.py): mismo `actualizado`, y una
+  lápida por cada consulta borrada.
+- Estadísticas diarias (estadisticas.py): los UPDATE de transiciones.actualizar
+  avisan solos; aquí los save() y delete() de Consulta.
+- Búsqueda de texto (busqueda.py): save() de Consulta y cambios del diagnóstico.
+- Principal cacheado en sesión (middleware.py): altas, cambios y bajas de
+  Paciente y Especialista (admin, registro) suben Persona.version_rol y todos
+  los workers vuelven a leer el rol en la petición siguiente.
+
+bulk_create no dispara signals: finalizacion.py sólo lo usa para diagnósticos
+nuevos, cuya consulta ya marcó su propio UPDATE de estado (y avisa a la búsqueda).
+"""
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import busqueda
+from .documentos import invalidar
+from .estadisticas import programar
+from .middleware import marcar_cambio_rol
+from .models import Consulta, Diagnostico, Especialista, Paciente, Receta
+from .sincronizacion import registrar_eliminada
+from .transiciones import actualizar
+
+
+@receiver(pre_save, sender=Consulta)
+def consulta_guardada(sender, instance, **kwargs):
+    # actualizado lo mueve auto_now; la versión se sube aquí
+    if not instance._state.adding:
+        instance.version = (instance.version or 0) + 1
+
+
+@receiver(post_save, sender=Consulta)
+def consulta_escrita(sender, instance, update_fields=None, **kwargs):
+    programar([instance.pk])
+    if update_fields is None or set(update_fields) & {'motivo', 'sintomas', 'diagnostico'}:
+        busqueda.programar([instance.pk])
+
+
+@receiver(post_delete, sender=Consulta)
+def consulta_eliminada(sender, instance, **kwargs):
+    registrar_eliminada(instance)
+    programar([instance.pk])
+
+
+@receiver(post_save, sender=Diagnostico)
+@receiver(post_delete, sender=Diagnostico)
+def diagnostico_cambiado(sender, instance, **kwargs):
+    actualizar(Consulta.objects.filter(pk=instance.consulta_id))
+    busqueda.programar([instance.consulta_id])
+
+
+@receiver(post_save, sender=Receta)
+@receiver(post_delete, sender=Receta)
+def receta_cambiada(sender, instance, **kwargs):
+    invalidar([instance.diagnostico_id])
+    actualizar(Consulta.objects.filter(diagnostico_data=instance.diagnostico_id))
+
+
+@receiver(post_save, sender=Paciente)
+@receiver(post_delete, sender=Paciente)
+def paciente_cambiado(sender, instance, **kwargs):
+    marcar_cambio_rol(instance.fk_rut_id)
+
+
+@receiver(post_save, sender=Especialista)
+@receiver(post_delete, sender=Especialista)
+def especialista_cambiado(sender, instance, **kwargs):
+    marcar_cambio_rol(instance.fk_rutp_id)
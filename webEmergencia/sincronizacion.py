@@ -0,0 +1,107 @@
+"""Sincronización incremental de consultas para clientes offline.
+
+El cliente guarda una marca (cursor opaco) y pide sólo lo que cambió después:
+consultas nuevas o modificadas (con diagnóstico y recetas, que mueven
+`actualizado` de su consulta desde signals.py) y lápidas de las borradas
+(ConsultaEliminada). Cambios y lápidas se recorren juntos en orden
+(momento, id) por sus índices, en páginas de tamaño acotado: sincronizar cuesta
+O(cambios), no O(historial).
+
+`actualizado` se fija al escribir, no al confirmar: una transacción lenta puede
+hacer visible una fila con un momento anterior a la marca de un cliente que
+sincronizó entretanto. Por eso ?since= relee los últimos SYNC_SOLAPE_SEGUNDOS;
+el cliente aplica los cambios por id y `version`, así que repetirlos no cambia nada.
+"""
+import heapq
+from datetime import timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Consulta, ConsultaEliminada
+from .pagination import KeysetPagination
+
+
+LIMITE = 200
+LIMITE_MAXIMO = 500
+
+
+class MarcaVencida(Exception):
+    """La marca es más antigua que las lápidas guardadas: hay que sincronizar desde cero"""
+
+
+def solape():
+    return timedelta(seconds=getattr(settings, 'SYNC_SOLAPE_SEGUNDOS', 60))
+
+
+def retencion():
+    return timedelta(days=getattr(settings, 'SYNC_RETENCION_DIAS', 30))
+
+
+def _despues_de(campo, campo_id, momento, pk):
+    return Q(**{f'{campo}__gte': momento}) & (Q(**{f'{campo}__gt': momento}) | Q(**{f'{campo_id}__gt': pk}))
+
+
+def cambios(paciente=None, since=None, cursor=None, limite=LIMITE):
+    """Siguiente página de cambios.
+
+    since: marca de una sincronización anterior (se relee el solape).
+    cursor: continuación exacta de la página anterior.
+    Devuelve (ids de consultas cambiadas, ids eliminados, cursor siguiente, hay_mas).
+    """
+    codec = KeysetPagination()
+    consultas = Consulta.objects.all()
+    lapidas = ConsultaEliminada.objects.all()
+    if paciente is not None:
+        consultas = consultas.filter(fk_idpaciente=paciente)
+        lapidas = lapidas.filter(paciente_id=paciente.id)
+
+    posicion = None
+    if cursor:
+        posicion = codec.decode_cursor(cursor)
+        consultas = consultas.filter(_despues_de('actualizado', 'id', *posicion))
+        lapidas = lapidas.filter(_despues_de('eliminada', 'consulta_id', *posicion))
+    elif since:
+        posicion = codec.decode_cursor(since)
+        if posicion[0] is None or posicion[0] < timezone.now() - retencion():
+            raise MarcaVencida()
+        desde = posicion[0] - solape()
+        consultas = consultas.filter(actualizado__gt=desde)
+        lapidas = lapidas.filter(eliminada__gt=desde)
+
+    # Sólo claves, por el índice; limite + 1 de cada lado para saber si hay más
+    claves_c = consultas.order_by('actualizado', 'id').values_list('actualizado', 'id')[:limite + 1]
+    claves_e = lapidas.order_by('eliminada', 'consulta_id').values_list('eliminada', 'consulta_id')[:limite + 1]
+    mezcla = heapq.merge(
+        ((momento, pk, False) for momento, pk in claves_c),
+        ((momento, pk, True) for momento, pk in claves_e),
+    )
+    pagina = list(islice(mezcla, limite + 1))
+    hay_mas = len(pagina) > limite
+    pagina = pagina[:limite]
+
+    if pagina:
+        siguiente = codec.encode_cursor(pagina[-1][0], pagina[-1][1])
+    elif cursor:
+        siguiente = cursor
+    elif since:
+        # Sin cambios: la marca avanza hasta donde ya no puede aparecer nada (ahora menos el solape),
+        # sin retroceder. Repetir la misma marca la vencería (410) en un cliente que nunca ve cambios
+        momento = timezone.now() - solape()
+        siguiente = since if posicion[0] >= momento else codec.encode_cursor(momento, 0)
+    else:
+        # Primera sincronización sin datos: la marca de ahora
+        siguiente = codec.encode_cursor(timezone.now(), 0)
+
+    cambiadas = [pk for _, pk, eliminada in pagina if not eliminada]
+    eliminadas = [pk for _, pk, eliminada in pagina if eliminada]
+    return cambiadas, eliminadas, siguiente, hay_mas
+
+
+def registrar_eliminada(consulta):
+    lapida = ConsultaEliminada.objects.create(consulta_id=consulta.pk, paciente_id=consulta.fk_idpaciente_id)
+    # Limpieza ocasional, como en eventos.py: cada vez que los ids cruzan un múltiplo de 200
+    if lapida.id % 200 == 0:
+        ConsultaEliminada.objects.filter(eliminada__lt=timezone.now() - retencion()).delete()
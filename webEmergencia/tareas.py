@@ -0,0 +1,198 @@
+"""Cola de tareas en segundo plano sobre la base de datos, sin Redis ni broker.
+
+Una vista llama a encolar() dentro de su transacción: la tarea queda guardada
+junto con los datos que la originan (o ninguno de los dos si hay rollback) y la
+respuesta vuelve sin esperar. `python manage.py trabajar_tareas` reclama las
+tareas listas con SELECT ... FOR UPDATE SKIP LOCKED sobre el índice parcial
+tarea_pendientes_idx (varios trabajadores no se estorban) y las ejecuta en un
+pool de hilos o de procesos.
+
+- Prioridad (mayor primero) y ejecutar_en para tareas programadas.
+- Reintentos con backoff exponencial y jitter hasta max_intentos; después
+  queda 'fallida' con el último error.
+- Un trabajador que muere deja la tarea en_curso hasta bloqueada_hasta; vencido
+  el plazo vuelve a pendiente. Por eso los handlers deben poder repetirse.
+
+Los handlers se registran por tipo con @tarea('tipo') en el módulo de su lógica,
+y ese módulo se importa en apps.ready() para que el trabajador los conozca.
+
+Sin trabajador (TAREAS_EN_LINEA, el valor por defecto salvo TAREAS_TRABAJADOR=1)
+la tarea se reclama y se ejecuta en el mismo proceso al confirmar la transacción
+que la encoló: la respuesta espera, pero la tarea no queda olvidada en la cola.
+"""
+import logging
+import os
+import random
+import socket
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Tarea
+
+
+logger = logging.getLogger(__name__)
+
+HANDLERS = {}
+
+
+class Handler:
+    def __init__(self, funcion, max_intentos, tiempo_maximo):
+        self.funcion = funcion
+        self.max_intentos = max_intentos
+        self.tiempo_maximo = tiempo_maximo
+
+
+def tarea(tipo, max_intentos=None, tiempo_maximo=None):
+    """Registra la función como handler de `tipo`; recibe los datos de la tarea como kwargs.
+
+    tiempo_maximo (segundos) es el plazo antes de que otro trabajador la retome.
+    """
+    def registrar(funcion):
+        HANDLERS[tipo] = Handler(
+            funcion,
+            max_intentos or getattr(settings, 'TAREAS_MAX_INTENTOS', 5),
+            tiempo_maximo or getattr(settings, 'TAREAS_TIEMPO_MAXIMO', 300),
+        )
+        return funcion
+    return registrar
+
+
+def encolar(tipo, datos=None, prioridad=0, ejecutar_en=None, max_intentos=None):
+    """Guarda una tarea (en la transacción en curso, si la hay)"""
+    handler = HANDLERS.get(tipo)
+    if max_intentos is None:
+        max_intentos = handler.max_intentos if handler else getattr(settings, 'TAREAS_MAX_INTENTOS', 5)
+    nueva = Tarea.objects.create(
+        tipo=tipo,
+        datos=datos or {},
+        prioridad=prioridad,
+        ejecutar_en=ejecutar_en or timezone.now(),
+        max_intentos=max_intentos,
+    )
+    if getattr(settings, 'TAREAS_EN_LINEA', False) and nueva.ejecutar_en <= timezone.now():
+        transaction.on_commit(lambda: ejecutar_en_linea(nueva.id, tipo), robust=True)
+    return nueva
+
+
+def ejecutar_en_linea(tarea_id, tipo):
+    """Reclama y corre en este proceso una tarea recién encolada (no hay trabajador).
+
+    Si falla queda pendiente para su reintento: lo hace `trabajar_tareas --una-pasada` (cron).
+    """
+    plazo = _plazos({tipo}, timezone.now())[tipo]
+    reclamada = Tarea.objects.filter(id=tarea_id, estado='pendiente').update(
+        estado='en_curso', intentos=F('intentos') + 1, bloqueada_hasta=plazo, trabajador=nombre_trabajador(),
+    )
+    if reclamada:
+        return _ejecutar(tarea_id)
+
+
+def iniciar_proceso():
+    """Los procesos del pool (spawn) necesitan Django configurado y los handlers registrados"""
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+
+def nombre_trabajador():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def espera_reintento(intentos):
+    base = getattr(settings, 'TAREAS_BACKOFF_BASE', 10)
+    maximo = getattr(settings, 'TAREAS_BACKOFF_MAX', 3600)
+    # Jitter: los reintentos de un mismo corte no vuelven todos juntos
+    return timedelta(seconds=min(base * 2 ** (intentos - 1), maximo) * random.uniform(0.5, 1.5))
+
+
+def _plazos(tipos, ahora):
+    return {
+        tipo: ahora + timedelta(seconds=HANDLERS[tipo].tiempo_maximo if tipo in HANDLERS else 300)
+        for tipo in tipos
+    }
+
+
+def reclamar(cantidad, trabajador, tipos=None):
+    """Marca en_curso hasta `cantidad` tareas listas y devuelve sus ids, en orden de prioridad"""
+    ahora = timezone.now()
+    listas = Tarea.objects.filter(estado='pendiente', ejecutar_en__lte=ahora)
+    if tipos:
+        listas = listas.filter(tipo__in=tipos)
+    listas = listas.order_by('-prioridad', 'ejecutar_en', 'id')
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            candidatas = list(listas.select_for_update(skip_locked=True).values_list('id', 'tipo')[:cantidad])
+            for tipo, plazo in _plazos({tipo for _, tipo in candidatas}, ahora).items():
+                Tarea.objects.filter(id__in=[pk for pk, t in candidatas if t == tipo]).update(
+                    estado='en_curso', intentos=F('intentos') + 1, bloqueada_hasta=plazo, trabajador=trabajador,
+                )
+        return [pk for pk, _ in candidatas]
+
+    # Sin SKIP LOCKED (SQLite): UPDATE condicional por tarea; si otro trabajador ganó, se sigue
+    candidatas = list(listas.values_list('id', 'tipo')[:cantidad])
+    plazos = _plazos({tipo for _, tipo in candidatas}, ahora)
+    return [
+        pk for pk, tipo in candidatas
+        if Tarea.objects.filter(id=pk, estado='pendiente').update(
+            estado='en_curso', intentos=F('intentos') + 1, bloqueada_hasta=plazos[tipo], trabajador=trabajador,
+        )
+    ]
+
+
+def ejecutar(tarea_id):
+    """Corre una tarea reclamada y registra el resultado. Devuelve el estado final."""
+    close_old_connections()
+    try:
+        return _ejecutar(tarea_id)
+    finally:
+        close_old_connections()
+
+
+def _ejecutar(tarea_id):
+    tarea = Tarea.objects.get(id=tarea_id)
+    # Sólo quien la tiene reclamada en este intento puede cerrarla
+    propia = Tarea.objects.filter(id=tarea.id, estado='en_curso', intentos=tarea.intentos)
+    handler = HANDLERS.get(tarea.tipo)
+    try:
+        if handler is None:
+            raise LookupError(f'No hay handler registrado para "{tarea.tipo}"')
+        handler.funcion(**tarea.datos)
+    except Exception:
+        error = traceback.format_exc(limit=20)
+        if tarea.intentos < tarea.max_intentos:
+            logger.warning('Tarea %s (%s) falló, intento %s de %s', tarea.id, tarea.tipo, tarea.intentos, tarea.max_intentos)
+            propia.update(
+                estado='pendiente', ejecutar_en=timezone.now() + espera_reintento(tarea.intentos),
+                bloqueada_hasta=None, ultimo_error=error,
+            )
+            return 'pendiente'
+        logger.error('Tarea %s (%s) falló definitivamente\n%s', tarea.id, tarea.tipo, error)
+        propia.update(estado='fallida', terminada=timezone.now(), bloqueada_hasta=None, ultimo_error=error)
+        return 'fallida'
+    propia.update(estado='hecha', terminada=timezone.now(), bloqueada_hasta=None)
+    return 'hecha'
+
+
+def recuperar_vencidas():
+    """Devuelve a pendiente las tareas de trabajadores que murieron (plazo vencido); cuántas"""
+    ahora = timezone.now()
+    vencidas = Tarea.objects.filter(estado='en_curso', bloqueada_hasta__lt=ahora)
+    error = 'Plazo vencido: el trabajador no respondió'
+    # El intento perdido cuenta (se sumó al reclamarla)
+    vencidas.filter(intentos__gte=F('max_intentos')).update(
+        estado='fallida', terminada=ahora, bloqueada_hasta=None, ultimo_error=error,
+    )
+    return vencidas.update(estado='pendiente', bloqueada_hasta=None, ultimo_error=error)
+
+
+def limpiar_terminadas():
+    dias = getattr(settings, 'TAREAS_RETENCION_DIAS', 7)
+    limite = timezone.now() - timedelta(days=dias)
+    return Tarea.objects.filter(estado='hecha', terminada__lt=limite).delete()[0]
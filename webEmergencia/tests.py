@@ -1,3 +1,959 @@
-from django.test import TestCase
+import asyncio
+import json
+import random
+import os
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from collections import Counter
+from datetime import date, timedelta
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import skipUnless
+from unittest.mock import patch
+from urllib.parse import parse_qs, urlparse
 
-# Create your tests here.
+from asgiref.sync import AsyncToSync
+from asgiref.testing import ApplicationCommunicator
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.handlers.asgi import ASGIHandler
+from django.db import connection
+from django.http import JsonResponse
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import path
+from django.utils import timezone
+
+from . import busqueda, estadisticas, personas, recordatorios
+from .agenda import reservar
+from .despacho import repartir_pendientes, tomar_siguiente
+from .finalizacion import finalizar_consultas, motivo_control
+from .middleware import EstaticosASGI
+from .models import Consulta, Diagnostico, Especialista, EstadisticaDiaria, Paciente, Persona, Receta, Recordatorio, Tarea
+from .openfda import CacheMedicamentos, consultar_openfda
+from .pagination import KeysetPagination
+from .transiciones import TRANSICIONES, aplicar, transicionar
+
+
+MARCAS = ['Ibuprofen', 'Ibuprofen PM', 'Ibuprofen and Famotidine', 'Ibutilide', 'Paracetamol', 'Paracetamol Forte']
+
+
+class StubOpenFDA:
+    """Servidor HTTP local que responde como drug/label.json de OpenFDA y cuenta las llamadas"""
+
+    def __init__(self, marcas=MARCAS, demora=0):
+        self.marcas = marcas
+        self.demora = demora
+        self.llamadas = []
+        self.status = None
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                params = parse_qs(urlparse(self.path).query)
+                search = params['search'][0]
+                stub.llamadas.append(search)
+                # Sólo se pide el conteo de marcas, nunca las etiquetas completas
+                assert params['count'] == ['openfda.brand_name.exact']
+                time.sleep(stub.demora)
+                # 'openfda.brand_name:ibu*' -> 'ibu'
+                prefijo = search.split(':')[-1].rstrip('*').lower()
+                items = [{'term': m, 'count': 1} for m in stub.marcas if m.lower().startswith(prefijo)]
+                status = stub.status or (200 if items else 404)
+                cuerpo = json.dumps({'results': items} if status == 200 else {'error': {}}).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(cuerpo)))
+                self.end_headers()
+                self.wfile.write(cuerpo)
+
+            def log_message(self, *args):
+                pass
+
+        self.servidor = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.servidor.server_port}/drug/label.json'
+        self.hilo = threading.Thread(target=self.servidor.serve_forever, daemon=True)
+        self.hilo.start()
+
+    def cerrar(self):
+        self.servidor.shutdown()
+        self.servidor.server_close()
+
+
+class Reloj:
+    def __init__(self):
+        self.ahora = 1000.0
+
+    def __call__(self):
+        return self.ahora
+
+
+class CacheMedicamentosTests(SimpleTestCase):
+
+    def setUp(self):
+        self.stub = StubOpenFDA()
+        self.addCleanup(self.stub.cerrar)
+        self.reloj = Reloj()
+
+    def cache(self, **kwargs):
+        kwargs.setdefault('reloj', self.reloj)
+        return CacheMedicamentos(
+            fetch=lambda clave, limite: consultar_openfda(clave, limite, url=self.stub.url, timeout=2), **kwargs,
+        )
+
+    def test_hit_despues_de_miss(self):
+        cache = self.cache()
+        self.assertEqual(cache.buscar('ibu'), ['Ibuprofen', 'Ibuprofen PM', 'Ibuprofen and Famotidine', 'Ibutilide'])
+        self.assertEqual(cache.buscar('IBU '), cache.buscar('ibu'))
+        self.assertEqual(len(self.stub.llamadas), 1)
+        stats = cache.stats()
+        self.assertEqual((stats['misses'], stats['hits'], stats['llamadas']), (1, 2, 1))
+
+    def test_prefijo_mas_largo_se_filtra_del_corto(self):
+        cache = self.cache()
+        cache.buscar('ibu')
+        self.assertEqual(cache.buscar('ibup'), ['Ibuprofen', 'Ibuprofen PM', 'Ibuprofen and Famotidine'])
+        self.assertEqual(cache.buscar('ibuprofen pm'), ['Ibuprofen PM'])
+        self.assertEqual(len(self.stub.llamadas), 1)
+        self.assertEqual(cache.stats()['hits_prefijo'], 2)
+
+    def test_prefijo_incompleto_no_se_filtra(self):
+        # Con tantas filas como el límite la respuesta pudo venir cortada: hay que preguntar
+        cache = self.cache(limite_upstream=2)
+        cache.buscar('ibu')
+        cache.buscar('ibut')
+        self.assertEqual(len(self.stub.llamadas), 2)
+
+    def test_llamadas_simultaneas_comparten_una(self):
+        self.stub.demora = 0.3
+        cache = self.cache()
+        resultados = []
+        hilos = [threading.Thread(target=lambda: resultados.append(cache.buscar('para'))) for _ in range(5)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        self.assertEqual(resultados, [['Paracetamol', 'Paracetamol Forte']] * 5)
+        self.assertEqual(len(self.stub.llamadas), 1)
+        self.assertEqual(cache.stats()['compartidas'], 4)
+
+    def test_vencida_se_sirve_mientras_se_revalida(self):
+        cache = self.cache(ttl=60, stale=600)
+        cache.buscar('para')
+        self.reloj.ahora += 120
+        self.stub.demora = 0.5
+
+        inicio = time.monotonic()
+        primera = cache.buscar('para')
+        # Con la revalidación en curso, la vencida se sigue respondiendo sin esperar a OpenFDA
+        segunda = cache.buscar('para')
+        self.assertLess(time.monotonic() - inicio, 0.3)
+        self.assertEqual(primera, segunda)
+
+        stats = cache.stats()
+        self.assertEqual((stats['hits_vencidos'], stats['misses']), (2, 1))
+        for _ in range(50):
+            if cache.stats()['llamadas'] == 2:
+                break
+            time.sleep(0.05)
+        self.assertEqual(len(self.stub.llamadas), 2)
+
+    def test_ttl_y_lru(self):
+        cache = self.cache(ttl=60, stale=0, max_entradas=2)
+        cache.buscar('ibu')
+        cache.buscar('para')
+        cache.buscar('ibu')         # 'para' queda como la menos usada
+        cache.buscar('zzz')         # saca a 'para'
+        self.assertEqual(cache.stats()['entradas'], 2)
+        cache.buscar('para')
+        self.assertEqual(len(self.stub.llamadas), 4)
+
+        self.reloj.ahora += 61
+        cache.buscar('para')
+        self.assertEqual(len(self.stub.llamadas), 5)
+
+    def test_sin_coincidencias_y_errores(self):
+        cache = self.cache(ttl_error=30)
+        self.assertEqual(cache.buscar('zzz'), [])
+
+        self.stub.status = 500
+        with self.assertLogs('webEmergencia.openfda', 'WARNING'):
+            self.assertEqual(cache.buscar('ibu'), [])
+        # Caché negativo corto: no se vuelve a llamar a un upstream caído
+        self.assertEqual(cache.buscar('ibu'), [])
+        self.assertEqual(len(self.stub.llamadas), 2)
+        self.assertEqual(cache.stats()['errores'], 1)
+
+
+def hilos_bloqueados():
+    """Hilos detenidos en async_to_sync esperando una corrutina (p.ej. un middleware síncrono
+    que adapta la vista async y deja su hilo ocupado mientras ella espera)"""
+    codigo = AsyncToSync.__call__.__code__
+    return sum(
+        any(marco.f_code is codigo for marco, _ in traceback.walk_stack(pila))
+        for pila in sys._current_frames().values()
+    )
+
+
+async def vista_hilo(request):
+    await asyncio.sleep(0)
+    return JsonResponse({'hilo': threading.get_ident(), 'bloqueados': hilos_bloqueados()})
+
+
+urlpatterns = [path('hilo/', vista_hilo)]
+
+# MIDDLEWARE tal como queda bajo ASGI (settings.ASGI_ASYNC)
+MIDDLEWARE_ASGI = [m for m in settings.MIDDLEWARE if m != 'whitenoise.middleware.WhiteNoiseMiddleware']
+
+
+@override_settings(ROOT_URLCONF=__name__, MIDDLEWARE=MIDDLEWARE_ASGI)
+class AsgiTests(SimpleTestCase):
+
+    def pedir(self, app, ruta):
+        """(hilo del event loop, status, cuerpo) de un GET a la aplicación ASGI"""
+        async def pedir():
+            comunicador = ApplicationCommunicator(app, {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                'scheme': 'http', 'path': ruta, 'raw_path': ruta.encode(), 'query_string': b'',
+                'root_path': '', 'headers': [(b'host', b'testserver')], 'server': ('testserver', 80),
+                'client': ('127.0.0.1', 1234),
+            })
+            await comunicador.send_input({'type': 'http.request', 'body': b''})
+            inicio = await comunicador.receive_output(5)
+            cuerpo = b''
+            while True:
+                parte = await comunicador.receive_output(5)
+                cuerpo += parte.get('body', b'')
+                if not parte.get('more_body'):
+                    break
+            return threading.get_ident(), inicio['status'], cuerpo
+        return asyncio.run(pedir())
+
+    def test_vista_async_corre_en_el_event_loop(self):
+        # Un middleware sólo síncrono obligaría a correr la vista en otro hilo con su propio loop
+        hilo_loop, status, cuerpo = self.pedir(EstaticosASGI(ASGIHandler()), '/hilo/')
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(cuerpo), {'hilo': hilo_loop, 'bloqueados': 0})
+
+    def test_estaticos_con_whitenoise(self):
+        with tempfile.TemporaryDirectory() as raiz:
+            os.makedirs(os.path.join(raiz, 'css'))
+            with open(os.path.join(raiz, 'css', 'app.3f2a1b.css'), 'w') as archivo:
+                archivo.write('body{}')
+            with override_settings(STATIC_ROOT=raiz, DEBUG=False):
+                app = EstaticosASGI(ASGIHandler())
+                _, status, cuerpo = self.pedir(app, f'{app.whitenoise.static_prefix}css/app.3f2a1b.css')
+                self.assertEqual((status, cuerpo), (200, b'body{}'))
+                _, status, _ = self.pedir(app, f'{app.whitenoise.static_prefix}css/no-existe.css')
+                self.assertEqual(status, 404)
+
+
+def crear_datos(pacientes=6, consultas=4):
+    """Un médico y `pacientes` pacientes con `consultas` consultas cada uno; la mitad
+    con diagnóstico y dos recetas, para que un N+1 supere cualquier presupuesto"""
+    medico = Persona.objects.create(rut='11111111', nombre='Ana', apellido='Rojas', correo='ana@ejemplo.cl')
+    especialista = Especialista.objects.create(fk_rutp=medico, especialidad='Medicina General')
+    inicio = timezone.now() + timedelta(days=1)
+    for i in range(pacientes):
+        persona = Persona.objects.create(
+            rut=f'2000000{i}', nombre=f'Paciente{i}', apellido='Soto', correo=f'p{i}@ejemplo.cl',
+        )
+        paciente = Paciente.objects.create(fk_rut=persona, fecha_nacimiento=date(1990, 1, 1))
+        for j in range(consultas):
+            consulta = Consulta.objects.create(
+                fk_idpaciente=paciente, motivo=f'fiebre {j}', sintomas='tos', especialidad='Medicina General',
+                fecha_inicio=inicio + timedelta(hours=i * consultas + j),
+            )
+            if j % 2:
+                diagnostico = Diagnostico.objects.create(consulta=consulta, descripcion='gripe')
+                Receta.objects.bulk_create([
+                    Receta(diagnostico=diagnostico, medicamento=m, dosis='1', horario='8 h') for m in ('A', 'B')
+                ])
+    return especialista
+
+
+# Las plantillas usan {% static %}: sin collectstatic no hay manifiesto
+STORAGES_PRUEBAS = {**settings.STORAGES, 'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'}}
+
+
+def entrar(client, rut):
+    """Sesión como la deja login_view: usuario de Django (para DRF) y user_rut"""
+    usuario, _ = User.objects.get_or_create(username=rut)
+    client.force_login(usuario)
+    sesion = client.session
+    sesion['user_rut'] = rut
+    sesion.save()
+
+
+@override_settings(QUERY_BUDGET_MODE='raise', STORAGES=STORAGES_PRUEBAS)
+class PresupuestoConsultasTests(TestCase):
+    """Las vistas con @query_budget lanzan QueryBudgetExceeded si la cantidad de consultas crece con las filas"""
+
+    @classmethod
+    def setUpTestData(cls):
+        # El índice de búsqueda se llena en on_commit
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.especialista = crear_datos()
+        cls.paciente = Paciente.objects.select_related('fk_rut').first()
+
+    def test_consulta_list(self):
+        entrar(self.client, self.paciente.fk_rut.rut)
+        respuesta = self.client.get('/api/consultas/')
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(len(respuesta.json()['results']), 4)
+
+        entrar(self.client, '11111111')
+        respuesta = self.client.get('/api/consultas/?page_size=50')
+        self.assertEqual(len(respuesta.json()['results']), 24)
+        respuesta = self.client.get(f'/api/consultas/?rut_paciente={self.paciente.fk_rut.rut}')
+        self.assertEqual(len(respuesta.json()['results']), 4)
+
+    def test_consulta_detail(self):
+        consulta = Consulta.objects.filter(fk_idpaciente=self.paciente, diagnostico_data__isnull=False).first()
+        entrar(self.client, '11111111')
+        self.assertEqual(self.client.get(f'/api/consultas/{consulta.pk}/').status_code, 200)
+
+        # Mover una cita aceptada pasa por la agenda (bloqueo, choques) dentro del presupuesto
+        reservar(consulta, self.especialista)
+        entrar(self.client, self.paciente.fk_rut.rut)
+        nueva = consulta.fecha_inicio + timedelta(days=7)
+        respuesta = self.client.put(
+            f'/api/consultas/{consulta.pk}/', {'fecha_inicio': nueva.isoformat()}, content_type='application/json',
+        )
+        self.assertEqual(respuesta.status_code, 200)
+        consulta.refresh_from_db()
+        self.assertEqual(consulta.fecha_fin, nueva + timedelta(minutes=30))
+
+    def test_listas_de_pacientes(self):
+        entrar(self.client, '11111111')
+        respuesta = self.client.get('/listar-pacientes/')
+        self.assertEqual(len(respuesta.context['pacientes']), 6)
+        respuesta = self.client.get('/listar-consultas-medico/')
+        self.assertEqual(len(respuesta.context['consultas']), 24)
+        respuesta = self.client.get(f'/listar-consultas-medico/?rut={self.paciente.fk_rut.rut}&q=fiebre')
+        self.assertEqual(len(respuesta.context['consultas']), 4)
+        respuesta = self.client.get(f'/api/paciente/{self.paciente.fk_rut.rut}/perfil/')
+        self.assertEqual(len(respuesta.json()['citas']), 4)
+
+
+def linealizable(exitos, final):
+    """¿Hay un orden de las transiciones exitosas que lleve de 'pendiente' al estado final?
+
+    Si no lo hay, alguna transición se aplicó sobre un estado que ya no era el suyo (lost update).
+    """
+    @lru_cache(maxsize=None)
+    def buscar(estado, restantes):
+        if not any(n for _, n in restantes):
+            return estado == final
+        for i, (accion, n) in enumerate(restantes):
+            origen, destino = TRANSICIONES[accion]
+            if n and estado in origen:
+                if buscar(destino, restantes[:i] + ((accion, n - 1),) + restantes[i + 1:]):
+                    return True
+        return False
+
+    return buscar('pendiente', tuple(sorted(exitos.items())))
+
+
+def en_paralelo(cantidad, trabajo):
+    """Corre trabajo(n) en `cantidad` hilos que arrancan juntos, cada uno con su conexión; devuelve sus resultados"""
+    barrera = threading.Barrier(cantidad)
+    resultados = [None] * cantidad
+
+    def correr(n):
+        try:
+            barrera.wait()
+            resultados[n] = trabajo(n)
+        finally:
+            connection.close()
+
+    hilos = [threading.Thread(target=correr, args=(n,)) for n in range(cantidad)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    return resultados
+
+
+class TransicionesConcurrentesTests(TransactionTestCase):
+    """Varios hilos aplican transiciones sobre las mismas consultas a la vez"""
+
+    HILOS = 6
+    CONSULTAS = 10
+
+    def setUp(self):
+        persona = Persona.objects.create(rut='30000000', nombre='Paz', apellido='Mena', correo='paz@ejemplo.cl')
+        paciente = Paciente.objects.create(fk_rut=persona, fecha_nacimiento=date(1990, 1, 1))
+        self.ids = [
+            Consulta.objects.create(fk_idpaciente=paciente, motivo='concurrencia', estado='pendiente').pk
+            for _ in range(self.CONSULTAS)
+        ]
+
+    def test_un_ganador_por_transicion(self):
+        for accion in ('aceptar', 'aplazar', 'aceptar', 'finalizar'):
+            def trabajo(n):
+                # Cada hilo recorre las consultas en otro orden para cruzarse con los demás
+                ids = random.Random(n).sample(self.ids, len(self.ids))
+                return Counter(pk for pk in ids if aplicar(accion, Consulta.objects.filter(pk=pk)))
+
+            ganadores = sum(en_paralelo(self.HILOS, trabajo), Counter())
+            self.assertEqual(ganadores, Counter(self.ids), accion)
+        self.assertEqual(set(Consulta.objects.filter(pk__in=self.ids).values_list('estado', flat=True)), {'finalizada'})
+
+    def test_historias_linealizables(self):
+        acciones = ['aceptar', 'aplazar', 'cancelar', 'finalizar']
+
+        def trabajo(n):
+            azar = random.Random(n)
+            exitos = {pk: Counter() for pk in self.ids}
+            for _ in range(40):
+                pk, accion = azar.choice(self.ids), azar.choice(acciones)
+                if aplicar(accion, Consulta.objects.filter(pk=pk)):
+                    exitos[pk][accion] += 1
+            return exitos
+
+        exitos = {pk: Counter() for pk in self.ids}
+        for parcial in en_paralelo(self.HILOS, trabajo):
+            for pk, contador in parcial.items():
+                exitos[pk] += contador
+        finales = dict(Consulta.objects.filter(pk__in=self.ids).values_list('id', 'estado'))
+        self.assertEqual([pk for pk in self.ids if not linealizable(exitos[pk], finales[pk])], [])
+
+
+class PaginacionKeysetTests(TestCase):
+    """El cursor recorre todas las filas una sola vez, también al pasar a la cola de fecha_inicio NULL"""
+
+    @classmethod
+    def setUpTestData(cls):
+        persona = Persona.objects.create(rut='40000000', nombre='Luz', apellido='Vera', correo='luz@ejemplo.cl')
+        cls.paciente = Paciente.objects.create(fk_rut=persona, fecha_nacimiento=date(1990, 1, 1))
+        inicio = timezone.now()
+        # Fechas repetidas (desempate por id) y siete sin fecha, para que la cola cruce varias páginas
+        fechas = [inicio + timedelta(hours=h) for h in (3, 3, 2, 2, 2, 1)] + [None] * 7
+        for fecha in fechas:
+            Consulta.objects.create(fk_idpaciente=cls.paciente, motivo='keyset', fecha_inicio=fecha)
+
+    def recorrer(self, page_size, entre_paginas=None):
+        ids, url = [], f'/api/consultas/?page_size={page_size}'
+        while url:
+            # Un cursor que no avanza repetiría la misma página para siempre
+            self.assertLess(len(ids), 50)
+            datos = self.client.get(url).json()
+            ids += [consulta['id'] for consulta in datos['results']]
+            url = datos['next']
+            if entre_paginas:
+                entre_paginas()
+        return ids
+
+    def test_recorre_la_cola_de_nulos(self):
+        entrar(self.client, '40000000')
+        esperado = [
+            pk for pk, _ in sorted(
+                Consulta.objects.values_list('id', 'fecha_inicio'),
+                key=lambda fila: (fila[1] is None, -(fila[1].timestamp() if fila[1] else 0), -fila[0]),
+            )
+        ]
+        for page_size in (1, 2, 4, 5, 6, 7, 20):
+            self.assertEqual(self.recorrer(page_size), esperado, page_size)
+
+    def test_filas_nuevas_no_desplazan_el_cursor(self):
+        entrar(self.client, '40000000')
+        antes = set(Consulta.objects.values_list('id', flat=True))
+
+        def agregar():
+            # Una cita más reciente (ya quedó atrás del cursor) y otra sin fecha (encabeza la cola
+            # de NULLs: aparece sólo si el cursor todavía no llega a ella)
+            for fecha in (timezone.now() + timedelta(days=1), None):
+                Consulta.objects.create(fk_idpaciente=self.paciente, motivo='nueva', fecha_inicio=fecha)
+
+        ids = self.recorrer(3, agregar)
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertLessEqual(antes, set(ids))
+        self.assertFalse(Consulta.objects.filter(pk__in=ids, motivo='nueva', fecha_inicio__isnull=False).exists())
+
+
+class DespachoTests(TransactionTestCase):
+    """Tomar y repartir pendientes (despacho.py): SKIP LOCKED en PostgreSQL, UPDATE condicional en SQLite"""
+
+    def setUp(self):
+        persona = Persona.objects.create(rut='50000000', nombre='Eva', apellido='Lagos', correo='eva@ejemplo.cl')
+        self.paciente = Paciente.objects.create(fk_rut=persona, fecha_nacimiento=date(1990, 1, 1))
+        self.especialistas = []
+        for i in range(4):
+            persona = Persona.objects.create(
+                rut=f'5100000{i}', nombre=f'Medico{i}', apellido='Lagos', correo=f'm{i}@ejemplo.cl',
+            )
+            self.especialistas.append(Especialista.objects.create(fk_rutp=persona, especialidad='Cardiología'))
+        self.inicio = timezone.now() + timedelta(days=1)
+
+    def pendiente(self, fecha_inicio, especialidad='Cardiología'):
+        return Consulta.objects.create(
+            fk_idpaciente=self.paciente, motivo='despacho', especialidad=especialidad, fecha_inicio=fecha_inicio,
+        )
+
+    def test_tomar_en_paralelo_reparte_consultas_distintas(self):
+        ids = {self.pendiente(self.inicio + timedelta(hours=i)).pk for i in range(6)}
+
+        def trabajo(n):
+            # Dos pedidos por médico: el segundo no puede chocar con el primero (bloques de 1 h)
+            tomadas = [tomar_siguiente(self.especialistas[n]) for _ in range(2)]
+            return [consulta.pk for consulta in tomadas if consulta is not None]
+
+        tomadas = sum(en_paralelo(len(self.especialistas), trabajo), [])
+        self.assertEqual(len(tomadas), len(set(tomadas)))
+        self.assertEqual(set(tomadas), ids)
+        asignadas = Consulta.objects.filter(pk__in=ids).values_list('estado', 'especialista_asignado_id')
+        self.assertTrue(all(estado == 'aceptada' and especialista for estado, especialista in asignadas))
+
+    def test_tomar_salta_vencidas_otras_especialidades_y_choques(self):
+        especialista = self.especialistas[0]
+        self.pendiente(timezone.now() - timedelta(hours=1))
+        self.pendiente(self.inicio, especialidad='Dermatología')
+        ocupada = self.pendiente(self.inicio)
+        reservar(ocupada, especialista)
+        cruzada = self.pendiente(self.inicio + timedelta(minutes=10))
+        libre = self.pendiente(self.inicio + timedelta(hours=2))
+
+        self.assertEqual(tomar_siguiente(especialista).pk, libre.pk)
+        self.assertIsNone(tomar_siguiente(especialista))
+        # La que se cruza con su agenda queda para otro médico
+        self.assertEqual(tomar_siguiente(self.especialistas[1]).pk, cruzada.pk)
+
+    def test_repartir_al_menos_cargado(self):
+        reservar(self.pendiente(self.inicio - timedelta(hours=5)), self.especialistas[0])
+        vencida = self.pendiente(timezone.now() - timedelta(hours=1))
+        nuevas = [self.pendiente(self.inicio + timedelta(hours=i)) for i in range(6)]
+
+        asignadas = repartir_pendientes('Cardiología')
+        self.assertEqual({consulta.pk for consulta in asignadas}, {consulta.pk for consulta in nuevas})
+        carga = Counter(Consulta.objects.filter(estado='aceptada').values_list('especialista_asignado_id', flat=True))
+        # 7 citas entre 4 médicos: nadie queda con 3 mientras otro tiene 1
+        self.assertEqual(sorted(carga.values()), [1, 2, 2, 2])
+        vencida.refresh_from_db()
+        self.assertEqual(vencida.estado, 'pendiente')
+
+
+class ConsultaCondicionalTests(TestCase):
+    """ETag / Last-Modified de consulta_detail (condicional.py): 304 en GET, 412 en PUT y DELETE"""
+
+    @classmethod
+    def setUpTestData(cls):
+        persona = Persona.objects.create(rut='60000000', nombre='Sol', apellido='Ortiz', correo='sol@ejemplo.cl')
+        cls.paciente = Paciente.objects.create(fk_rut=persona, fecha_nacimiento=date(1990, 1, 1))
+        cls.consulta = Consulta.objects.create(
+            fk_idpaciente=cls.paciente, motivo='dolor', especialidad='Medicina General',
+            fecha_inicio=timezone.now() + timedelta(days=1),
+        )
+        cls.url = f'/api/consultas/{cls.consulta.pk}/'
+
+    def setUp(self):
+        entrar(self.client, '60000000')
+
+    def put(self, datos, **cabeceras):
+        return self.client.put(self.url, datos, content_type='application/json', headers=cabeceras)
+
+    def test_get_condicional(self):
+        respuesta = self.client.get(self.url)
+        etag, ultima = respuesta['ETag'], respuesta['Last-Modified']
+
+        respuesta = self.client.get(self.url, headers={'If-None-Match': etag})
+        self.assertEqual((respuesta.status_code, respuesta.content), (304, b''))
+        self.assertEqual(respuesta['ETag'], etag)
+        self.assertEqual(self.client.get(self.url, headers={'If-Modified-Since': ultima}).status_code, 304)
+
+        # Un cambio en la consulta o en sus recetas cambia el ETag
+        self.assertEqual(self.put({'motivo': 'dolor fuerte'}).status_code, 200)
+        respuesta = self.client.get(self.url, headers={'If-None-Match': etag})
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.json()['motivo'], 'dolor fuerte')
+        etag = respuesta['ETag']
+        diagnostico = Diagnostico.objects.create(consulta=self.consulta, descripcion='migraña')
+        Receta.objects.create(diagnostico=diagnostico, medicamento='Paracetamol', dosis='1', horario='8 h')
+        self.assertEqual(self.client.get(self.url, headers={'If-None-Match': etag}).status_code, 200)
+
+    def test_if_match(self):
+        etag = self.client.get(self.url)['ETag']
+        respuesta = self.put({'motivo': 'primero'}, **{'If-Match': etag})
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertNotEqual(respuesta['ETag'], etag)
+
+        # Otro cliente con la versión anterior no pisa el cambio
+        self.assertEqual(self.put({'motivo': 'segundo'}, **{'If-Match': etag}).status_code, 412)
+        self.assertEqual(self.client.delete(self.url, headers={'If-Match': etag}).status_code, 412)
+        self.consulta.refresh_from_db()
+        self.assertEqual(self.consulta.motivo, 'primero')
+
+        self.assertEqual(self.put({'motivo': 'segundo'}, **{'If-Match': respuesta['ETag']}).status_code, 200)
+
+    def test_lista_condicional(self):
+        etag = self.client.get('/api/consultas/')['ETag']
+        self.assertEqual(self.client.get('/api/consultas/', headers={'If-None-Match': etag}).status_code, 304)
+        Consulta.objects.create(fk_idpaciente=self.paciente, motivo='otra', fecha_inicio=timezone.now())
+        self.assertEqual(self.client.get('/api/consultas/', headers={'If-None-Match': etag}).status_code, 200)
+
+
+@override_settings(SYNC_SOLAPE_SEGUNDOS=60, SYNC_RETENCION_DIAS=30)
+class SincronizacionTests(TestCase):
+    """?since= de /api/consultas/sync/: relee el solape, informa lápidas y no deja vencer la marca"""
+
+    url = '/api/consultas/sync/'
+
+    @classmethod
+    def setUpTestData(cls):
+        persona = Persona.objects.create(rut='70000000', nombre='Iris', apellido='Paz', correo='iris@ejemplo.cl')
+        cls.paciente = Paciente.objects.create(fk_rut=persona, fecha_nacimiento=date(1990, 1, 1))
+        otra = Persona.objects.create(rut='70000001', nombre='Otro', apellido='Paz', correo='otro@ejemplo.cl')
+        cls.otro = Paciente.objects.create(fk_rut=otra, fecha_nacimiento=date(1990, 1, 1))
+        hace_una_hora = timezone.now() - timedelta(hours=1)
+        for paciente in (cls.paciente, cls.paciente, cls.paciente, cls.otro):
+            Consulta.objects.create(fk_idpaciente=paciente, motivo='sync', fecha_inicio=timezone.now())
+        Consulta.objects.update(actualizado=hace_una_hora)
+
+    def setUp(self):
+        entrar(self.client, '70000000')
+
+    def sincronizar(self, **parametros):
+        respuesta = self.client.get(self.url, parametros)
+        self.assertEqual(respuesta.status_code, 200)
+        return respuesta.json()
+
+    def marca(self, momento):
+        return KeysetPagination().encode_cursor(momento, 0)
+
+    def test_solape_y_lapidas(self):
+        datos = self.sincronizar()
+        propias = list(Consulta.objects.filter(fk_idpaciente=self.paciente).order_by('id').values_list('id', flat=True))
+        self.assertEqual([consulta['id'] for consulta in datos['cambios']], propias)
+        since = KeysetPagination().decode_cursor(datos['cursor'])[0]
+
+        modificada, borrada, vieja = propias
+        # Escrita 30 s antes de la marca pero confirmada después: el solape la relee
+        Consulta.objects.filter(pk=modificada).update(actualizado=since - timedelta(seconds=30))
+        Consulta.objects.filter(pk=vieja).update(actualizado=since - timedelta(minutes=5))
+        Consulta.objects.filter(pk=borrada).delete()
+        Consulta.objects.filter(fk_idpaciente=self.otro).delete()
+
+        datos = self.sincronizar(since=datos['cursor'])
+        self.assertEqual([consulta['id'] for consulta in datos['cambios']], [modificada])
+        # Sólo las lápidas del propio paciente
+        self.assertEqual(datos['eliminadas'], [borrada])
+
+    def test_paginas_mezclan_cambios_y_lapidas(self):
+        since = self.marca(timezone.now() - timedelta(minutes=30))
+        ids = list(Consulta.objects.filter(fk_idpaciente=self.paciente).order_by('id').values_list('id', flat=True))
+        Consulta.objects.filter(pk=ids[0]).delete()
+        # update() no mueve `actualizado`: sólo save() cuenta como cambio
+        Consulta.objects.filter(pk=ids[2]).update(motivo='sin marca')
+        Consulta.objects.get(pk=ids[1]).save()
+
+        cambiadas, eliminadas, parametros = [], [], {'since': since, 'limite': 1}
+        while True:
+            datos = self.sincronizar(**parametros)
+            cambiadas += [consulta['id'] for consulta in datos['cambios']]
+            eliminadas += datos['eliminadas']
+            if not datos['hay_mas']:
+                break
+            parametros = {'cursor': datos['cursor'], 'limite': 1}
+        self.assertEqual((cambiadas, eliminadas), ([ids[1]], [ids[0]]))
+
+    def test_sin_cambios_la_marca_avanza(self):
+        # La última sincronización fue hace 50 minutos y desde entonces no cambió nada
+        since = self.marca(timezone.now() - timedelta(minutes=50))
+        datos = self.sincronizar(since=since)
+        self.assertEqual((datos['cambios'], datos['eliminadas']), ([], []))
+        # La respuesta trae una marca reciente: la del cliente nunca llega a vencer
+        marca = KeysetPagination().decode_cursor(datos['cursor'])[0]
+        self.assertAlmostEqual(marca, timezone.now() - timedelta(seconds=60), delta=timedelta(seconds=5))
+
+        # Una marca dentro del solape no retrocede
+        reciente = self.marca(timezone.now())
+        self.assertEqual(self.sincronizar(since=reciente)['cursor'], reciente)
+
+    def test_marca_vencida(self):
+        since = self.marca(timezone.now() - timedelta(days=31))
+        self.assertEqual(self.client.get(self.url, {'since': since}).status_code, 410)
+
+
+class ReconciliarEstadisticasTests(TestCase):
+    """estadisticas.reconciliar es idempotente: avisar de más nunca cuenta dos veces"""
+
+    @classmethod
+    def setUpTestData(cls):
+        persona = Persona.objects.create(rut='80000000', nombre='Ada', apellido='Ruiz', correo='ada@ejemplo.cl')
+        cls.paciente = Paciente.objects.create(fk_rut=persona, fecha_nacimiento=date(1990, 1, 1))
+        medico = Persona.objects.create(rut='80000001', nombre='Leo', apellido='Ruiz', correo='leo@ejemplo.cl')
+        cls.especialista = Especialista.objects.create(fk_rutp=medico, especialidad='Pediatría')
+
+    def crear(self, cantidad):
+        inicio = timezone.now() + timedelta(days=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            return [
+                Consulta.objects.create(
+                    fk_idpaciente=self.paciente, motivo='stats', especialidad='Pediatría',
+                    fecha_inicio=inicio + timedelta(hours=i),
+                ).pk
+                for i in range(cantidad)
+            ]
+
+    def contadas(self):
+        return sorted(
+            (tuple(fila[:-1]), fila[-1])
+            for fila in EstadisticaDiaria.objects.filter(cantidad__gt=0).values_list(*estadisticas.DIMENSIONES, 'cantidad')
+        )
+
+    def esperadas(self):
+        zona = timezone.get_default_timezone()
+        return sorted(Counter(
+            estadisticas.clave(fila, zona) for fila in Consulta.objects.values_list(*estadisticas.CAMPOS_CONSULTA)
+        ).items())
+
+    def test_repetir_no_cambia_nada(self):
+        ids = self.crear(4)
+        self.assertEqual(self.contadas(), self.esperadas())
+
+        # Cambios sin avisar (on_commit no corre en TestCase): un UPDATE de estado y un borrado
+        aplicar('aceptar', Consulta.objects.filter(pk=ids[0]), especialista_asignado=self.especialista)
+        transicionar(ids[1], 'cancelar', razon_cancelacion='  No  PUEDE asistir ')
+        momento = Consulta.objects.get(pk=ids[1]).actualizado
+        Consulta.objects.filter(pk=ids[2]).delete()
+        for _ in range(3):
+            estadisticas.reconciliar(ids, momento=momento)
+            self.assertEqual(self.contadas(), self.esperadas())
+        # La razón se agrupa normalizada
+        self.assertIn('no puede asistir', {k[4] for k, _ in self.contadas()})
+
+    def test_consultas_sin_contar(self):
+        self.crear(2)
+        # bulk_create no avisa; reconciliar las cuenta una sola vez
+        nuevas = Consulta.objects.bulk_create([
+            Consulta(fk_idpaciente=self.paciente, motivo='bulk', especialidad='Pediatría') for _ in range(3)
+        ])
+        ids = list(Consulta.objects.filter(motivo='bulk').values_list('id', flat=True))
+        self.assertEqual(len(ids), len(nuevas))
+        self.assertTrue(estadisticas.faltan())
+        estadisticas.reconciliar(ids)
+        estadisticas.reconciliar(ids)
+        self.assertFalse(estadisticas.faltan())
+        self.assertEqual(self.contadas(), self.esperadas())
+
+        # reconstruir parte de cero y deja lo mismo
+        estadisticas.reconstruir()
+        estadisticas.reconciliar(ids)
+        self.assertEqual(self.contadas(), self.esperadas())
+
+
+class BackendMemoria:
+    """Backend de recordatorios que guarda los mensajes; falla una vez los de `fallar` (ids de consulta)"""
+
+    def __init__(self, fallar=()):
+        self.enviados = []
+        self.fallar = set(fallar)
+
+    def enviar(self, mensajes):
+        errores = {}
+        for m in mensajes:
+            if m['consulta_id'] in self.fallar:
+                self.fallar.discard(m['consulta_id'])
+                errores[m['recordatorio_id']] = 'SMTPServerDisconnected: caído'
+            else:
+                self.enviados.append((m['consulta_id'], m['nivel']))
+        return errores
+
+
+@override_settings(RECORDATORIOS_NIVELES={'24h': 24 * 3600, '1h': 3600})
+class RecordatoriosTests(TestCase):
+    """Cada cita recibe un solo aviso por nivel aunque las pasadas se repitan o el backend falle"""
+
+    @classmethod
+    def setUpTestData(cls):
+        persona = Persona.objects.create(rut='90000000', nombre='Noa', apellido='Gil', correo='noa@ejemplo.cl')
+        cls.paciente = Paciente.objects.create(fk_rut=persona, fecha_nacimiento=date(1990, 1, 1))
+
+    def cita(self, en):
+        return Consulta.objects.create(
+            fk_idpaciente=self.paciente, motivo='control', especialidad='Medicina General',
+            estado='aceptada', fecha_inicio=timezone.now() + en,
+        ).pk
+
+    def test_un_aviso_por_nivel(self):
+        ahora = timezone.now()
+        lejana, cercana = self.cita(timedelta(hours=30)), self.cita(timedelta(hours=5))
+        backend = BackendMemoria(fallar=[cercana])
+
+        # Pasadas repetidas (dos demonios, reinicios) a lo largo de siete horas
+        for horas in (0, 0, 4.5, 4.5, 6.5, 6.5):
+            recordatorios.escanear(ahora + timedelta(hours=horas))
+            recordatorios.entregar(backend)
+            recordatorios.entregar(backend)
+
+        self.assertEqual(Counter(backend.enviados), Counter({(cercana, '24h'): 1, (cercana, '1h'): 1, (lejana, '24h'): 1}))
+        fallido = Recordatorio.objects.get(consulta_id=cercana, nivel='24h')
+        self.assertEqual((fallido.estado, fallido.intentos), ('enviado', 2))
+
+    def test_cita_reagendada_o_cancelada(self):
+        ahora = timezone.now()
+        movida, cancelada = self.cita(timedelta(hours=5)), self.cita(timedelta(hours=6))
+        recordatorios.escanear(ahora)
+        # Antes de la entrega: una cambia de hora y la otra se cancela
+        Consulta.objects.filter(pk=movida).update(fecha_inicio=ahora + timedelta(hours=7), actualizado=timezone.now())
+        transicionar(cancelada, 'cancelar', razon_cancelacion='viaje')
+
+        backend = BackendMemoria()
+        recordatorios.entregar(backend)
+        self.assertEqual(backend.enviados, [])
+        # La hora nueva recibe su propio aviso, una sola vez
+        for _ in range(2):
+            recordatorios.escanear(ahora + timedelta(minutes=1))
+            recordatorios.entregar(backend)
+        self.assertEqual(backend.enviados, [(movida, '24h')])
+
+
+class BusquedaPorPacienteTests(TestCase):
+    """Con paciente_id la búsqueda filtra dentro de la consulta de texto, no después del límite"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.pacientes = []
+        for i in range(2):
+            persona = Persona.objects.create(
+                rut=f'9100000{i}', nombre=f'Busca{i}', apellido='Rey', correo=f'b{i}@ejemplo.cl',
+            )
+            cls.pacientes.append(Paciente.objects.create(fk_rut=persona, fecha_nacimiento=date(1990, 1, 1)))
+        uno, otro = cls.pacientes
+        with cls.captureOnCommitCallbacks(execute=True):
+            # El otro paciente tiene muchas más coincidencias, y más relevantes
+            cls.propias = [
+                Consulta.objects.create(fk_idpaciente=uno, motivo='control', sintomas='fiebre leve').pk
+                for _ in range(3)
+            ]
+            for _ in range(12):
+                Consulta.objects.create(fk_idpaciente=otro, motivo='fiebre alta', sintomas='fiebre y tos fiebre')
+            Consulta.objects.create(fk_idpaciente=uno, motivo='control', sintomas='dolor')
+
+    def recorrer(self, buscar, limite):
+        ids, despues_de = [], None
+        while True:
+            encontradas = buscar('fieb', limite, despues_de, paciente_id=self.pacientes[0].id)
+            ids += [pk for pk, _ in encontradas]
+            if len(encontradas) < limite:
+                return ids
+            pk, rango = encontradas[-1]
+            despues_de = (rango, pk)
+
+    def test_solo_las_del_paciente(self):
+        for buscar in (busqueda.buscar, busqueda._buscar_like):
+            self.assertEqual(sorted(self.recorrer(buscar, 2)), self.propias, buscar.__name__)
+
+    def test_lista_del_medico(self):
+        medico = Persona.objects.create(rut='91000009', nombre='Dra', apellido='Rey', correo='dra@ejemplo.cl')
+        Especialista.objects.create(fk_rutp=medico, especialidad='Medicina General')
+        entrar(self.client, '91000009')
+        with override_settings(STORAGES=STORAGES_PRUEBAS), patch('webEmergencia.views.RESULTADOS_BUSQUEDA', 2):
+            respuesta = self.client.get(f'/listar-consultas-medico/?rut={self.pacientes[0].fk_rut.rut}&q=fiebre')
+        # Las 2 más relevantes del paciente, aunque el otro tenga más coincidencias
+        ids = [consulta['id'] for consulta in respuesta.context['consultas']]
+        self.assertEqual(len(ids), 2)
+        self.assertLess(set(ids), set(self.propias))
+
+
+class BuscarPersonasTests(TestCase):
+    """personas.py: RUT con o sin formato y nombres por trigramas (FTS5 en SQLite, pg_trgm en PostgreSQL)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        filas = [
+            ('12345678-5', 'María José', 'González'),
+            ('1234567-4', 'Omar', 'Soto'),
+            ('10000013-K', 'Marta', 'Soto'),
+            ('7654321-6', 'Pedro', 'Núñez'),
+        ]
+        for rut, nombre, apellido in filas:
+            persona = Persona.objects.create(rut=rut, nombre=nombre, apellido=apellido, correo=f'{rut}@ejemplo.cl')
+            Paciente.objects.create(fk_rut=persona, fecha_nacimiento=date(1990, 1, 1))
+
+    def ruts(self, texto, limite=10):
+        return [fila['rut'] for fila in personas.buscar(texto, limite)]
+
+    def test_digito_verificador(self):
+        self.assertEqual(
+            [personas.digito_verificador(cuerpo) for cuerpo in ('12345678', '7654321', '10000013')], ['5', '6', 'K'],
+        )
+
+    def test_rut_en_cualquier_formato(self):
+        for texto in ('12.345.678-5', '12345678-5', '123456785', '12345678', ' 12.345.678 '):
+            self.assertEqual(self.ruts(texto)[0], '12345678-5', texto)
+            self.assertEqual(personas.pacientes_por_rut(texto).first().fk_rut_id, '12345678-5', texto)
+        self.assertEqual(self.ruts('10000013-k'), ['10000013-K'])
+        # Prefijo mientras se escribe: la coincidencia exacta primero, después las más cortas
+        self.assertEqual(self.ruts('1234567'), ['1234567-4', '12345678-5'])
+        self.assertIsNone(personas.pacientes_por_rut('99999999').first())
+
+    def test_nombre_sin_tildes_ni_mayusculas(self):
+        self.assertEqual(self.ruts('gonzalez mar'), ['12345678-5'])
+        self.assertEqual(self.ruts('NUÑEZ'), ['7654321-6'])
+        # Quien tiene una palabra que empieza con lo escrito va primero
+        self.assertEqual(self.ruts('mar')[:2], ['10000013-K', '12345678-5'])
+        self.assertIn('1234567-4', self.ruts('mar'))
+        self.assertEqual(self.ruts('ma'), [])
+
+    @skipUnless(connection.vendor == 'postgresql', 'la tolerancia a errores de tipeo es de pg_trgm')
+    def test_errores_de_tipeo(self):
+        self.assertEqual(self.ruts('gonsalez maria'), ['12345678-5'])
+
+    def test_cambio_de_nombre(self):
+        persona = Persona.objects.get(rut='7654321-6')
+        persona.apellido = 'Ibáñez'
+        persona.save()
+        self.assertEqual(self.ruts('ibanez'), ['7654321-6'])
+        self.assertEqual(self.ruts('nunez'), [])
+
+    def test_api(self):
+        medico = Persona.objects.create(rut='5555555-5', nombre='Dr', apellido='Vidal', correo='dr@ejemplo.cl')
+        Especialista.objects.create(fk_rutp=medico, especialidad='Medicina General')
+        entrar(self.client, '5555555-5')
+        respuesta = self.client.get('/api/personas/buscar/', {'q': '12.345.678-5'})
+        self.assertEqual(respuesta.status_code, 200)
+        (fila,) = respuesta.json()['resultados']
+        self.assertEqual((fila['rut'], fila['apellido']), ('12345678-5', 'González'))
+        self.assertIsNotNone(fila['paciente_id'])
+        entrar(self.client, '12345678-5')
+        self.assertEqual(self.client.get('/api/personas/buscar/', {'q': 'soto'}).status_code, 403)
+
+
+class TareasEnLineaTests(TestCase):
+    """Sin trabajador (TAREAS_EN_LINEA) los controles crónicos se crean al confirmar la finalización"""
+
+    @classmethod
+    def setUpTestData(cls):
+        persona = Persona.objects.create(rut='92000000', nombre='Ema', apellido='Toro', correo='ema@ejemplo.cl')
+        cls.paciente = Paciente.objects.create(fk_rut=persona, fecha_nacimiento=date(1960, 1, 1))
+        medico = Persona.objects.create(rut='92000001', nombre='Gil', apellido='Toro', correo='gil@ejemplo.cl')
+        cls.especialista = Especialista.objects.create(fk_rutp=medico, especialidad='Medicina General')
+
+    def finalizar(self):
+        consulta = Consulta.objects.create(
+            fk_idpaciente=self.paciente, motivo='control', especialidad='Medicina General',
+            fecha_inicio=timezone.now() - timedelta(hours=1),
+        )
+        reservar(consulta, self.especialista)
+        datos = {'descripcion': 'Hipertensión', 'es_cronico': True, 'nombre_enfermedad': 'Hipertensión'}
+        with self.captureOnCommitCallbacks(execute=True):
+            [(consulta, _)] = finalizar_consultas(self.especialista, [(consulta.pk, datos)])
+        return Tarea.objects.get(tipo='crear_controles_cronicos', datos__consultas=[consulta.pk])
+
+    def controles(self):
+        return Consulta.objects.filter(motivo=motivo_control('Hipertensión'))
+
+    @override_settings(TAREAS_EN_LINEA=True)
+    def test_en_linea(self):
+        tarea = self.finalizar()
+        self.assertEqual((tarea.estado, tarea.intentos), ('hecha', 1))
+        self.assertEqual(self.controles().count(), 1)
+
+    @override_settings(TAREAS_EN_LINEA=False)
+    def test_con_trabajador(self):
+        tarea = self.finalizar()
+        self.assertEqual(tarea.estado, 'pendiente')
+        self.assertFalse(self.controles().exists())
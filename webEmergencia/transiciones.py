@@ -0,0 +1,70 @@
+"""Máquina de estados de Consulta.estado.
+
+Cada transición es un único UPDATE ... WHERE id = ? AND estado IN (<origen>) que
+escribe sólo el estado y los campos que la acompañan. Si otra petición cambió
+el estado entre medio, el UPDATE no afecta filas y la transición se rechaza: no
+hay lectura previa que pueda quedar vieja ni save() que pise otras columnas.
+"""
+from django.db.models import F
+from django.utils import timezone
+from rest_framework import status
+
+from .estadisticas import programar
+from .models import Consulta
+
+
+# accion: (estados de origen, estado de destino)
+TRANSICIONES = {
+    'aceptar': (('pendiente', 'aplazada'), 'aceptada'),
+    # Cola de pendientes (despacho.py): sólo las que nadie ha tocado
+    'tomar': (('pendiente',), 'aceptada'),
+    'aplazar': (('pendiente', 'aceptada'), 'aplazada'),
+    'cancelar': (('pendiente', 'aceptada', 'aplazada'), 'cancelada'),
+    'finalizar': (('aceptada',), 'finalizada'),
+}
+
+
+class TransicionRechazada(Exception):
+    """La consulta no existe o su estado actual no admite la acción"""
+
+    def __init__(self, accion, pk, estado_actual):
+        self.accion = accion
+        self.pk = pk
+        self.estado_actual = estado_actual
+        if estado_actual is None:
+            self.mensaje = 'Consulta no encontrada'
+            self.status_code = status.HTTP_404_NOT_FOUND
+        else:
+            self.mensaje = f'No se puede {accion} una consulta en estado "{estado_actual}"'
+            self.status_code = status.HTTP_409_CONFLICT
+        super().__init__(self.mensaje)
+
+
+def actualizar(consultas, **campos):
+    """queryset.update() que además mueve actualizado y version (los validadores de ETag de la API)
+
+    Las filas escritas quedan con actualizado = ahora: así las encuentra estadisticas.py al confirmar.
+    """
+    ahora = timezone.now()
+    filas = consultas.update(actualizado=ahora, version=F('version') + 1, **campos)
+    if filas:
+        programar(momento=ahora)
+    return filas
+
+
+def aplicar(accion, consultas, **campos):
+    """UPDATE condicional sobre el queryset `consultas`; devuelve cuántas filas cambiaron"""
+    origen, destino = TRANSICIONES[accion]
+    return actualizar(consultas.filter(estado__in=origen), estado=destino, **campos)
+
+
+def transicionar(pk, accion, condiciones=None, **campos):
+    """Aplica la acción a una consulta o lanza TransicionRechazada.
+
+    `condiciones` agrega filtros al WHERE (por ejemplo, el especialista asignado).
+    Sólo si se rechaza se lee el estado actual, para el mensaje de error.
+    """
+    if aplicar(accion, Consulta.objects.filter(pk=pk, **(condiciones or {})), **campos):
+        return TRANSICIONES[accion][1]
+    estado = Consulta.objects.filter(pk=pk).values_list('estado', flat=True).first()
+    raise TransicionRechazada(accion, pk, estado)
@@ -1,6 +1,8 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 from . import auth_views
+from . import async_views
 
 urlpatterns = [
     path('', views.index, name='index'),
@@ -17,10 +19,28 @@ urlpatterns = [
     # API URLs
     path('api/consultas/', views.consulta_list, name='consulta_list'),
     path('api/consultas/<int:pk>/', views.consulta_detail, name='consulta_detail'),
+    path('api/consultas/finalizar/', views.finalizar_consultas_lote, name='finalizar_consultas_lote'),
+    path('api/consultas/exportar/', views.exportar_consultas, name='exportar_consultas'),
+    path('api/consultas/sync/', views.sincronizar_consultas, name='sincronizar_consultas'),
+    path('api/consultas/buscar/', views.buscar_consultas, name='buscar_consultas'),
+    path('api/personas/buscar/', views.buscar_personas, name='buscar_personas'),
     path('api/consultas/<int:pk>/finalizar/', views.finalizar_consulta_view, name='finalizar_consulta'),
     path('api/citas-medico/<int:pk>/gestionar/', views.gestionar_cita_medico, name='gestionar_cita_medico'),
+    path('api/citas-medico/siguiente/', views.siguiente_paciente, name='siguiente_paciente'),
     path('api/paciente/<str:rut_paciente>/perfil/', views.ver_perfil_paciente, name='ver_perfil_paciente'),
-    path('api/buscar-medicamentos/', views.buscar_medicamentos_api, name='buscar_medicamentos'),
+    path('api/agenda/cupos/', views.cupos_disponibles, name='cupos_disponibles'),
+    path('api/estadisticas/', views.estadisticas_consultas, name='estadisticas_consultas'),
+    path('api/seguimiento/', views.seguimiento_lecturas, name='seguimiento_lecturas'),
+    path(
+        'api/buscar-medicamentos/',
+        async_views.buscar_medicamentos_api if settings.ASGI_ASYNC else views.buscar_medicamentos_api,
+        name='buscar_medicamentos',
+    ),
+    path(
+        'api/eventos/consultas/',
+        async_views.eventos_consultas if settings.ASGI_ASYNC else views.eventos_consultas,
+        name='eventos_consultas',
+    ),
     
     # Auth API URLs
     path('api/auth/login/', auth_views.login_view, name='api_login'),
@@ -1,60 +1,60 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.utils.crypto import get_random_string
-from django.http import JsonResponse
-from .models import Persona, Paciente, Consulta, Especialista, Diagnostico, Receta
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.core.paginator import Paginator
+from django.db import transaction
+from .models import Persona, Paciente, Consulta
 from .forms import VerificarRutForm, RegistroCompletoForm, CitaForm
 from rest_framework.response import Response
 from rest_framework.decorators import api_view
 from rest_framework import status
 from .serializers import ConsultaSerializer, DiagnosticoSerializer
-import bcrypt
-import requests
-from django.db import transaction
+from .pagination import KeysetPagination
+from .filters import filtrar_consultas, parse_fecha
+from .queries import consultas_para_serializar, pacientes_con_resumen
+from .query_budget import query_budget
+from .catalogo import catalogo
+from .openfda import get_cache_medicamentos
+from .agenda import ConflictoAgenda, cupos_libres, reprogramar, reservar
+from .despacho import tomar_siguiente
+from .transiciones import TransicionRechazada, transicionar
+from .finalizacion import ErrorFinalizacion, MAX_LOTE, finalizar_consultas
+from .exportacion import FORMATOS, exportar
+from .documentos import documentos_de
+from .condicional import CAMPOS_VALIDADOR, marcar, no_modificada, validadores
+from .sincronizacion import LIMITE, LIMITE_MAXIMO, MarcaVencida, cambios
+from .estadisticas import AGRUPACIONES, resumen
+from . import busqueda, personas, seguimiento
+from .eventos import (
+    publicar_cambio, ultimo_evento_id, eventos_despues_de, desde_request, formatear, formatear_cursor,
+)
 from datetime import timedelta
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX
+from django.conf import settings
+from django.utils import timezone
 from deep_translator import GoogleTranslator
 
+PACIENTES_POR_PAGINA = 50
+RESULTADOS_BUSQUEDA = 200
+
 def get_user_role(request):
-    rut = request.session.get('user_rut')
-    if not rut:
-        return None, None, None
-    
-    try:
-        persona = Persona.objects.get(rut=rut)
-    except Persona.DoesNotExist:
+    # El principal ya viene resuelto (y cacheado en sesión) por PrincipalMiddleware
+    principal = request.principal
+    if not principal.is_authenticated or principal.rol_api is None:
         return None, None, None
-    
-    # Verificar si es especialista
-    try:
-        especialista = Especialista.objects.get(fk_rutp=persona)
-        return persona, especialista, 'medico'
-    except Especialista.DoesNotExist:
-        pass
-    
-    # Verificar si es paciente
-    try:
-        paciente = Paciente.objects.get(fk_rut=persona)
-        return persona, paciente, 'paciente'
-    except Paciente.DoesNotExist:
-        pass
-    
-    return None, None, None
+    return principal.persona, principal.rol_obj, principal.rol_api
 
 def index(request):
     context = {}
     
     # Verificar si el usuario está logueado
     if 'user_rut' in request.session:
-        rut = request.session.get('user_rut')
-        try:
-            # Obtener el objeto Persona
-            persona = Persona.objects.get(rut=rut)
-            context['persona'] = persona
-            
-            # Verificar si es Especialista
-            es_especialista = Especialista.objects.filter(fk_rutp=persona).exists()
-            context['es_especialista'] = es_especialista
-        except Persona.DoesNotExist:
+        principal = request.principal
+        if principal.is_authenticated:
+            context['persona'] = principal.persona
+            context['es_especialista'] = principal.es_especialista
+        else:
             # Si la persona no existe, limpiar sesión
             request.session.flush()
     
@@ -86,9 +86,9 @@ def registrar_y_agendar(request):
         if form.is_valid():
             # Crear persona
             persona = form.save(commit=False)
-            raw_password = get_random_string(12)
-            hashed_password = bcrypt.hashpw(raw_password.encode('utf-8'), bcrypt.gensalt())
-            persona.contrasena = hashed_password.decode('utf-8')
+            # La contraseña aleatoria nunca se le entregaba a nadie: en vez de hashearla con bcrypt
+            # en la petición (~0,25 s) se marca inutilizable, igual que en importar_pacientes
+            persona.contrasena = UNUSABLE_PASSWORD_PREFIX + get_random_string(40)
             persona.save()
 
             # Crear paciente
@@ -121,10 +121,9 @@ def agendar_nueva_cita(request):
         messages.error(request, 'Debe iniciar sesión para agendar una cita.')
         return redirect('index')
     
-    try:
-        persona = Persona.objects.get(rut=rut)
-        paciente = Paciente.objects.get(fk_rut=persona)
-    except (Persona.DoesNotExist, Paciente.DoesNotExist):
+    principal = request.principal
+    persona, paciente = principal.persona, principal.paciente
+    if persona is None or paciente is None:
         messages.error(request, 'Error al obtener los datos del paciente.')
         return redirect('index')
 
@@ -153,20 +152,20 @@ def consultar_citas(request):
         messages.error(request, 'Debe iniciar sesión para consultar sus citas.')
         return redirect('index')
     
-    try:
-        from django.utils import timezone
-        persona = Persona.objects.get(rut=rut)
-        paciente = Paciente.objects.get(fk_rut=persona)
-        citas = Consulta.objects.filter(fk_idpaciente=paciente).order_by('-fecha_inicio')
-        return render(request, 'webEmergencia/listar_citas.html', {
-            'citas': citas,
-            'persona': persona,
-            'now': timezone.now()
-        })
-    except (Persona.DoesNotExist, Paciente.DoesNotExist):
+    from django.utils import timezone
+    principal = request.principal
+    persona, paciente = principal.persona, principal.paciente
+    if persona is None or paciente is None:
         messages.error(request, 'Error al obtener los datos del paciente.')
         return redirect('index')
 
+    citas = Consulta.objects.filter(fk_idpaciente=paciente).order_by('-fecha_inicio')
+    return render(request, 'webEmergencia/listar_citas.html', {
+        'citas': citas,
+        'persona': persona,
+        'now': timezone.now()
+    })
+
 def modificar_cita(request, cita_id):
     cita = get_object_or_404(Consulta, id=cita_id)
     if request.method == 'POST':
@@ -174,10 +173,17 @@ def modificar_cita(request, cita_id):
         if form.is_valid():
             consulta = form.save(commit=False)
             consulta.especialidad = form.cleaned_data['especialidad']
-            consulta.save()
-            
-            messages.success(request, 'Cita modificada exitosamente.')
-            return redirect('consultar_citas')
+            try:
+                with transaction.atomic():
+                    # Una cita aceptada mueve su bloque en la agenda del especialista
+                    if 'fecha_inicio' in form.changed_data:
+                        consulta.fecha_fin = reprogramar(consulta, consulta.fecha_inicio)
+                    consulta.save()
+            except ConflictoAgenda as e:
+                messages.error(request, e.mensaje)
+            else:
+                messages.success(request, 'Cita modificada exitosamente.')
+                return redirect('consultar_citas')
     else:
         form = CitaForm(instance=cita)
     
@@ -193,6 +199,7 @@ def eliminar_cita(request, cita_id):
     return render(request, 'webEmergencia/eliminar_cita.html', {'cita': cita})
 
 @api_view(['GET', 'POST'])
+@query_budget(15)
 def consulta_list(request):
     persona, rol_obj, rol_string = get_user_role(request)
     
@@ -201,22 +208,34 @@ def consulta_list(request):
     
     if request.method == 'GET':
         if rol_string == 'paciente':
-            consultas = Consulta.objects.filter(fk_idpaciente=rol_obj).order_by('-fecha_inicio')
+            consultas = consultas_para_serializar().filter(fk_idpaciente=rol_obj)
         elif rol_string == 'medico':
-            consultas = Consulta.objects.all().order_by('-fecha_inicio')
+            consultas = consultas_para_serializar()
             rut_paciente = request.query_params.get('rut_paciente')
             if rut_paciente:
-                try:
-                    persona_paciente = Persona.objects.get(rut=rut_paciente)
-                    paciente = Paciente.objects.get(fk_rut=persona_paciente)
-                    consultas = consultas.filter(fk_idpaciente=paciente)
-                except (Persona.DoesNotExist, Paciente.DoesNotExist):
+                paciente_id = personas.pacientes_por_rut(rut_paciente).values_list('id', flat=True).first()
+                if paciente_id is None:
                     return Response({'error': 'Paciente no encontrado'}, status=status.HTTP_404_NOT_FOUND)
+                consultas = consultas.filter(fk_idpaciente_id=paciente_id)
         else:
             return Response({'error': 'Rol no reconocido'}, status=status.HTTP_400_BAD_REQUEST)
         
-        serializer = ConsultaSerializer(consultas, many=True)
-        return Response(serializer.data)
+        # Filtros y paginación por cursor en la base de datos (orden: -fecha_inicio, -id)
+        consultas = filtrar_consultas(consultas, request.query_params)
+        paginator = KeysetPagination()
+        paginator.extra_fields = CAMPOS_VALIDADOR
+        claves = paginator.paginate_claves(consultas, request)
+
+        # Si la página no cambió desde la copia del cliente, 304 sin cargar ni serializar las filas.
+        # Sólo ETag: la fecha más reciente de la página no cambia si una fila se borra o sale
+        # del filtro, e If-Modified-Since daría un 304 con la lista vieja
+        etag, _ = validadores(claves, paginator.next_cursor)
+        no_modificado = no_modificada(request, etag, None)
+        if no_modificado is not None:
+            return no_modificado
+
+        serializer = ConsultaSerializer(paginator.get_filas(consultas, claves), many=True)
+        return marcar(paginator.get_paginated_response(serializer.data), etag, None)
     
     elif request.method == 'POST':
         if rol_string != 'paciente':
@@ -232,11 +251,13 @@ def consulta_list(request):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 @api_view(['GET', 'PUT', 'DELETE'])
+@query_budget(14)
 def consulta_detail(request, pk):
-    try:
-        consulta = Consulta.objects.get(pk=pk)
-    except Consulta.DoesNotExist:
+    # Validadores primero: sólo columnas de la fila, sin JOIN ni prefetch
+    fila = Consulta.objects.filter(pk=pk).values_list('pk', 'fk_idpaciente_id', *CAMPOS_VALIDADOR).first()
+    if fila is None:
         return Response({'error': 'Consulta no encontrada'}, status=status.HTTP_404_NOT_FOUND)
+    etag, ultima = validadores([fila])
     
     # Para GET, permitimos que pacientes vean sus propias consultas
     if request.method == 'GET':
@@ -244,15 +265,20 @@ def consulta_detail(request, pk):
         
         # Si es paciente, solo puede ver sus propias consultas
         if rol_string == 'paciente':
-            if consulta.fk_idpaciente != rol_obj:
+            if fila[1] != rol_obj.id:
                 return Response({'error': 'No tienes permiso para acceder a esta consulta'}, status=status.HTTP_403_FORBIDDEN)
         # Los médicos pueden ver cualquier consulta
         elif rol_string != 'medico':
             # Si no está autenticado, permitimos ver la consulta de todas formas
             pass
         
-        serializer = ConsultaSerializer(consulta)
-        return Response(serializer.data)
+        # El cliente ya tiene esta versión: 304 sin cargar relaciones ni serializar
+        no_modificado = no_modificada(request, etag, ultima)
+        if no_modificado is not None:
+            return no_modificado
+        
+        serializer = ConsultaSerializer(consultas_para_serializar().get(pk=pk))
+        return marcar(Response(serializer.data), etag, ultima)
     
     # Para PUT y DELETE, se requiere autenticación
     persona, rol_obj, rol_string = get_user_role(request)
@@ -263,20 +289,33 @@ def consulta_detail(request, pk):
     # Verificar permisos según el rol
     if rol_string == 'paciente':
         # Un paciente solo puede modificar/eliminar sus propias consultas
-        if consulta.fk_idpaciente != rol_obj:
+        if fila[1] != rol_obj.id:
             return Response({'error': 'No tienes permiso para acceder a esta consulta'}, status=status.HTTP_403_FORBIDDEN)
     elif rol_string != 'medico':
         return Response({'error': 'Rol no reconocido'}, status=status.HTTP_400_BAD_REQUEST)
 
+    # If-Match con un ETag viejo: otro cambio llegó antes, 412 en vez de pisarlo
+    precondicion = no_modificada(request, etag, ultima)
+    if precondicion is not None:
+        return precondicion
+
     if request.method == 'PUT':
         # Solo pacientes pueden modificar (y solo sus propias consultas)
         if rol_string != 'paciente':
             return Response({'error': 'Solo los pacientes pueden modificar consultas'}, status=status.HTTP_403_FORBIDDEN)
         
+        consulta = consultas_para_serializar().get(pk=pk)
         serializer = ConsultaSerializer(consulta, data=request.data, partial=True)
         if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data)
+            inicio = serializer.validated_data.get('fecha_inicio', consulta.fecha_inicio)
+            try:
+                with transaction.atomic():
+                    # Una cita aceptada mueve su bloque en la agenda del especialista
+                    fin = consulta.fecha_fin if inicio == consulta.fecha_inicio else reprogramar(consulta, inicio)
+                    serializer.save(fecha_fin=fin)
+            except ConflictoAgenda as e:
+                return Response({'error': e.mensaje, 'conflicto': e.consulta_id}, status=status.HTTP_409_CONFLICT)
+            return marcar(Response(serializer.data), *validadores([(consulta.pk, consulta.version, consulta.actualizado)]))
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     elif request.method == 'DELETE':
@@ -284,10 +323,11 @@ def consulta_detail(request, pk):
         if rol_string != 'paciente':
             return Response({'error': 'Solo los pacientes pueden eliminar consultas'}, status=status.HTTP_403_FORBIDDEN)
         
-        consulta.delete()
+        Consulta.objects.filter(pk=pk).delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 @api_view(['POST', 'PUT'])
+@query_budget(14)
 def gestionar_cita_medico(request, pk):
     persona, rol_obj, rol_string = get_user_role(request)
     
@@ -297,17 +337,20 @@ def gestionar_cita_medico(request, pk):
     if rol_string != 'medico':
         return Response({'error': 'Solo los médicos pueden gestionar citas'}, status=status.HTTP_403_FORBIDDEN)
     
-    try:
-        consulta = Consulta.objects.get(pk=pk)
-    except Consulta.DoesNotExist:
-        return Response({'error': 'Consulta no encontrada'}, status=status.HTTP_404_NOT_FOUND)
-    
     accion = request.data.get('accion')
     
     if accion == 'aceptar':
-        consulta.estado = 'aceptada'
-        consulta.especialista_asignado = rol_obj
-        consulta.save()
+        try:
+            consulta = consultas_para_serializar().get(pk=pk)
+        except Consulta.DoesNotExist:
+            return Response({'error': 'Consulta no encontrada'}, status=status.HTTP_404_NOT_FOUND)
+
+        # Verifica que el especialista no tenga otra cita aceptada en ese horario
+        try:
+            reservar(consulta, rol_obj)
+        except ConflictoAgenda as e:
+            return Response({'error': e.mensaje, 'conflicto': e.consulta_id}, status=status.HTTP_409_CONFLICT)
+        publicar_cambio(consulta)
         serializer = ConsultaSerializer(consulta)
         return Response({'message': 'Cita aceptada', 'cita': serializer.data}, status=status.HTTP_200_OK)
     
@@ -315,23 +358,311 @@ def gestionar_cita_medico(request, pk):
         razon = request.data.get('razon')
         if not razon:
             return Response({'error': 'La razón de cancelación es requerida'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        consulta.estado = 'cancelada'
-        consulta.razon_cancelacion = razon
-        consulta.save()
-        serializer = ConsultaSerializer(consulta)
-        return Response({'message': 'Cita cancelada', 'cita': serializer.data}, status=status.HTTP_200_OK)
+        mensaje, campos = 'Cita cancelada', {'razon_cancelacion': razon}
     
     elif accion == 'aplazar':
-        consulta.estado = 'aplazada'
-        consulta.save()
-        serializer = ConsultaSerializer(consulta)
-        return Response({'message': 'Cita aplazada', 'cita': serializer.data}, status=status.HTTP_200_OK)
+        mensaje, campos = 'Cita aplazada', {}
     
     else:
         return Response({'error': 'Acción no reconocida. Use: aceptar, cancelar o aplazar'}, status=status.HTTP_400_BAD_REQUEST)
 
+    # Un solo UPDATE condicional; la fila se lee después, sólo para responder
+    try:
+        transicionar(pk, accion, **campos)
+    except TransicionRechazada as e:
+        return Response({'error': e.mensaje, 'estado': e.estado_actual}, status=e.status_code)
+    consulta = consultas_para_serializar().get(pk=pk)
+    publicar_cambio(consulta)
+    serializer = ConsultaSerializer(consulta)
+    return Response({'message': mensaje, 'cita': serializer.data}, status=status.HTTP_200_OK)
+
+@api_view(['GET'])
+def exportar_consultas(request):
+    """Descarga las consultas filtradas en CSV o NDJSON (médicos y administradores).
+
+    Mismos filtros que /api/consultas/ más rut_paciente; ?formato=csv|ndjson.
+    """
+    persona, rol_obj, rol_string = get_user_role(request)
+
+    if rol_string != 'medico' and not request.user.is_staff:
+        return Response({'error': 'Solo médicos y administradores pueden exportar consultas'}, status=status.HTTP_403_FORBIDDEN)
+
+    formato = request.query_params.get('formato', 'csv')
+    if formato not in FORMATOS:
+        return Response({'error': f'Formato no soportado. Use: {", ".join(FORMATOS)}'}, status=status.HTTP_400_BAD_REQUEST)
+
+    consultas = filtrar_consultas(Consulta.objects.all(), request.query_params)
+    rut_paciente = request.query_params.get('rut_paciente')
+    if rut_paciente:
+        paciente_id = personas.pacientes_por_rut(rut_paciente).values_list('id', flat=True).first()
+        consultas = consultas.filter(fk_idpaciente_id=paciente_id) if paciente_id else consultas.none()
+
+    # Las filas se leen mientras se envían: sin query_budget, las consultas ocurren después de retornar
+    respuesta = StreamingHttpResponse(exportar(consultas, formato), content_type=FORMATOS[formato])
+    respuesta['Content-Disposition'] = f'attachment; filename="consultas-{timezone.localtime():%Y%m%d-%H%M}.{formato}"'
+    return respuesta
+
+@api_view(['GET'])
+@query_budget(6)
+def sincronizar_consultas(request):
+    """Consultas cambiadas y eliminadas desde una marca: ?since=<cursor> o ?cursor=<cursor>&limite=
+
+    El paciente recibe las suyas y el médico todas. Mientras hay_mas sea true se sigue
+    con ?cursor=; el último cursor se guarda y se usa como ?since= la próxima vez.
+    """
+    persona, rol_obj, rol_string = get_user_role(request)
+
+    if not persona:
+        return Response({'error': 'Usuario no autenticado'}, status=status.HTTP_401_UNAUTHORIZED)
+
+    if rol_string not in ('paciente', 'medico'):
+        return Response({'error': 'Rol no reconocido'}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        limite = min(max(int(request.query_params.get('limite', LIMITE)), 1), LIMITE_MAXIMO)
+    except ValueError:
+        return Response({'error': 'limite debe ser un número'}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        cambiadas, eliminadas, cursor, hay_mas = cambios(
+            paciente=rol_obj if rol_string == 'paciente' else None,
+            since=request.query_params.get('since'),
+            cursor=request.query_params.get('cursor'),
+            limite=limite,
+        )
+    except MarcaVencida:
+        return Response(
+            {'error': 'La marca es demasiado antigua; sincronice desde cero (sin since)'},
+            status=status.HTTP_410_GONE,
+        )
+
+    # Una fila borrada entre las claves y la carga llega como lápida en la próxima página
+    filas = consultas_para_serializar().in_bulk(cambiadas) if cambiadas else {}
+    serializer = ConsultaSerializer([filas[pk] for pk in cambiadas if pk in filas], many=True)
+    return Response({
+        'cambios': serializer.data,
+        'eliminadas': eliminadas,
+        'cursor': cursor,
+        'hay_mas': hay_mas,
+    }, status=status.HTTP_200_OK)
+
+@api_view(['GET'])
+@query_budget(6)
+def buscar_consultas(request):
+    """Búsqueda de texto en motivo, síntomas y diagnóstico (médicos), de la más relevante a la menos.
+
+    ?q=fiebre tos&page_size= (máx 100); con next_cursor seguir con ?cursor=.
+    """
+    persona, rol_obj, rol_string = get_user_role(request)
+
+    if rol_string != 'medico':
+        return Response({'error': 'Solo médicos pueden buscar consultas'}, status=status.HTTP_403_FORBIDDEN)
+
+    texto = request.query_params.get('q', '')
+    if not busqueda.terminos(texto):
+        return Response({'error': 'Indique qué buscar en q'}, status=status.HTTP_400_BAD_REQUEST)
+
+    paginacion = KeysetPagination()
+    limite = paginacion.get_page_size(request)
+    despues_de = None
+    if request.query_params.get('cursor'):
+        despues_de = busqueda.decodificar_cursor(request.query_params['cursor'])
+
+    # Una fila más para saber si hay página siguiente
+    encontradas = busqueda.buscar(texto, limite + 1, despues_de)
+    pagina = encontradas[:limite]
+    filas = consultas_para_serializar().in_bulk([pk for pk, _ in pagina]) if pagina else {}
+    resultados = []
+    for pk, rango in pagina:
+        if pk in filas:
+            resultados.append(dict(ConsultaSerializer(filas[pk]).data, rango=rango))
+    siguiente = None
+    if len(encontradas) > limite:
+        ultima, rango = pagina[-1]
+        siguiente = busqueda.codificar_cursor(rango, ultima)
+    return Response({
+        'results': resultados,
+        'next_cursor': siguiente,
+    }, status=status.HTTP_200_OK)
+
+@api_view(['GET'])
+@query_budget(4)
+def buscar_personas(request):
+    """Personas por nombre o RUT mientras se escribe (médicos y administradores).
+
+    ?q= (mínimo 3 caracteres): "12.345", "123456789", "gonzalez mar"; ?limite= (máx 20).
+    """
+    persona, rol_obj, rol_string = get_user_role(request)
+
+    if rol_string != 'medico' and not request.user.is_staff:
+        return Response({'error': 'Solo médicos y administradores pueden buscar personas'}, status=status.HTTP_403_FORBIDDEN)
+
+    try:
+        limite = min(int(request.query_params.get('limite', personas.LIMITE)), personas.LIMITE_MAXIMO)
+    except ValueError:
+        return Response({'error': 'limite debe ser un número'}, status=status.HTTP_400_BAD_REQUEST)
+    if limite < 1:
+        return Response({'error': 'limite debe ser mayor que 0'}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response({'resultados': personas.buscar(request.query_params.get('q', ''), limite)}, status=status.HTTP_200_OK)
+
+@api_view(['GET'])
+@query_budget(3)
+def estadisticas_consultas(request):
+    """Totales diarios de consultas (médicos y administradores), leídos sólo de las tablas de resumen.
+
+    ?desde=YYYY-MM-DD&hasta=YYYY-MM-DD (por defecto los últimos 30 días, máximo 366)
+    ?por=especialidad,estado,... agrupa; especialidad=, estado=, especialista= filtran.
+    """
+    persona, rol_obj, rol_string = get_user_role(request)
+
+    if rol_string != 'medico' and not request.user.is_staff:
+        return Response({'error': 'Solo médicos y administradores pueden ver estadísticas'}, status=status.HTTP_403_FORBIDDEN)
+
+    hasta = timezone.localdate()
+    if request.query_params.get('hasta'):
+        hasta = timezone.localdate(parse_fecha(request.query_params['hasta'], 'hasta'))
+    desde = hasta - timedelta(days=29)
+    if request.query_params.get('desde'):
+        desde = timezone.localdate(parse_fecha(request.query_params['desde'], 'desde'))
+    if desde > hasta or (hasta - desde).days >= 366:
+        return Response({'error': 'El rango debe ir de desde a hasta y cubrir a lo más 366 días'}, status=status.HTTP_400_BAD_REQUEST)
+
+    por = [p for p in request.query_params.get('por', '').split(',') if p]
+    desconocidas = [p for p in por if p not in AGRUPACIONES]
+    if desconocidas:
+        return Response({'error': f'No se puede agrupar por {", ".join(desconocidas)}. Use: {", ".join(AGRUPACIONES)}'}, status=status.HTTP_400_BAD_REQUEST)
+
+    filtros = {}
+    for parametro in ('especialidad', 'estado'):
+        if request.query_params.get(parametro):
+            filtros[parametro] = request.query_params[parametro]
+    if request.query_params.get('especialista'):
+        try:
+            filtros['especialista_id'] = int(request.query_params['especialista'])
+        except ValueError:
+            return Response({'error': 'especialista debe ser un número'}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response({
+        'desde': desde,
+        'hasta': hasta,
+        'por': por,
+        'resultados': resumen(desde, hasta, por, **filtros),
+    }, status=status.HTTP_200_OK)
+
+@api_view(['GET', 'POST'])
+@query_budget(10)
+def seguimiento_lecturas(request):
+    """Lecturas de dispositivos y apps de seguimiento (webEmergencia/seguimiento.py).
+
+    POST: lote como arreglo JSON, {"lecturas": [...]} o NDJSON (Content-Type: application/x-ndjson).
+    El paciente envía las suyas; el médico indica el rut en cada lectura.
+    GET: ?desde=&hasta= (por defecto los últimos 7 días), dispositivo=, puntos=; el médico indica ?rut=.
+    """
+    persona, rol_obj, rol_string = get_user_role(request)
+
+    if not persona:
+        return Response({'error': 'Usuario no autenticado'}, status=status.HTTP_401_UNAUTHORIZED)
+
+    if rol_string not in ('paciente', 'medico'):
+        return Response({'error': 'Rol no reconocido'}, status=status.HTTP_400_BAD_REQUEST)
+
+    paciente_id = rol_obj.id if rol_string == 'paciente' else None
+
+    if request.method == 'POST':
+        try:
+            if request.content_type.split(';')[0].strip() in ('application/x-ndjson', 'application/jsonl'):
+                lecturas = seguimiento.leer_lote(cuerpo=request.body)
+            else:
+                lecturas = seguimiento.leer_lote(datos=request.data)
+        except seguimiento.LoteInvalido as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        validas, rechazadas, repetidas = seguimiento.validar(lecturas, paciente_id)
+        if not validas:
+            return Response({'error': 'Ninguna lectura es válida', 'rechazadas': rechazadas}, status=status.HTTP_400_BAD_REQUEST)
+        insertadas = seguimiento.guardar(validas)
+        return Response({
+            'recibidas': len(lecturas),
+            'insertadas': insertadas,
+            'duplicadas': repetidas + len(validas) - insertadas,
+            'rechazadas': rechazadas,
+        }, status=status.HTTP_201_CREATED if insertadas else status.HTTP_200_OK)
+
+    if paciente_id is None:
+        rut = request.query_params.get('rut')
+        if not rut:
+            return Response({'error': 'Indique el rut del paciente'}, status=status.HTTP_400_BAD_REQUEST)
+        paciente_id = Paciente.objects.filter(fk_rut_id=rut).values_list('id', flat=True).first()
+        if paciente_id is None:
+            return Response({'error': 'Paciente no encontrado'}, status=status.HTTP_404_NOT_FOUND)
+
+    hasta = timezone.now()
+    if request.query_params.get('hasta'):
+        hasta = parse_fecha(request.query_params['hasta'], 'hasta', fin_de_dia=True)
+    desde = hasta - timedelta(days=7)
+    if request.query_params.get('desde'):
+        desde = parse_fecha(request.query_params['desde'], 'desde')
+    if desde >= hasta:
+        return Response({'error': 'desde debe ser anterior a hasta'}, status=status.HTTP_400_BAD_REQUEST)
+
+    maximo = getattr(settings, 'SEGUIMIENTO_PUNTOS_MAXIMO', seguimiento.PUNTOS_MAXIMO)
+    try:
+        puntos = min(max(int(request.query_params.get('puntos', seguimiento.PUNTOS)), 1), maximo)
+    except ValueError:
+        return Response({'error': 'puntos debe ser un número'}, status=status.HTTP_400_BAD_REQUEST)
+
+    total, intervalo, lecturas = seguimiento.consultar(
+        paciente_id, desde, hasta, dispositivo=request.query_params.get('dispositivo'), puntos=puntos,
+    )
+    return Response({
+        'desde': desde,
+        'hasta': hasta,
+        'total': total,
+        'intervalo': intervalo,
+        'lecturas': lecturas,
+    }, status=status.HTTP_200_OK)
+
+@api_view(['POST'])
+@query_budget(16)
+def siguiente_paciente(request):
+    """El médico toma la próxima consulta pendiente de su especialidad (cola sin contención)"""
+    persona, rol_obj, rol_string = get_user_role(request)
+
+    if not persona:
+        return Response({'error': 'Usuario no autenticado'}, status=status.HTTP_401_UNAUTHORIZED)
+
+    if rol_string != 'medico':
+        return Response({'error': 'Solo los médicos pueden tomar pacientes'}, status=status.HTTP_403_FORBIDDEN)
+
+    consulta = tomar_siguiente(rol_obj)
+    if consulta is None:
+        return Response({'message': 'No hay consultas pendientes en tu especialidad', 'cita': None}, status=status.HTTP_200_OK)
+
+    serializer = ConsultaSerializer(consultas_para_serializar().get(pk=consulta.pk))
+    return Response({'message': 'Paciente asignado', 'cita': serializer.data}, status=status.HTTP_200_OK)
+
 @api_view(['GET'])
+@query_budget(9)
+def cupos_disponibles(request):
+    """Próximos cupos libres de una especialidad: ?especialidad=Cardiología&n=5&desde=YYYY-MM-DD"""
+    especialidad = request.GET.get('especialidad')
+    if not especialidad:
+        return Response({'error': 'El parámetro especialidad es requerido'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        cantidad = min(max(int(request.GET.get('n', 5)), 1), 50)
+    except ValueError:
+        return Response({'error': 'n debe ser un número'}, status=status.HTTP_400_BAD_REQUEST)
+
+    desde = timezone.now()
+    if request.GET.get('desde'):
+        desde = max(desde, parse_fecha(request.GET['desde'], 'desde'))
+
+    cupos = cupos_libres(especialidad, cantidad=cantidad, desde=desde)
+    return Response({'especialidad': especialidad, 'cupos': cupos}, status=status.HTTP_200_OK)
+
+@api_view(['GET'])
+@query_budget(4)
 def ver_perfil_paciente(request, rut_paciente):
     persona, rol_obj, rol_string = get_user_role(request)
     
@@ -341,14 +672,14 @@ def ver_perfil_paciente(request, rut_paciente):
     if rol_string != 'medico':
         return Response({'error': 'Solo los médicos pueden ver perfiles de pacientes'}, status=status.HTTP_403_FORBIDDEN)
     
-    try:
-        persona_paciente = Persona.objects.get(rut=rut_paciente)
-        paciente = Paciente.objects.get(fk_rut=persona_paciente)
-    except (Persona.DoesNotExist, Paciente.DoesNotExist):
+    # Acepta el RUT con o sin puntos, guion o dígito verificador
+    paciente = personas.pacientes_por_rut(rut_paciente).select_related('fk_rut').first()
+    if paciente is None:
         return Response({'error': 'Paciente no encontrado'}, status=status.HTTP_404_NOT_FOUND)
+    persona_paciente = paciente.fk_rut
     
     # Obtener citas del paciente
-    citas = Consulta.objects.filter(fk_idpaciente=paciente).order_by('-fecha_inicio')
+    citas = consultas_para_serializar().filter(fk_idpaciente=paciente).order_by('-fecha_inicio')
     
     data = {
         'persona': {
@@ -368,6 +699,7 @@ def ver_perfil_paciente(request, rut_paciente):
     
     return Response(data, status=status.HTTP_200_OK)
 
+@query_budget(6)
 def listar_consultas_medico(request):
     persona, rol_obj, rol_string = get_user_role(request)
     
@@ -377,13 +709,25 @@ def listar_consultas_medico(request):
     if rol_string != 'medico':
         return redirect('index')
     
-    # Obtener todas las consultas
-    consultas = Consulta.objects.all().order_by('-fecha_inicio')
+    # Antes de leer las consultas: todo evento con id menor o igual ya está reflejado en la tabla
+    evento_id = ultimo_evento_id()
+    
+    # Obtener todas las consultas (con paciente y persona en el mismo JOIN)
+    consultas = Consulta.objects.select_related('fk_idpaciente__fk_rut').order_by('-fecha_inicio')
     
     # Filtrar por RUT si se proporciona
     rut_filtro = request.GET.get('rut', '')
+    paciente_id = None
     if rut_filtro:
-        consultas = consultas.filter(fk_idpaciente__fk_rut__rut=rut_filtro)
+        paciente_id = personas.pacientes_por_rut(rut_filtro).values_list('id', flat=True).first()
+        consultas = consultas.filter(fk_idpaciente_id=paciente_id) if paciente_id else consultas.none()
+    
+    # Búsqueda de texto: las más relevantes primero (ver busqueda.py), ya dentro del paciente filtrado
+    texto = request.GET.get('q', '').strip()
+    if texto:
+        encontradas = busqueda.buscar(texto, RESULTADOS_BUSQUEDA, paciente_id=paciente_id)
+        orden = {pk: posicion for posicion, (pk, _) in enumerate(encontradas)}
+        consultas = sorted(consultas.filter(pk__in=orden), key=lambda consulta: orden[consulta.pk])
     
     # Preparar datos para mostrar
     consultas_data = []
@@ -401,11 +745,15 @@ def listar_consultas_medico(request):
     
     context = {
         'consultas': consultas_data,
-        'rut_filtro': rut_filtro
+        'rut_filtro': rut_filtro,
+        'texto_busqueda': texto,
+        # La página se suscribe a los cambios posteriores a este evento
+        'ultimo_evento_id': evento_id,
     }
     
     return render(request, 'webEmergencia/listar_consultas_medico.html', context)
 
+@query_budget(4)
 def listar_pacientes(request):
     persona, rol_obj, rol_string = get_user_role(request)
     
@@ -415,16 +763,15 @@ def listar_pacientes(request):
     if rol_string != 'medico':
         return redirect('index')
     
-    # Obtener todos los pacientes
-    pacientes = Paciente.objects.all().order_by('fk_rut__apellido', 'fk_rut__nombre')
+    # Pacientes con su resumen de consultas, buscados y paginados en la base de datos
+    busqueda = request.GET.get('q', '').strip()
+    paginator = Paginator(pacientes_con_resumen(busqueda), PACIENTES_POR_PAGINA)
+    page_obj = paginator.get_page(request.GET.get('page'))
     
     # Preparar datos para mostrar
     pacientes_data = []
-    for paciente in pacientes:
+    for paciente in page_obj:
         persona_data = paciente.fk_rut
-        # Contar consultas del paciente
-        num_consultas = Consulta.objects.filter(fk_idpaciente=paciente).count()
-        
         pacientes_data.append({
             'id': paciente.id,
             'rut': persona_data.rut,
@@ -434,48 +781,35 @@ def listar_pacientes(request):
             'telefono': paciente.telefono,
             'direccion': paciente.direccion,
             'fecha_nacimiento': paciente.fecha_nacimiento,
-            'num_consultas': num_consultas
+            'num_consultas': paciente.num_consultas,
+            'ultima_visita': paciente.ultima_visita,
+            'citas_abiertas': paciente.citas_abiertas
         })
     
     context = {
-        'pacientes': pacientes_data
+        'pacientes': pacientes_data,
+        'page_obj': page_obj,
+        'total_pacientes': paginator.count,
+        'busqueda': busqueda
     }
     
     return render(request, 'webEmergencia/listar_pacientes.html', context)
 
+@query_budget(4)
 def mis_documentos(request):
     rut = request.session.get('user_rut')
     if not rut:
         messages.error(request, 'Debe iniciar sesión para ver sus documentos.')
         return redirect('index')
     
-    try:
-        persona = Persona.objects.get(rut=rut)
-        paciente = Paciente.objects.get(fk_rut=persona)
-    except (Persona.DoesNotExist, Paciente.DoesNotExist):
+    principal = request.principal
+    persona, paciente = principal.persona, principal.paciente
+    if persona is None or paciente is None:
         messages.error(request, 'Error al obtener los datos del paciente.')
         return redirect('index')
     
-    # Obtener todas las consultas finalizadas del paciente con diagnóstico
-    consultas_finalizadas = Consulta.objects.filter(
-        fk_idpaciente=paciente,
-        estado='finalizada',
-        diagnostico_data__isnull=False
-    ).order_by('-fecha_inicio').select_related('diagnostico_data')
-    
-    # Preparar datos con diagnósticos y recetas
-    documentos = []
-    for consulta in consultas_finalizadas:
-        if hasattr(consulta, 'diagnostico_data'):
-            diagnostico = consulta.diagnostico_data
-            documentos.append({
-                'consulta_id': consulta.id,
-                'consulta_fecha': consulta.fecha_inicio,
-                'consulta_motivo': consulta.motivo,
-                'consulta_especialidad': consulta.especialidad,
-                'diagnostico': diagnostico,
-                'recetas': diagnostico.recetas.all()
-            })
+    # Consultas finalizadas con diagnóstico; cada documento sale del caché (ver documentos.py)
+    documentos = documentos_de(paciente)
     
     context = {
         'persona': persona,
@@ -485,120 +819,127 @@ def mis_documentos(request):
     
     return render(request, 'webEmergencia/mis_documentos.html', context)
 
+def _especialista_que_finaliza(request):
+    """(especialista, None) o (None, Response de error)"""
+    if not request.session.get('user_rut'):
+        return None, Response({'error': 'Usuario no autenticado'}, status=status.HTTP_401_UNAUTHORIZED)
+    especialista = request.principal.especialista
+    if especialista is None:
+        return None, Response({'error': 'Solo especialistas pueden finalizar consultas'}, status=status.HTTP_403_FORBIDDEN)
+    return especialista, None
+
+
 @api_view(['POST'])
+@query_budget(30)
 def finalizar_consulta_view(request, pk):
+    especialista, error = _especialista_que_finaliza(request)
+    if error:
+        return error
 
-    # 1. Validaciones: Obtener usuario desde request.session['rut']
-    rut = request.session.get('user_rut')
-    if not rut:
-        return Response({'error': 'Usuario no autenticado'}, status=status.HTTP_401_UNAUTHORIZED)
-    
-    try:
-        persona_especialista = Persona.objects.get(rut=rut)
-        especialista = Especialista.objects.get(fk_rutp=persona_especialista)
-    except (Persona.DoesNotExist, Especialista.DoesNotExist):
-        return Response({'error': 'Solo especialistas pueden finalizar consultas'}, status=status.HTTP_403_FORBIDDEN)
-    
-    # 2. Obtener la consulta por pk
-    try:
-        consulta = Consulta.objects.get(pk=pk)
-    except Consulta.DoesNotExist:
-        return Response({'error': 'Consulta no encontrada'}, status=status.HTTP_404_NOT_FOUND)
-    
-    # 3. Verificar que pertenezca a ese especialista
-    if consulta.especialista_asignado != especialista:
-        return Response({'error': 'No tienes permiso para finalizar esta consulta'}, status=status.HTTP_403_FORBIDDEN)
-    
-    # 4. Verificar que el estado actual sea 'aceptada'
-    if consulta.estado != 'aceptada':
-        return Response({'error': f'La consulta debe estar en estado "aceptada", estado actual: {consulta.estado}'}, status=status.HTTP_400_BAD_REQUEST)
-    
     try:
-        with transaction.atomic():
-            descripcion = request.data.get('descripcion')
-            es_cronico = request.data.get('es_cronico', False)
-            nombre_enfermedad = request.data.get('nombre_enfermedad', None)
-            
-            if not descripcion:
-                return Response({'error': 'La descripción del diagnóstico es requerida'}, status=status.HTTP_400_BAD_REQUEST)
-            
-            diagnostico = Diagnostico.objects.create(
-                consulta=consulta,
-                descripcion=descripcion,
-                es_cronico=es_cronico,
-                nombre_enfermedad=nombre_enfermedad if es_cronico else None
-            )
-            
-            recetas_data = request.data.get('recetas', [])
-            if not isinstance(recetas_data, list):
-                return Response({'error': 'Las recetas deben ser una lista'}, status=status.HTTP_400_BAD_REQUEST)
-            
-            for receta_item in recetas_data:
-                medicamento = receta_item.get('medicamento')
-                dosis = receta_item.get('dosis')
-                horario = receta_item.get('horario')
-                
-                if not all([medicamento, dosis, horario]):
-                    return Response({'error': 'Cada receta debe tener medicamento, dosis y horario'}, status=status.HTTP_400_BAD_REQUEST)
-                
-                Receta.objects.create(
-                    diagnostico=diagnostico,
-                    medicamento=medicamento,
-                    dosis=dosis,
-                    horario=horario
-                )
-            
-            if es_cronico and nombre_enfermedad:
-                fecha_seguimiento = consulta.fecha_inicio + timedelta(days=7)
-                
-                Consulta.objects.create(
-                    fk_idpaciente=consulta.fk_idpaciente,
-                    fk_idespecialista=consulta.fk_idespecialista,
-                    especialista_asignado=especialista,
-                    motivo=f"Control Crónico: {nombre_enfermedad}",
-                    especialidad=consulta.especialidad,
-                    fecha_inicio=fecha_seguimiento,
-                    estado='aceptada'
-                )
-            
-            consulta.estado = 'finalizada'
-            consulta.save()
-            
-            serializer = ConsultaSerializer(consulta)
-            return Response({
-                'message': 'Consulta finalizada exitosamente',
-                'cita': serializer.data,
-                'diagnostico': DiagnosticoSerializer(diagnostico).data
-            }, status=status.HTTP_200_OK)
-    
+        # Paciente y especialista por JOIN para ConsultaSerializer (el diagnóstico todavía no existe)
+        consultas = Consulta.objects.select_related('fk_idpaciente__fk_rut', 'especialista_asignado__fk_rutp')
+        [resultado] = finalizar_consultas(especialista, [(pk, request.data)], queryset=consultas)
+    except ErrorFinalizacion as e:
+        return Response({'error': e.mensaje}, status=e.status_code)
     except Exception as e:
         return Response({'error': f'Error al finalizar la consulta: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    if isinstance(resultado, ErrorFinalizacion):
+        return Response({'error': resultado.mensaje}, status=resultado.status_code)
+
+    consulta, diagnostico = resultado
+    return Response({
+        'message': 'Consulta finalizada exitosamente',
+        'cita': ConsultaSerializer(consulta).data,
+        'diagnostico': DiagnosticoSerializer(diagnostico).data
+    }, status=status.HTTP_200_OK)
+
+
+@api_view(['POST'])
+@query_budget(30)
+def finalizar_consultas_lote(request):
+    """Finaliza muchas consultas en una transacción (cierre de turno).
+
+    Body: {"consultas": [{"id": 1, "descripcion": ..., "es_cronico": ..., "recetas": [...]}, ...]}
+    Responde un resultado por ítem; los ítems con error no impiden finalizar los demás.
+    """
+    especialista, error = _especialista_que_finaliza(request)
+    if error:
+        return error
+
+    items = request.data.get('consultas')
+    if not isinstance(items, list) or not items:
+        return Response({'error': 'Se requiere una lista "consultas"'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(items) > MAX_LOTE:
+        return Response({'error': f'Máximo {MAX_LOTE} consultas por lote'}, status=status.HTTP_400_BAD_REQUEST)
+
+    pares = []
+    for item in items:
+        item = item if isinstance(item, dict) else {}
+        pk = item.get('id')
+        pares.append((pk if isinstance(pk, int) and not isinstance(pk, bool) else None, item))
+
+    try:
+        resultados = finalizar_consultas(especialista, pares)
+    except ErrorFinalizacion as e:
+        return Response({'error': e.mensaje}, status=e.status_code)
+    except Exception as e:
+        return Response({'error': f'Error al finalizar las consultas: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    respuesta = []
+    for (pk, _), resultado in zip(pares, resultados):
+        if isinstance(resultado, ErrorFinalizacion):
+            respuesta.append({'id': pk, 'ok': False, 'status': resultado.status_code, 'error': resultado.mensaje})
+        else:
+            consulta, diagnostico = resultado
+            respuesta.append({'id': pk, 'ok': True, 'estado': consulta.estado, 'diagnostico_id': diagnostico.id})
+
+    finalizadas = sum(1 for r in respuesta if r['ok'])
+    return Response({
+        'finalizadas': finalizadas,
+        'errores': len(respuesta) - finalizadas,
+        'resultados': respuesta,
+    }, status=status.HTTP_200_OK)
+
 def buscar_medicamentos_api(request):
     query = request.GET.get('q', '')
     
     if not query or len(query) < 2:
         return JsonResponse([], safe=False)
 
-    try:
-        url = f"https://api.fda.gov/drug/label.json?search=openfda.brand_name:{query}*&limit=10"
-        response = requests.get(url, timeout=5)
-        
-        if response.status_code != 200:
-            return JsonResponse([], safe=False)
-            
-        data = response.json()
-        resultados = []
-        
-        if 'results' in data:
-            for item in data['results']:
-                if 'openfda' in item and 'brand_name' in item['openfda']:
-                    for brand in item['openfda']['brand_name']:
-                        if brand not in resultados:
-                            resultados.append(brand)
-        
-        return JsonResponse(resultados[:10], safe=False)
+    # Catálogo local (índice de prefijos en memoria compartida): sin red
+    if not catalogo.vacio():
+        return JsonResponse(catalogo.buscar(query, limite=10), safe=False)
 
-    except Exception as e:
-        print(f"Error en OpenFDA: {e}")
-        return JsonResponse([], safe=False)
\ No newline at end of file
+    # Sin catálogo importado todavía: consultar OpenFDA si está permitido
+    if not getattr(settings, 'MEDICAMENTOS_OPENFDA_FALLBACK', True):
+        return JsonResponse([], safe=False)
+    # Caché por prefijo con coalescing: 'ibu', 'ibup', 'ibupr'... no repiten la llamada
+    return JsonResponse(get_cache_medicamentos().buscar(query, limite=10), safe=False)
+
+def eventos_consultas(request):
+    """Server-Sent Events con los cambios de estado de las consultas (versión WSGI).
+
+    Devuelve los eventos pendientes y cierra; el navegador se reconecta tras `retry`
+    con Last-Event-ID. Bajo ASGI se usa async_views.eventos_consultas, que mantiene
+    la conexión abierta.
+    """
+    if not request.principal.es_especialista:
+        return JsonResponse({'error': 'Solo los médicos pueden recibir eventos de consultas'}, status=403)
+
+    desde = desde_request(request)
+    partes = [f"retry: {getattr(settings, 'EVENTOS_SSE_RETRY_MS', 3000)}\n\n"]
+    if desde is None:
+        partes.append(formatear_cursor(ultimo_evento_id()))
+    else:
+        # Sin estado entre peticiones: el solape se reenvía y el navegador descarta lo que ya aplicó
+        eventos = eventos_despues_de(desde)
+        cursor = max([desde] + [evento['id'] for evento in eventos])
+        partes.extend(formatear(evento, cursor) for evento in eventos)
+        if not eventos:
+            partes.append(formatear_cursor(desde))
+
+    response = HttpResponse(''.join(partes), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    return response